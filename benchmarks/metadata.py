@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+Compare the fast header reader with wavinfo on the test samples.
+
+Run from the root of the repository:
+    python benchmarks/metadata.py [DIRECTORY] [--repeat N]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from wavinfo import WavInfoReader
+from mixpresplit import wav
+from mixpresplit.cli import get_wavs_files
+
+
+def measure(reader, paths: [str], repeat: int) -> float:
+    """
+    Return the best time in seconds it took the reader to read all paths
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            reader(path)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", nargs="?", default="./testsamples/channeltests")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    paths = sorted(get_wavs_files(args.directory))
+    readers = [("wavinfo", WavInfoReader), ("native", wav.read_header)]
+
+    print("Reading {} files, best of {} runs".format(len(paths), args.repeat))
+    results = {}
+    for name, reader in readers:
+        results[name] = measure(reader, paths, args.repeat)
+        print("{:<10} {:>8.2f} ms  {:>8.1f} us/file".format(name, results[name] * 1000, results[name] / len(paths) * 1e6))
+    print("Speedup:   {:>8.1f}x".format(results["wavinfo"] / results["native"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+Measure how long it takes mixpresplit to start: importing the CLI, "-h"
+and a dry run of the test samples, each in a fresh interpreter.
+
+Modules that only some runs need (wavinfo, ffmpeg handling, the FLAC
+encoders, checksums and worker pools) have to be imported where they are
+used. The benchmark exits with 1 if one of them is imported by the CLI
+module or if the import takes longer than the budget.
+
+Run from the root of the repository:
+    python benchmarks/startup.py [--repeat N] [--budget MS] [--top N]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Milliseconds the import of mixpresplit.cli may take (without the interpreter)
+IMPORT_BUDGET_MS = 100.0
+
+# Modules that must not be imported just to start the CLI
+HEAVY_MODULES = ["wavinfo", "lxml", "numpy", "subprocess", "concurrent.futures", "asyncio", "hashlib", "tempfile", "xml.etree.ElementTree", "mixpresplit.flac", "mixpresplit.verify", "mixpresplit.api"]
+
+
+def python(args: [str]) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable] + args, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def import_times() -> {str: (int, int)}:
+    """
+    Return the (self, cumulative) microseconds of each module imported
+    with mixpresplit.cli
+    """
+    result = python(["-X", "importtime", "-c", "import mixpresplit.cli"])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line.split(":", 1)[1].split("|")
+        if own.strip().isdigit():
+            times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def wall_time(args: [str]) -> float:
+    """
+    Return the seconds a fresh interpreter needs to run mixpresplit with args
+    """
+    start = time.perf_counter()
+    result = python(["-m", "mixpresplit.cli"] + args)
+    duration = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError("mixpresplit {} failed:\n{}".format(" ".join(args), result.stderr))
+    return duration
+
+
+def heavy_modules() -> [str]:
+    """
+    Return the heavy modules that are loaded by importing mixpresplit.cli
+    """
+    code = "import sys, mixpresplit.cli; print(' '.join(m for m in {!r} if m in sys.modules))".format(HEAVY_MODULES)
+    return python(["-c", code]).stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_MS, help="Milliseconds the import may take (default: {})".format(IMPORT_BUDGET_MS))
+    parser.add_argument("--top", type=int, default=10, help="Number of the slowest imports to list")
+    parser.add_argument("--samples", default="./testsamples/channeltests")
+    args = parser.parse_args()
+
+    # Compile first, so no run pays for it
+    python(["-m", "compileall", "-q", "mixpresplit"])
+
+    best = None
+    for _ in range(args.repeat):
+        times = import_times()
+        if best is None or times["mixpresplit.cli"][1] < best["mixpresplit.cli"][1]:
+            best = times
+    import_ms = best["mixpresplit.cli"][1] / 1000
+    print("Best of {} runs".format(args.repeat))
+    print("{:<24} {:>8.1f} ms".format("import mixpresplit.cli", import_ms))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cases = [("-h", ["-h"]), ("--dry-run", [args.samples, os.path.join(workdir, "{take}-{tracknumber}"), "--dry-run", "--no-cache", "--no-preflight"])]
+        for name, case_args in cases:
+            seconds = min(wall_time(case_args) for _ in range(args.repeat))
+            print("{:<24} {:>8.1f} ms".format("mixpresplit " + name, seconds * 1000))
+
+    print("\nSlowest imports (self time):")
+    for name, (own, cumulative) in sorted(best.items(), key=lambda item: -item[1][0])[:args.top]:
+        print("    {:>8.1f} ms  {:>8.1f} ms cumulative  {}".format(own / 1000, cumulative / 1000, name))
+
+    failed = False
+    loaded = heavy_modules()
+    if loaded:
+        print("\nRegression: importing the CLI loads {}".format(", ".join(loaded)))
+        failed = True
+    if import_ms > args.budget:
+        print("\nRegression: the import took {:.1f} ms, the budget is {:.1f} ms".format(import_ms, args.budget))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+Measure the throughput of scanning, filtering and splitting on synthetic
+MixPre-like polywavs (with bext and iXML) of a chosen layout.
+
+Each case runs in a fresh process, so the peak RSS is the one of the case
+(including ffmpeg for the ffmpeg based splits). Results can be stored as
+JSON and compared with the results of another commit.
+
+Run from the root of the repository:
+    python benchmarks/throughput.py [--channels N] [--bits 32] [--seconds S]
+                                    [--files N] [--repeat N] [--cases a,b]
+                                    [--json RESULTS] [--compare BASELINE]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mixpresplit import api, cli, wav
+from mixpresplit.discover import discover
+from mixpresplit.filters import compile_filter
+from mixpresplit.table import TakeTable
+from tests.polywav import write_polywav
+
+
+# Options of the split cases on top of BASE_OPTIONS
+SPLIT_CASES = {
+    "split-native" : {"native": True},
+    "split-native-stats" : {"native": True, "stats": True},
+    "split-wav" : {},
+    "split-single-pass" : {"single-pass": True},
+    "split-24" : {"24": True},
+    "split-16" : {"16": True},
+    "split-flac" : {"flac": True},
+    "split-native-flac" : {"native": True, "flac": True},
+}
+
+# Cases that run in-process only and don't need ffmpeg
+PYTHON_CASES = ["discover", "read-metadata", "filter-takes", "filter-tracks", "table-select", "expand-outpath", "plan-outputs"]
+
+# Cases that read all of the audio in-process
+ANALYSIS_CASES = ["channel-levels"]
+
+# The defaults of the command line tool, with outputs that may be replaced
+BASE_OPTIONS = api.make_options(overwrite=True, rewrite=True, cache=False, flac_encoders=4)
+
+# Filters and OUTPATH used by the in-process cases
+TAKE_FILTER = "1-3,!2,all"
+TRACK_FILTER = "1-4,!2,mixdown,Track"
+OUTPATH = "out/{date}/{scene}/{take}/{hour}-{min}-{sec}_{tracknumber}_{trackname}"
+
+# Number of times the fast in-process cases are repeated within one measurement
+INNER_LOOPS = 1000
+
+# Number of times all files are read by the read-metadata case
+METADATA_LOOPS = 100
+
+# Allowed slowdown before --compare reports a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+def peak_rss() -> int:
+    """
+    Return the peak resident set size of this process and its finished
+    children in bytes (0 where the resource module is not available)
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def generate(directory: str, files: int, channels: int, bits: int, seconds: float, samplerate: int) -> [str]:
+    paths = []
+    for n in range(files):
+        path = os.path.join(directory, "{:03d}.WAV".format(n + 1))
+        paths.append(write_polywav(path, channels=channels, frames=int(seconds * samplerate), bits=bits, samplerate=samplerate, take=n + 1))
+    return paths
+
+
+def run_case(case: str, paths: [str], workdir: str) -> dict:
+    """
+    Run a single case once and return its duration and peak RSS. This is
+    the entry point of the worker process.
+    """
+    options = dict(BASE_OPTIONS, **SPLIT_CASES.get(case, {}))
+    metas = [cli.read_metadata(p) for p in paths]
+    tracks = [track for meta in metas for track in meta.tracks.values()]
+    outdir = os.path.join(workdir, "out")
+    shutil.rmtree(outdir, ignore_errors=True)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        if case == "discover":
+            for _ in range(METADATA_LOOPS):
+                list(discover([os.path.dirname(paths[0])]))
+        elif case == "read-metadata":
+            for _ in range(METADATA_LOOPS):
+                for path in paths:
+                    cli.read_metadata(path)
+        elif case == "filter-takes":
+            options["takes"] = TAKE_FILTER
+            for _ in range(INNER_LOOPS):
+                cli.filter_takes(metas, options)
+        elif case == "filter-tracks":
+            options["tracks"] = TRACK_FILTER
+            for _ in range(INNER_LOOPS):
+                for track in tracks:
+                    cli.filter_tracks(track, options)
+        elif case == "table-select":
+            table = TakeTable.from_metas(metas)
+            for _ in range(INNER_LOOPS):
+                table.rows(compile_filter(TAKE_FILTER), track_filter=compile_filter(TRACK_FILTER))
+        elif case == "expand-outpath":
+            for _ in range(INNER_LOOPS):
+                for meta in metas:
+                    for channel in meta.tracks.keys():
+                        cli.expand_outpath(OUTPATH, meta, channel)
+        elif case == "plan-outputs":
+            for _ in range(INNER_LOOPS):
+                for meta in metas:
+                    cli.plan_outputs(meta, OUTPATH, options)
+        elif case == "channel-levels":
+            for meta in metas:
+                wav.channel_levels(meta.filepath, meta.codec)
+        else:
+            for meta in metas:
+                cli.process_files(meta, os.path.join(outdir, "{take}-{tracknumber}"), options)
+        duration = time.perf_counter() - start
+
+    return {"seconds": duration, "peak_rss": peak_rss()}
+
+
+def measure(case: str, paths: [str], workdir: str, repeat: int) -> dict:
+    """
+    Return the best duration and the highest peak RSS of repeat runs,
+    each in a fresh process
+    """
+    context = multiprocessing.get_context("spawn")
+    best = None
+    rss = 0
+    for _ in range(repeat):
+        with context.Pool(1) as pool:
+            result = pool.apply(run_case, (case, paths, workdir))
+        best = result["seconds"] if best is None else min(best, result["seconds"])
+        rss = max(rss, result["peak_rss"])
+    return {"seconds": best, "peak_rss": rss}
+
+
+def describe(case: str, result: dict, source_bytes: int, audio_seconds: float, calls: int) -> dict:
+    """
+    Add the derived figures to a result: MB/s and realtime factor for the
+    cases that split audio, microseconds per call for the others
+    """
+    seconds = result["seconds"]
+    if case in PYTHON_CASES:
+        result["us_per_call"] = seconds / calls * 1e6
+    else:
+        result["mb_per_s"] = source_bytes / 1e6 / seconds
+        result["realtime"] = audio_seconds / seconds
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_result(case: str, result: dict) -> str:
+    if "us_per_call" in result:
+        figures = "{:>10.2f} us/call".format(result["us_per_call"])
+    else:
+        figures = "{:>8.1f} MB/s {:>8.1f}x realtime".format(result["mb_per_s"], result["realtime"])
+    return "{:<18} {:>9.3f} s  {}  {:>8.1f} MB peak RSS".format(case, result["seconds"], figures, result["peak_rss"] / 2**20)
+
+
+def compare(results: dict, baseline: dict, threshold: float=REGRESSION_THRESHOLD) -> bool:
+    """
+    Print the change of each case against a baseline and return True if
+    any case got slower than the threshold allows
+    """
+    if baseline.get("parameters") != results["parameters"]:
+        print("Warning: the baseline was measured with other parameters, the results are not comparable")
+    print("\nCompared to {}:".format(baseline.get("commit") or "baseline"))
+    regression = False
+    for case, result in results["cases"].items():
+        if case not in baseline["cases"]:
+            continue
+        ratio = result["seconds"] / baseline["cases"][case]["seconds"]
+        slower = ratio > 1 + threshold
+        regression = regression or slower
+        print("{:<18} {:>+7.1f}% time  {}".format(case, (ratio - 1) * 100, "REGRESSION" if slower else ""))
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--bits", type=int, default=32, choices=[16, 24, 32])
+    parser.add_argument("--seconds", type=float, default=60.0, help="Duration of each file")
+    parser.add_argument("--samplerate", type=int, default=48000)
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", help="Comma separated list of cases (default: all)")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Compare with the results in this file")
+    args = parser.parse_args()
+
+    cases = PYTHON_CASES + ANALYSIS_CASES + list(SPLIT_CASES.keys())
+    if args.cases is not None:
+        cases = [c for c in args.cases.split(",") if c in cases]
+    if shutil.which("ffmpeg") is None:
+        skipped = [c for c in cases if c in SPLIT_CASES and c not in ("split-native", "split-native-stats")]
+        cases = [c for c in cases if c not in skipped]
+        if skipped:
+            print("Note: ffmpeg not found, skipping {}".format(", ".join(skipped)))
+
+    parameters = {k: getattr(args, k) for k in ["channels", "bits", "seconds", "samplerate", "files"]}
+    results = {
+        "commit" : git_commit(),
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "parameters" : parameters,
+        "cases" : {}
+    }
+
+    with tempfile.TemporaryDirectory(prefix="mixpresplit-bench-") as workdir:
+        paths = generate(workdir, args.files, args.channels, args.bits, args.seconds, args.samplerate)
+        source_bytes = sum(os.path.getsize(p) for p in paths)
+        audio_seconds = args.seconds * args.files
+        calls = {
+            "discover" : METADATA_LOOPS,
+            "read-metadata" : METADATA_LOOPS * args.files,
+            "filter-takes" : INNER_LOOPS,
+            "filter-tracks" : INNER_LOOPS * args.files * args.channels,
+            "expand-outpath" : INNER_LOOPS * args.files * args.channels,
+            "table-select" : INNER_LOOPS,
+            "plan-outputs" : INNER_LOOPS * args.files,
+        }
+
+        print("{} files, {} channels, {} bit, {} s each ({:.1f} MB), best of {} runs".format(args.files, args.channels, args.bits, args.seconds, source_bytes / 1e6, args.repeat))
+        for case in cases:
+            result = describe(case, measure(case, paths, workdir, args.repeat), source_bytes, audio_seconds, calls.get(case, 1))
+            results["cases"][case] = result
+            print(format_result(case, result))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+#-*- coding: utf-8 -*-
+"""
+Python API of mixpresplit.
+
+The command line tool prints its results and exits on errors. The
+functions here do the same work without printing: problems are raised as
+exceptions (subclasses of MixpresplitError) and the results of a split are
+returned as TakeResult objects.
+
+    from mixpresplit import api
+
+    options = api.make_options(native=True, takes="1-5")
+    takes = api.plan(api.select(api.scan(["/media/card"], options), options), "/srv/{date}/{trackname}", options)
+    for result in api.split_all(takes, options):
+        print(result.to_dict())
+
+AsyncSplitter runs the splits on an asyncio event loop: ffmpeg is started
+as an asyncio subprocess, the native splitter and the FLAC encoders run in
+a process pool, so a single service process can split many cards at the
+same time without blocking its loop. The number of units that run at the
+same time is limited by the splitter (across all calls).
+"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import subprocess
+import click
+import concurrent.futures
+
+from mixpresplit import cli, flac, wav
+from mixpresplit.cache import MetadataCache
+from mixpresplit.catalogue import Catalogue
+from mixpresplit.filters import compile_filter
+from mixpresplit.manifest import Manifest, manifest_directory
+from mixpresplit.scheduler import READERS_PER_DEVICE, WRITERS_PER_DEVICE
+from mixpresplit.table import TakeTable
+
+
+# The options of the command line tool with their defaults
+DEFAULT_OPTIONS = {
+    "overwrite" : False,
+    "only-circled" : False,
+    "replace" : (),
+    "with" : (),
+    "dry-run" : False,
+    "tracks" : None,
+    "takes" : None,
+    "open" : False,
+    "flac" : False,
+    "24" : False,
+    "16" : False,
+    "single-pass" : False,
+    "native" : False,
+    "flac-level" : None,
+    "flac-block-size" : None,
+    "flac-encoders" : flac.default_encoders(),
+    "skip-silent" : False,
+    "silence-threshold" : -60.0,
+    "checksums" : False,
+    "verify" : None,
+    "stats" : False,
+    "jobs" : 1,
+    "device-readers" : READERS_PER_DEVICE,
+    "device-writers" : WRITERS_PER_DEVICE,
+    "events" : None,
+    "summary" : False,
+    "preflight" : True,
+    "cache" : True,
+    "recursive" : True,
+    "ignore" : (),
+    "catalogue" : False,
+    "scene" : None,
+    "tape" : None,
+    "since" : None,
+    "until" : None,
+    "track-name" : None,
+    "rewrite" : False,
+    "stitch" : True,
+    "watch" : False,
+    "interval" : 2.0,
+    "plan" : None,
+    "execute" : None,
+    "shard" : None,
+    "batch" : None
+}
+
+# Keyword arguments of make_options that can't be spelled like the option
+OPTION_ALIASES = {
+    "bit24" : "24",
+    "bit16" : "16",
+    "with_" : "with",
+}
+
+
+class MixpresplitError(Exception):
+    pass
+
+
+class OptionsError(MixpresplitError):
+    def __init__(self, message: str, solution: str=None) -> "OptionsError":
+        super().__init__(message)
+        self.solution = solution
+
+
+class ScanError(MixpresplitError):
+    pass
+
+
+class SplitError(MixpresplitError):
+    def __init__(self, take: str, cause: Exception) -> "SplitError":
+        message = "Splitting {} failed: {}".format(take, cause)
+        stderr = getattr(cause, "stderr", None)
+        if stderr:
+            message += "\n" + stderr.decode("utf-8", "replace").strip()
+        super().__init__(message)
+        self.take = take
+        self.cause = cause
+
+
+def make_options(**kwargs) -> dict:
+    """
+    Return the options dict with the given options changed, options are
+    named like on the command line with underscores (e.g. only_circled=True,
+    bit24=True)
+    """
+    options = dict(DEFAULT_OPTIONS)
+    for name, value in kwargs.items():
+        key = OPTION_ALIASES.get(name, name.replace("_", "-"))
+        if key not in options:
+            raise TypeError("Unknown option {}".format(name))
+        options[key] = value
+    return options
+
+
+def check_options(outpath: str, options: dict) -> None:
+    """
+    Raise an OptionsError if OUTPATH and the options can't be used
+    """
+    try:
+        problem = cli.check_options(outpath, options)
+    except click.UsageError as e:
+        raise OptionsError(e.message, "Pass OUTPATH")
+    if problem is not None:
+        raise OptionsError(*problem)
+
+
+def scan(inpaths: [str], options: dict=None) -> ["Metadata"]:
+    """
+    Read the metadata of the wav files in the directories inpaths and join
+    takes that were split into several files. With the catalogue option the
+    inpaths are added to the catalogue and the takes are queried from it.
+    """
+    options = options or DEFAULT_OPTIONS
+    try:
+        if options["catalogue"]:
+            with Catalogue() as catalogue:
+                for inpath in inpaths:
+                    catalogue.update(inpath, list(cli.discover_options([inpath], options)))
+                metas = catalogue.query(inpaths, options["scene"], options["tape"], options["since"], options["until"], True if options["only-circled"] else None, options["track-name"])
+            # Leave out the files of cards that aren't mounted
+            metas = [meta for meta in metas if os.path.isfile(meta.filepath)]
+        else:
+            metas = cli.scan_inpaths(inpaths, options, MetadataCache() if options["cache"] else None)
+    except (OSError, wav.WavFormatError, sqlite3.Error) as e:
+        raise ScanError(str(e)) from e
+    if options["stitch"]:
+        metas = cli.stitch_takes(metas)
+    return metas
+
+
+def select(metas: ["Metadata"], options: dict) -> ["Metadata"]:
+    """
+    Return the takes that pass the take filter (and only-circled), metas
+    can also be a TakeTable
+    """
+    if isinstance(metas, TakeTable):
+        take_filter = compile_filter(options["takes"]) if options["takes"] is not None else None
+        return metas.metadatas(metas.rows(take_filter, circled=True if options["only-circled"] else None))
+    if options["takes"] is not None:
+        take_filter = compile_filter(options["takes"])
+        metas = [meta for meta in metas if take_filter.matches(meta.take)]
+    if options["only-circled"]:
+        metas = [meta for meta in metas if meta.circled]
+    return metas
+
+
+def plan(metas: ["Metadata"], outpath: str, options: dict) -> [("Metadata", [(int, str)])]:
+    """
+    Return the (meta, outputs) pairs of the takes, where outputs are the
+    (channel, outpath) pairs that will be written
+    """
+    check_options(outpath, options)
+    return [(meta, cli.plan_outputs(meta, outpath, options)) for meta in metas]
+
+
+class OutputResult():
+    def __init__(self, channel: int, path: str, status: str, note: str=None, checksum: str=None) -> "OutputResult":
+        """
+        status is "written", "up-to-date" (skipped by the manifest),
+        "silent" (not written, see --skip-silent) or "planned" (dry run)
+        """
+        self.channel = channel
+        self.path = path
+        self.status = status
+        self.note = note
+        self.checksum = checksum
+
+    def to_dict(self) -> dict:
+        return {
+            "channel" : self.channel,
+            "path" : self.path,
+            "status" : self.status,
+            "note" : self.note,
+            "checksum" : self.checksum
+        }
+
+
+class TakeResult():
+    def __init__(self, meta: "Metadata") -> "TakeResult":
+        self.meta = meta
+        self.outputs = []
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def raise_error(self) -> "TakeResult":
+        """
+        Raise the SplitError of the take if it failed
+        """
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "take" : self.meta.filepath,
+            "scene" : self.meta.scene,
+            "number" : self.meta.take,
+            "silent_tracks" : list(self.meta.silent_tracks),
+            "outputs" : [output.to_dict() for output in self.outputs],
+            "seconds" : round(self.seconds, 3),
+            "error" : str(self.error) if self.error is not None else None
+        }
+
+
+def prepare_take(meta: "Metadata", outputs: [(int, str)], options: dict, manifest: "Manifest"=None) -> ("TakeResult", list):
+    """
+    Skip what is up to date and return the result so far and the units that
+    still have to run
+    """
+    result = TakeResult(meta)
+    if options["dry-run"]:
+        result.outputs = [OutputResult(channel, path, "planned") for channel, path in outputs]
+        return result, []
+    outputs, complete = cli.skip_complete(meta, outputs, options, manifest)
+    result.outputs = [OutputResult(channel, path, "up-to-date") for channel, path in complete]
+    cli.create_directories(outputs)
+    units = cli.work_units(meta, outputs, options)
+    for _, unit_outputs in units:
+        cli.record_outputs(meta, unit_outputs, options, manifest, "start")
+    return result, units
+
+
+def finish_take(result: "TakeResult", units: list, finished: list, options: dict, manifest: "Manifest"=None) -> "TakeResult":
+    """
+    Record the units that finished (their results or exceptions) in the
+    manifest and the result
+    """
+    checksums = {}
+    for (unit, unit_outputs), done in zip(units, finished):
+        if isinstance(done, BaseException):
+            result.error = result.error or SplitError(result.meta.filepath, done)
+            continue
+        notes, unit_checksums, timing = done
+        cli.log_unit(unit, unit_outputs, timing)
+        checksums.update(unit_checksums)
+        unit_outputs, silent = cli.sort_silent(result.meta, unit_outputs, timing)
+        cli.record_outputs(result.meta, unit_outputs, options, manifest, "done", checksums)
+        for channel, path in unit_outputs:
+            result.outputs.append(OutputResult(channel, path, "written", notes.get(path), checksums.get(path)))
+        result.outputs += [OutputResult(channel, path, "silent") for channel, path in silent]
+    return result
+
+
+def open_manifest(outpath: str, options: dict) -> "Manifest":
+    """
+    Return the manifest of OUTPATH (None for dry runs)
+    """
+    if options["dry-run"]:
+        return None
+    return Manifest(manifest_directory(outpath))
+
+
+def split(meta: "Metadata", outputs: [(int, str)], options: dict, manifest: "Manifest"=None) -> "TakeResult":
+    """
+    Split a planned take in this process, one unit after the other
+    """
+    started = time.perf_counter()
+    result, units = prepare_take(meta, outputs, options, manifest)
+    finished = []
+    for unit, _ in units:
+        try:
+            finished.append(cli.run_unit(unit))
+        except (subprocess.CalledProcessError, OSError, wav.WavFormatError) as e:
+            finished.append(e)
+    finish_take(result, units, finished, options, manifest)
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def split_all(takes: [("Metadata", [(int, str)])], options: dict, manifest: "Manifest"=None) -> ["TakeResult"]:
+    """
+    Split the planned takes one after the other (see AsyncSplitter to split
+    them concurrently)
+    """
+    return [split(meta, outputs, options, manifest) for meta, outputs in takes]
+
+
+def run(inpaths: [str], outpath: str, **kwargs) -> ["TakeResult"]:
+    """
+    Scan, select, plan and split like the command line tool
+    """
+    options = make_options(**kwargs)
+    takes = plan(select(scan(inpaths, options), options), outpath, options)
+    return split_all(takes, options, open_manifest(outpath, options))
+
+
+class AsyncSplitter():
+    def __init__(self, options: dict=None, concurrency: int=None, executor: "concurrent.futures.Executor"=None) -> "AsyncSplitter":
+        """
+        Split takes on the running event loop with at most concurrency
+        (default: the jobs option) units at the same time. Units that don't
+        run ffmpeg run on the executor (default: a process pool of its own).
+        """
+        self.options = options or make_options()
+        self.concurrency = concurrency or self.options["jobs"]
+        self.semaphore = None
+        self.semaphore_loop = None
+        self.executor = executor
+        self.own_executor = executor is None
+
+    def get_semaphore(self) -> "asyncio.Semaphore":
+        """
+        Return the semaphore of the running loop. It is only created here,
+        before Python 3.10 it is bound to the loop that is current when it
+        is created, which is not the loop of asyncio.run() in __init__.
+        """
+        loop = asyncio.get_running_loop()
+        if self.semaphore_loop is not loop:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            self.semaphore_loop = loop
+        return self.semaphore
+
+    def get_executor(self) -> "concurrent.futures.Executor":
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.concurrency)
+        return self.executor
+
+    async def run_unit(self, unit: tuple) -> (dict, dict, dict):
+        """
+        Run a unit without blocking the loop, like cli.run_unit
+        """
+        loop = asyncio.get_running_loop()
+        kind, args, context = unit
+        async with self.get_semaphore():
+            if kind != "ffmpeg":
+                return await loop.run_in_executor(self.get_executor(), cli.run_unit, unit)
+            started = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(*args[0], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, args[0], stderr=stderr)
+            checksums = await loop.run_in_executor(self.get_executor(), cli.ffmpeg_followups, args, context)
+            return {}, checksums, {"seconds" : time.perf_counter() - started, "tracks" : {}}
+
+    async def split(self, meta: "Metadata", outputs: [(int, str)], manifest: "Manifest"=None) -> "TakeResult":
+        """
+        Split a planned take, all of its units may run at the same time
+        """
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        # Checking the manifest and planning the units reads the sources
+        result, units = await loop.run_in_executor(None, prepare_take, meta, outputs, self.options, manifest)
+        finished = await asyncio.gather(*[self.run_unit(unit) for unit, _ in units], return_exceptions=True)
+        finish_take(result, units, finished, self.options, manifest)
+        result.seconds = time.perf_counter() - started
+        return result
+
+    async def split_all(self, takes: [("Metadata", [(int, str)])], manifest: "Manifest"=None) -> ["TakeResult"]:
+        """
+        Split the planned takes concurrently, the results are in the order of takes
+        """
+        return await asyncio.gather(*[self.split(meta, outputs, manifest) for meta, outputs in takes])
+
+    async def run(self, inpaths: [str], outpath: str) -> ["TakeResult"]:
+        """
+        Scan, select, plan and split a card (scanning and planning run in a thread)
+        """
+        loop = asyncio.get_running_loop()
+        metas = await loop.run_in_executor(None, scan, inpaths, self.options)
+        takes = await loop.run_in_executor(None, plan, select(metas, self.options), outpath, self.options)
+        return await self.split_all(takes, open_manifest(outpath, self.options))
+
+    def close(self) -> None:
+        if self.own_executor and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def __aenter__(self) -> "AsyncSplitter":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,108 @@
+#-*- coding: utf-8 -*-
+"""
+Persistent cache for the metadata of already scanned wav files.
+
+Entries are keyed by the absolute path of a file and are only valid as
+long as the size and the modification time of the file didn't change.
+"""
+
+import os
+import sys
+import json
+import time
+
+
+# Bump this whenever the stored metadata changes, old caches are discarded then
+CACHE_VERSION = 2
+
+# Maximum number of files in the cache, least recently used ones are evicted
+MAX_ENTRIES = 10000
+
+
+def default_cache_path() -> str:
+    """
+    Return the platform specific location of the metadata cache
+    """
+    if "MIXPRESPLIT_CACHE" in os.environ:
+        return os.environ["MIXPRESPLIT_CACHE"]
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "mixpresplit", "metadata.json")
+
+
+class MetadataCache():
+    def __init__(self, path: str=None, max_entries: int=MAX_ENTRIES) -> "MetadataCache":
+        self.path = path or default_cache_path()
+        self.max_entries = max_entries
+        self.entries = {}
+        self.changed = False
+        self.load()
+
+    def load(self) -> "MetadataCache":
+        """
+        Read the cache from disk, a missing or broken cache is treated as empty
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                content = json.load(f)
+            if content.get("version") == CACHE_VERSION:
+                self.entries = content["entries"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            self.entries = {}
+        return self
+
+    def get(self, path: str, stat: os.stat_result) -> dict:
+        """
+        Return the cached metadata of the file or None if the file is
+        unknown or has changed since it was cached. A hit only updates the
+        use in memory, it is written along with the next change, so a run
+        that reads everything from the cache doesn't rewrite it.
+        """
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            return None
+        entry["used"] = time.time()
+        return entry["metadata"]
+
+    def put(self, path: str, stat: os.stat_result, metadata: dict) -> "MetadataCache":
+        self.entries[os.path.abspath(path)] = {
+            "size" : stat.st_size,
+            "mtime" : stat.st_mtime_ns,
+            "used" : time.time(),
+            "metadata" : metadata
+        }
+        self.changed = True
+        return self
+
+    def evict(self) -> "MetadataCache":
+        """
+        Drop the least recently used entries until max_entries is reached
+        """
+        if len(self.entries) > self.max_entries:
+            by_use = sorted(self.entries.items(), key=lambda item: item[1]["used"], reverse=True)
+            self.entries = dict(by_use[:self.max_entries])
+            self.changed = True
+        return self
+
+    def save(self) -> "MetadataCache":
+        """
+        Write the cache to disk if anything changed. Failing to write the
+        cache is not an error, the next run just has to scan again.
+        """
+        self.evict()
+        if not self.changed:
+            return self
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "entries": self.entries}, f)
+            os.replace(temporary, self.path)
+            self.changed = False
+        except OSError:
+            pass
+        return self
@@ -0,0 +1,193 @@
+#-*- coding: utf-8 -*-
+"""
+A persistent catalogue of the takes and tracks of all scanned cards.
+
+The metadata of every file that was scanned with --catalogue is kept in a
+SQLite database (next to the metadata cache), one row per file and one row
+per track. Scanning a directory again only reads the files whose size or
+modification time changed and drops the files that are gone, so the
+catalogue grows into an index of the whole archive. The takes to split can
+then be selected by a query (scene, tape, date range, circled, track name)
+that runs against the indexed columns instead of the files, even if the
+cards are not mounted.
+"""
+
+import os
+import sqlite3
+
+from mixpresplit import cli
+from mixpresplit.cache import default_cache_path
+
+
+# Bump this whenever the schema changes, old catalogues are rebuilt then
+CATALOGUE_VERSION = 1
+
+# Columns of a file, named like the fields of Metadata
+FILE_COLUMNS = ["datestring", "timestring", "codec", "samplerate", "channels", "scene", "take", "tape", "circled", "speed", "samplecount", "time_reference"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    datestring TEXT,
+    timestring TEXT,
+    codec TEXT,
+    samplerate INTEGER,
+    channels INTEGER,
+    scene TEXT,
+    take INTEGER,
+    tape TEXT,
+    circled INTEGER,
+    speed TEXT,
+    samplecount INTEGER,
+    time_reference INTEGER
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    channel INTEGER NOT NULL,
+    tracknumber INTEGER NOT NULL,
+    trackname TEXT
+);
+CREATE INDEX IF NOT EXISTS files_scene ON files(scene, datestring);
+CREATE INDEX IF NOT EXISTS files_tape ON files(tape);
+CREATE INDEX IF NOT EXISTS files_date ON files(datestring);
+CREATE INDEX IF NOT EXISTS tracks_path ON tracks(path);
+CREATE INDEX IF NOT EXISTS tracks_name ON tracks(trackname);
+"""
+
+
+def default_catalogue_path() -> str:
+    """
+    Return the location of the catalogue (next to the metadata cache)
+    """
+    if "MIXPRESPLIT_CATALOGUE" in os.environ:
+        return os.environ["MIXPRESPLIT_CATALOGUE"]
+    return os.path.join(os.path.dirname(default_cache_path()), "catalogue.sqlite")
+
+
+# Number of paths whose tracks are looked up in one query
+PATHS_PER_QUERY = 500
+
+
+def directory_range(directory: str) -> (str, str):
+    """
+    Return the range (low <= path < high) of the paths of all files in and
+    below the directory, so they can be found with the index of the paths
+    """
+    prefix = os.path.join(os.path.abspath(directory), "")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class Catalogue():
+    def __init__(self, path: str=None) -> "Catalogue":
+        self.path = path or default_catalogue_path()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        # Readers don't block a run that updates the catalogue
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != CATALOGUE_VERSION:
+            with self.connection:
+                self.connection.execute("DROP TABLE IF EXISTS tracks")
+                self.connection.execute("DROP TABLE IF EXISTS files")
+                self.connection.execute("PRAGMA user_version = {}".format(CATALOGUE_VERSION))
+        self.connection.executescript(SCHEMA)
+
+    def update(self, directory: str, paths: [str]) -> (int, int, int):
+        """
+        Bring the files of the directory up to date with the paths found in
+        it: new and changed files are read, files that are gone are dropped.
+        Returns the number of added, updated and removed files.
+        """
+        known = dict(((path, (size, mtime)) for path, size, mtime in self.connection.execute(
+            "SELECT path, size, mtime FROM files WHERE path >= ? AND path < ?", directory_range(directory))))
+
+        stats = {}
+        for path in paths:
+            stat = os.stat(path)
+            path = os.path.abspath(path)
+            if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                stats[path] = stat
+        gone = set(known) - set(os.path.abspath(p) for p in paths)
+
+        metas = cli.read_metadatas(list(stats.keys()))
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in gone])
+            for meta in metas:
+                self.put(meta, stats[meta.filepath])
+        added = len([path for path in stats if path not in known])
+        return added, len(stats) - added, len(gone)
+
+    def put(self, meta: "cli.Metadata", stat: os.stat_result) -> None:
+        """
+        Store the metadata of a file (within a transaction)
+        """
+        self.connection.execute("DELETE FROM files WHERE path = ?", (meta.filepath,))
+        self.connection.execute("INSERT INTO files (path, size, mtime, {}) VALUES (?, ?, ?, {})".format(", ".join(FILE_COLUMNS), ", ".join("?" * len(FILE_COLUMNS))),
+            [meta.filepath, stat.st_size, stat.st_mtime_ns] + [getattr(meta, column) for column in FILE_COLUMNS])
+        self.connection.executemany("INSERT INTO tracks (path, channel, tracknumber, trackname) VALUES (?, ?, ?, ?)",
+            [(meta.filepath, channel, track.tracknumber, track.trackname) for channel, track in meta.tracks.items()])
+
+    def query(self, directories: [str]=(), scene: str=None, tape: str=None, since: str=None, until: str=None, circled: bool=None, trackname: str=None) -> ["cli.Metadata"]:
+        """
+        Return the files in the catalogue that match all given conditions:
+        below one of the directories, of the scene or tape, recorded between
+        the dates (YYYY-MM-DD, inclusive), (not) circled and with a track
+        whose name contains trackname. The files are ordered by path.
+        """
+        conditions = []
+        parameters = []
+        if directories:
+            conditions.append("(" + " OR ".join(["(path >= ? AND path < ?)"] * len(directories)) + ")")
+            for directory in directories:
+                parameters += directory_range(directory)
+        for column, value in [("scene", scene), ("tape", tape)]:
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                parameters.append(value)
+        if since is not None:
+            conditions.append("datestring >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("datestring <= ?")
+            parameters.append(until)
+        if circled is not None:
+            conditions.append("circled = ?")
+            parameters.append(int(circled))
+        if trackname is not None:
+            conditions.append("EXISTS (SELECT 1 FROM tracks WHERE tracks.path = files.path AND instr(tracks.trackname, ?) > 0)")
+            parameters.append(trackname)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        metas = {}
+        for row in self.connection.execute("SELECT path, {} FROM files{} ORDER BY path".format(", ".join(FILE_COLUMNS), where), parameters):
+            meta = cli.Metadata().set_filepath(row[0])
+            for column, value in zip(FILE_COLUMNS, row[1:]):
+                setattr(meta, column, cli.intern_text(value))
+            meta.circled = bool(meta.circled)
+            metas[meta.filepath] = meta
+
+        # The tracks of the selected files, looked up by their paths
+        paths = list(metas.keys())
+        for n in range(0, len(paths), PATHS_PER_QUERY):
+            chunk = paths[n:n + PATHS_PER_QUERY]
+            for path, channel, tracknumber, trackname in self.connection.execute(
+                    "SELECT path, channel, tracknumber, trackname FROM tracks WHERE path IN ({}) ORDER BY rowid".format(", ".join("?" * len(chunk))), chunk):
+                metas[path].add_track(channel, tracknumber, trackname)
+        return list(metas.values())
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "Catalogue":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,35 +1,77 @@
 #!/usr/bin/env python 
 #-*- coding: utf-8 -*-
 
+# Only what every call needs is imported here, the rest (wavinfo, ffmpeg,
+# the FLAC encoders, checksums and worker pools) is imported where it is
+# used, so "-h", dry runs and plans start quickly (see benchmarks/startup.py)
 import sys
 import os, re, struct
+import shlex
 import datetime
-import platform
-import subprocess
-import xml.etree.ElementTree as ET
-from collections import defaultdict
+import time
 from collections import OrderedDict
-from wavinfo import WavInfoReader
 import click
+from mixpresplit import wav, stats, preflight, progress
+from mixpresplit.cache import MetadataCache
+from mixpresplit.discover import IGNORE_PATTERNS, discover
+from mixpresplit.filters import compile_filter
+from mixpresplit.manifest import Manifest, manifest_directory
+from mixpresplit.outpath import OutpathError, compile_outpath
+from mixpresplit.scheduler import IOScheduler, READERS_PER_DEVICE, WRITERS_PER_DEVICE
+from mixpresplit.plan import PLAN_VERSION, PLAN_OPTIONS, PlanError, write_plan, read_plan, check_sources, parse_shard, shard_takes
+from mixpresplit.watch import Watcher
 
 
 # Allow also -h to get help
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
-# Filter patterns
-filter_take_pattern       = re.compile(r'(!?\d-\d|!?\d|!?[A-z0-9-_]+)')
-filter_take_pattern_digit = re.compile(r'^(!?\d)$')
-filter_take_pattern_range = re.compile(r'^(!?\d-\d)$')
-filter_take_pattern_word  = re.compile(r'^(!?[A-z0-9-_]+)$')
-filter_track_pattern       = re.compile(r'(!?\d-\d|!?\d|!?[A-z0-9-_]+)')
-filter_track_pattern_digit = re.compile(r'^(!?\d)$')
-filter_track_pattern_range = re.compile(r'^(!?\d-\d)$')
-filter_track_pattern_word  = re.compile(r'^(!?[A-z0-9-_]+)$')
+# Number of files whose metadata is read at the same time
+SCAN_WORKERS = 8
 
+# Dates of --since and --until (like the dates of the recorder)
+date_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}$')
 
 
 
+
+def intern_text(text: str) -> str:
+    """
+    Return the interned text, so the scene, tape, date and track names that
+    repeat across thousands of takes are stored once
+    """
+    if isinstance(text, str):
+        return sys.intern(text)
+    return text
+
+
+class Track():
+    __slots__ = ["tracknumber", "trackname"]
+
+    def __init__(self, tracknumber: int, trackname: str) -> "Track":
+        self.tracknumber = tracknumber
+        self.trackname = intern_text(trackname)
+
+    def __getitem__(self, key: str):
+        """
+        Tracks used to be dicts, track["trackname"] still works
+        """
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, dict):
+            return other == {"trackname": self.trackname, "tracknumber": self.tracknumber}
+        return isinstance(other, Track) and (self.tracknumber, self.trackname) == (other.tracknumber, other.trackname)
+
+    def __repr__(self) -> str:
+        return "Track({!r}, {!r})".format(self.tracknumber, self.trackname)
+
+
 class Metadata():
+    # Without a __dict__ per take a catalogue of many thousand takes stays small
+    __slots__ = ["filepath", "datestring", "timestring", "codec", "samplerate", "channels", "scene", "take", "tape", "circled", "speed", "samplecount", "time_reference", "tracks", "continuations", "silent_tracks"]
+
     def __init__(self)  -> "Metadata":
         self.filepath = None
         self.datestring = None
@@ -43,7 +85,13 @@ class Metadata():
         self.circled = None
         self.speed = None
         self.samplecount = None
-        self.tracks = OrderedDict()
+        self.time_reference = None
+        # Track by internal tracknumber, in the order of the recorder
+        self.tracks = {}
+        # Further files of the same take (recorders split long takes)
+        self.continuations = []
+        # Numbers of the tracks that were skipped because they are silent
+        self.silent_tracks = []
 
     def set_filepath(self, filepath: str):
         self.filepath = filepath
@@ -56,6 +104,13 @@ class Metadata():
         else:
             return os.path.basename(self.filepath)
 
+    @property
+    def filepaths(self) -> [str]:
+        """
+        The paths of all files of the take, in order
+        """
+        return [self.filepath] + [c.filepath for c in self.continuations]
+
     @property
     def directory(self) -> str:
         if self.filepath is None:
@@ -75,11 +130,11 @@ class Metadata():
         return datetime.timedelta(seconds=self.total_seconds)
 
     def set_datestring(self, datestring: str) -> str:
-        self.datestring = datestring
+        self.datestring = intern_text(datestring)
         return self
 
     def set_timestring(self, timestring: str) -> str:
-        self.timestring = timestring
+        self.timestring = intern_text(timestring)
         return self
 
     def set_codec(self, bitrate: int) -> "Metadata":
@@ -101,7 +156,7 @@ class Metadata():
         return self
 
     def set_scene(self, scene: str) -> "Metadata":
-        self.scene = scene
+        self.scene = intern_text(scene)
         return self
 
     def set_take(self, take: int) -> "Metadata":
@@ -109,7 +164,7 @@ class Metadata():
         return self
 
     def set_tape(self, tape: str) -> "Metadata":
-        self.tape = tape
+        self.tape = intern_text(tape)
         return self
 
     def set_circled(self, circled: bool) -> "Metadata":
@@ -117,18 +172,79 @@ class Metadata():
         return self
 
     def set_speed(self, speed: str) -> "Metadata":
-        self.speed = speed
+        self.speed = intern_text(speed)
         return self
 
     def set_samplecount(self, samplecount: int) -> "Metadata":
         self.samplecount = int(samplecount)
         return self
 
+    def set_time_reference(self, time_reference: int) -> "Metadata":
+        self.time_reference = int(time_reference)
+        return self
+
+    def add_continuation(self, meta: "Metadata") -> "Metadata":
+        """
+        Append the samples of another file of the same take to this take
+        """
+        self.continuations.append(meta)
+        self.samplecount += meta.samplecount
+        return self
+
+    def continues_with(self, meta: "Metadata") -> bool:
+        """
+        True if meta is the next file of this take: The same scene, take,
+        tape and format and a time reference that starts right where the
+        samples of this take end (the time reference restarts at midnight)
+        """
+        if self.time_reference is None or meta.time_reference is None:
+            return False
+        samples_per_day = self.samplerate * 24 * 60 * 60
+        return (meta.scene, meta.take, meta.tape, meta.codec, meta.samplerate, meta.channels) == (self.scene, self.take, self.tape, self.codec, self.samplerate, self.channels) \
+            and meta.time_reference == (self.time_reference + self.samplecount) % samples_per_day \
+            and [(i, t.tracknumber) for i, t in meta.tracks.items()] == [(i, t.tracknumber) for i, t in self.tracks.items()]
+
     def add_track(self, internal_tracknumber: int, tracknumber: int, trackname: str) -> "Metadata":
         if not internal_tracknumber in self.tracks:
-            self.tracks[internal_tracknumber] = {"trackname": trackname, "tracknumber": tracknumber}
+            self.tracks[internal_tracknumber] = Track(tracknumber, trackname)
         return self
 
+    def to_dict(self) -> dict:
+        """
+        Return the metadata as a JSON serializable dict
+        """
+        return {
+            "filepath" : self.filepath,
+            "datestring" : self.datestring,
+            "timestring" : self.timestring,
+            "codec" : self.codec,
+            "samplerate" : self.samplerate,
+            "channels" : self.channels,
+            "scene" : self.scene,
+            "take" : self.take,
+            "tape" : self.tape,
+            "circled" : self.circled,
+            "speed" : self.speed,
+            "samplecount" : self.samplecount,
+            "time_reference" : self.time_reference,
+            "tracks" : [[i, track.tracknumber, track.trackname] for i, track in self.tracks.items()],
+            "continuations" : [c.to_dict() for c in self.continuations]
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Metadata":
+        """
+        Create metadata from a dict returned by to_dict
+        """
+        meta = cls()
+        for key, value in d.items():
+            if key not in ["tracks", "continuations"]:
+                setattr(meta, key, intern_text(value))
+        for internal_tracknumber, tracknumber, trackname in d["tracks"]:
+            meta.add_track(internal_tracknumber, tracknumber, trackname)
+        meta.continuations = [cls.from_dict(c) for c in d.get("continuations", [])]
+        return meta
+
     def __str__(self) -> str:
         lines = []
         lines.append("Metadata():")
@@ -156,8 +272,20 @@ class Metadata():
 
 
 
+def read_header(path: str) -> "wav.WavHeader":
+    """
+    Read the header with the fast native reader and use wavinfo for
+    anything it can't handle
+    """
+    try:
+        return wav.read_header(path)
+    except (wav.WavFormatError, wav.expat.ExpatError, UnicodeDecodeError, struct.error, ValueError, ZeroDivisionError):
+        from wavinfo import WavInfoReader
+        return WavInfoReader(path)
+
+
 def read_metadata(path: str) -> "Metadata":
-    metadata = WavInfoReader(path)
+    metadata = read_header(path)
 
     meta = Metadata()
     meta.set_filepath(path)
@@ -182,6 +310,7 @@ def read_metadata(path: str) -> "Metadata":
     meta.set_speed([l.split("=")[1] for l in metadata.bext.description.split("\r\n") if l.startswith("sSPEED")][0])
     meta.set_circled([l.split("=")[1]=="TRUE" for l in metadata.bext.description.split("\r\n") if l.startswith("sCIRCLED")][0])
     meta.set_samplecount(metadata.data.frame_count)
+    meta.set_time_reference(metadata.bext.time_reference)
 
     # Always subtract 2 from regular (non-mixdown) channelnumbers to match the device channels
     index_offset = 2
@@ -208,232 +337,950 @@ def read_metadata(path: str) -> "Metadata":
     return meta
 
 
-def get_wavs_files(inpath: str) -> [str]:
-    return [os.path.join(inpath, f) for f in os.listdir(inpath) if f.lower().endswith(".wav")]
+def read_metadatas(paths: [str], cache: "MetadataCache"=None, workers: int=SCAN_WORKERS) -> ["Metadata"]:
+    """
+    Read the metadata of many files concurrently. Files found in the cache
+    with the same size and modification time are not read again. paths can
+    be an iterator (see discover), files are read while it finds the rest.
+    """
+    metas = []
+
+    # Look up the cache first and only read the rest
+    missing = []
+    executor = None
+    try:
+        for n, path in enumerate(paths):
+            stat = os.stat(path)
+            cached = cache.get(path, stat) if cache is not None else None
+            if cached is not None:
+                metas.append(Metadata.from_dict(cached).set_filepath(path))
+                continue
+            if executor is None:
+                import concurrent.futures
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            metas.append(None)
+            missing.append((n, path, stat, executor.submit(read_metadata, path)))
+
+        for n, path, stat, future in missing:
+            metas[n] = future.result()
+            if cache is not None:
+                cache.put(path, stat, metas[n].to_dict())
+    except BaseException:
+        for _, _, _, future in missing:
+            future.cancel()
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    if cache is not None:
+        cache.save()
+
+    return metas
+
+
+def catalogue_metadatas(inpaths: [str], options: dict) -> ["Metadata"]:
+    """
+    Bring the catalogue up to date with the files in the inpaths and return
+    the files it holds that match the query options (below the inpaths, if
+    any were given). Files whose card isn't mounted are skipped.
+    """
+    from mixpresplit.catalogue import Catalogue
+    with Catalogue() as catalogue:
+        for inpath in inpaths:
+            added, updated, removed = catalogue.update(inpath, list(discover_options([inpath], options)))
+            print("Catalogue: {} ({} file(s) added, {} updated, {} removed)".format(inpath, added, updated, removed))
+        metas = catalogue.query(inpaths, options["scene"], options["tape"], options["since"], options["until"], True if options["only-circled"] else None, options["track-name"])
+        print("Catalogue: {} file(s) of {} match".format(len(metas), len(catalogue)))
+
+    online = [meta for meta in metas if os.path.isfile(meta.filepath)]
+    if len(online) < len(metas):
+        print("Skipping {} file(s) that are not reachable (card not mounted?)".format(len(metas) - len(online)))
+    return online
+
+
+def stitch_takes(metas: ["Metadata"]) -> ["Metadata"]:
+    """
+    Join files that continue each other (see Metadata.continues_with) into
+    a single take, the other files become continuations of the first one
+    """
+    stitched = []
+    # The part that may continue in another file, for each scene, take and tape
+    open_takes = {}
+    for meta in sorted(metas, key=lambda m: (m.datestring or "", m.time_reference or 0, m.filepath)):
+        key = (meta.scene, meta.take, meta.tape)
+        previous = open_takes.get(key)
+        if previous is not None and previous["end"].continues_with(meta):
+            previous["take"].add_continuation(meta)
+            previous["end"] = meta
+            continue
+        open_takes[key] = {"take": meta, "end": meta}
+        stitched.append(meta)
+
+    # Keep the order the files came in
+    order = dict((id(m), n) for n, m in enumerate(metas))
+    return sorted(stitched, key=lambda m: order[id(m)])
+
+
+def get_wavs_files(inpath: str, recursive: bool=True, ignore: [str]=IGNORE_PATTERNS) -> [str]:
+    return list(discover([inpath], recursive, ignore))
+
+
+def discover_options(inpaths: [str], options: dict):
+    """
+    Yield the wav files in the inpaths with the discovery options
+    """
+    return discover(inpaths, options["recursive"], IGNORE_PATTERNS + tuple(options["ignore"]))
+
+
+def scan_inpaths(inpaths: [str], options: dict, cache: "MetadataCache"=None) -> ["Metadata"]:
+    """
+    Find the wav files in the inpaths and read their metadata (ordered by path)
+    """
+    return sorted(read_metadatas(discover_options(inpaths, options), cache), key=lambda meta: meta.filepath)
 
 
 def expand_outpath(outpath: str , meta: dict, channel: int=0) -> str:
-    outpath = outpath.replace("{date}", meta.datestring)
-    outpath = outpath.replace("{hour}", meta.timestring.split(":")[0])
-    outpath = outpath.replace("{h}", meta.timestring.split(":")[0])
-    outpath = outpath.replace("{min}", meta.timestring.split(":")[1])
-    outpath = outpath.replace("{m}", meta.timestring.split(":")[1])
-    outpath = outpath.replace("{sec}", meta.timestring.split(":")[2])
-    outpath = outpath.replace("{s}", meta.timestring.split(":")[2])
-    outpath = outpath.replace("{scene}", meta.scene)
-    outpath = outpath.replace("{take}", str(meta.take))
-    outpath = outpath.replace("{tape}", meta.tape)
-
-    if channel != 0:
-        track = meta.tracks[channel]
-        outpath = outpath.replace("{tracknumber}", str(track["tracknumber"]))
-        outpath = outpath.replace("{track}", str(track["tracknumber"]))
-        outpath = outpath.replace("{n}", str(track["tracknumber"]))
-        outpath = outpath.replace("{trackname}", track["trackname"])
-        outpath = outpath.replace("{name}", track["trackname"])
-
-    if meta.circled:
-        outpath = outpath.replace("{circled}", "CIRCLED")
-
-    return outpath
-
-
-def process_files(meta: "Metadata", outpath: str, options: dict) -> [str]:
-    # Expand the output
-    outpath = expand_outpath(outpath, meta)
+    return compile_outpath(outpath).render(meta, channel)
+
+
+def output_codec(meta: "Metadata", options: dict) -> (str, str):
+    """
+    Return the output codec and the file extension for the given options
+    """
+    # Get the input codec as a default
+    if options["flac"]:
+        return "flac", ".flac"
+    return meta.codec, ".wav"
+
+
+def output_arguments(meta: "Metadata", options: dict) -> [str]:
+    """
+    Return the ffmpeg output options that have to precede each output file
+    """
+    codec, _ = output_codec(meta, options)
+    args = [
+        "-map_metadata", "0",     # <-- Try to preserve cue points
+        "-map_metadata", "0:s:0", # <-- Map stream Metadata as well
+        "-write_bext", "1",       # <-- Also preserve bext / timecode / other
+        "-bitexact",
+        "-c:a", codec,            # <-- output codec
+    ]
+
+    # Convert to 24 or 16 bit if demanded
+    if options["24"]:
+        args += ["-sample_fmt", "s24"]
+    elif options["16"]:
+        args += ["-sample_fmt", "s16"]
+
+    # FLAC compression level and block size (in samples), ffmpeg's defaults otherwise
+    if codec == "flac":
+        if options["flac-level"] is not None:
+            args += ["-compression_level", str(options["flac-level"])]
+        if options["flac-block-size"] is not None:
+            args += ["-frame_size", str(options["flac-block-size"])]
+
+    # Switch to RF64 if the track doesn't fit into a regular wav file
+    if output_needs_rf64(meta, options):
+        args += ["-rf64", "auto"]
+
+    return args
+
+
+def output_bits(meta: "Metadata", options: dict) -> int:
+    """
+    Return the bits per sample of the outputs (FLAC stores at most 24)
+    """
+    if options["24"]:
+        return 24
+    elif options["16"]:
+        return 16
+    bits = wav.NATIVE_CODECS.get(meta.codec, (None, 32))[1]
+    if options["flac"]:
+        return min(bits, 24)
+    return bits
+
+
+def output_needs_rf64(meta: "Metadata", options: dict) -> bool:
+    """
+    True if a track of the take would exceed the size limit of a wav file
+    """
+    codec, _ = output_codec(meta, options)
+    if codec == "flac" or meta.samplecount is None:
+        return False
+    return wav.needs_rf64(meta.samplecount, output_bits(meta, options) // 8)
+
+
+def output_format(meta: "Metadata", options: dict) -> str:
+    """
+    Return a short description of the output codec and sample format
+    """
+    codec, _ = output_codec(meta, options)
+    if options["24"]:
+        return "{}/s24".format(codec)
+    elif options["16"]:
+        return "{}/s16".format(codec)
+    return codec
+
+
+def global_arguments(options: dict) -> [str]:
+    """
+    Return the ffmpeg options that apply to the whole command
+    """
+    args = []
+
+    # Set overwrite option in ffmpeg if flag is found
+    if options["overwrite"]:
+        args.append("-y")
+
+    # Hide ffmpeg output
+    args += ["-hide_banner", "-loglevel", "error"]
+    return args
+
+
+def input_arguments(meta: "Metadata") -> [str]:
+    """
+    Return the ffmpeg options for reading all files of the take
+    """
+    args = []
+    for filepath in meta.filepaths:
+        args += ["-i", filepath]
+    return args
+
+
+def concat_filter(meta: "Metadata") -> str:
+    """
+    Return a filter that streams the files of a take with continuations one after the other
+    """
+    inputs = "".join("[{}:a]".format(n) for n in range(len(meta.filepaths)))
+    return "{}concat=n={}:v=0:a=1".format(inputs, len(meta.filepaths))
+
+
+def split_command(meta: "Metadata", channel: int, outpath: str, options: dict) -> [str]:
+    """
+    Construct a ffmpeg command that writes a single channel of a polywav
+    """
+    cmd = ["ffmpeg"] + input_arguments(meta)
+    cmd += ["-c:a", meta.codec]   # <-- input codec, output codec below!
+
+    # Which channel shall be used
+    if not meta.continuations:
+        cmd += ["-af", "pan=1|c0=c{}".format(channel)]
+    else:
+        cmd += ["-filter_complex", "{},pan=1|c0=c{}[c{}]".format(concat_filter(meta), channel, channel)]
+        cmd += ["-map", "[c{}]".format(channel)]
+    cmd += output_arguments(meta, options)
+    cmd.append(outpath)
+    cmd += global_arguments(options)
+    return cmd
+
+
+def flac_encoder_command(meta: "Metadata", outpath: str, options: dict) -> [str]:
+    """
+    Construct a ffmpeg command that encodes the raw samples of a single
+    channel from stdin, the metadata is taken from the polywav
+    """
+    cmd = ["ffmpeg", "-i", meta.filepath]
+    cmd += ["-f", meta.codec.replace("pcm_", ""), "-ar", str(meta.samplerate), "-ac", "1", "-i", "pipe:0"]
+    cmd += ["-map", "1:a"]
+    cmd += output_arguments(meta, options)
+    cmd.append(outpath)
+    cmd += global_arguments(options)
+    # Never ask whether to overwrite, stdin carries the samples
+    if not options["overwrite"]:
+        cmd.append("-n")
+    return cmd
+
+
+def single_pass_command(meta: "Metadata", outputs: [(int, str)], options: dict) -> [str]:
+    """
+    Construct a ffmpeg command that decodes the polywav once and writes all
+    (channel, outpath) pairs from that single pass. The stream is fanned out
+    with asplit and each branch uses the same pan filter as split_command,
+    so the written samples do not differ between the two modes.
+    """
+    cmd = ["ffmpeg"] + input_arguments(meta)
+
+    # [0:a]asplit=3[s0][s1][s2];[s0]pan=1|c0=c0[c0];[s1]pan=1|c0=c4[c4];...
+    branches = "".join("[s{}]".format(n) for n in range(len(outputs)))
+    source = "[0:a]" if not meta.continuations else "{},".format(concat_filter(meta))
+    graph = ["{}asplit={}{}".format(source, len(outputs), branches)]
+    for n, (channel, _) in enumerate(outputs):
+        graph.append("[s{}]pan=1|c0=c{}[c{}]".format(n, channel, channel))
+    cmd += ["-filter_complex", ";".join(graph)]
+
+    # Add -map [c3] <options> /my/path/SceneName-001.3-Trackname.WAV for each output
+    for channel, outpath in outputs:
+        cmd += ["-map", "[c{}]".format(channel)]
+        cmd += output_arguments(meta, options)
+        cmd.append(outpath)
+
+    cmd += global_arguments(options)
+    return cmd
 
-    # Construct channel mapping and filenames for output
-    outfiles = [(i, track) for i, track in meta.tracks.items()]
+
+def plan_outputs(meta: "Metadata", outpath: str, options: dict) -> [(int, str)]:
+    """
+    Return a (channel, outpath) pair for each track of the take that passes
+    the track filters
+    """
+    # The values of the take are the same for all of its tracks
+    template = compile_outpath(outpath, tuple(options["replace"]), tuple(options["with"]))
+    tokens = template.bind(meta)
+
+    _, file_extension = output_codec(meta, options)
 
     # If no Stereo Master is recorded first channel would be at index 3
     # correct this offset by subtracting this
     smallest = min(meta.tracks.keys())
 
-    # List of paths written to
-    written_to = []
-    
-    # Add -map [FL] /my/path/SceneName-001.1-Trackname.WAV:
-    for i, track  in outfiles:
-        # Get the input codec as a default
-        output_codec = meta.codec
-        file_extension = ".wav"
-
-        # Override input codec if options are present
-        if options["flac"]:
-            output_codec = "flac"
-            file_extension = ".flac"
-
-        # Construct basic command
-        cmd = [
-            "ffmpeg",
-            "-i", meta.filepath,
-            "-c:a", meta.codec,       # <-- input codec, output codec below!
-            "-map_metadata", "0",     # <-- Try to preserve cue points
-            "-map_metadata", "0:s:0", # <-- Map stream Metadata as well
-            "-write_bext", "1",       # <-- Also preserve bext / timecode / other
-            "-bitexact",
-        ]
-
-        # Which channel shall be used
-        channel = i-smallest
-        cmd.append("-af")
-        cmd.append("pan=1|c0=c{}".format(channel))
-
-        # Which Codec shall be used
-        cmd.append("-c:a")
-        cmd.append(output_codec) # <-- output codec
-
-        # Convert to 24 or 16 bit if demanded
-        if options["24"]:
-            cmd.append("-sample_fmt")
-            cmd.append("s24")
-        elif options["16"]:
-            cmd.append("-sample_fmt")
-            cmd.append("s16")
-
+    outputs = []
+    for i, track in meta.tracks.items():
         # Skip loop to end if track is filtered
         if not filter_tracks(track, options):
             continue
-        
-        # expand the Outpath per Track
-        patched_outpath = expand_outpath(outpath, meta, i)
 
-        # For each --replace foo use the according --with bar
-        for i, r in enumerate(options["replace"]):
-            patched_outpath = patched_outpath.replace(r, options["with"][i])
+        # Expand the Outpath per Track, including --replace/--with
+        patched_outpath = template.render(meta, i, tokens)
 
         # Add extension if there is none
         if not patched_outpath.lower().endswith(file_extension):
             patched_outpath = "{}{}".format(patched_outpath, file_extension)
-        
-        # Create Outpath if it doesn't exist
-        if not os.path.isdir(patched_outpath) and not options["dry-run"]:
-            os.makedirs(os.path.dirname(patched_outpath), exist_ok=True)
-        cmd.append(patched_outpath)
-        
 
-        # Set overwrite option in ffmpeg if flag is found
-        if options["overwrite"]:
-            cmd.append("-y") 
+        outputs.append((i-smallest, patched_outpath))
+
+    return outputs
 
-        # Hide ffmpeg output
-        cmd.append("-hide_banner") 
-        cmd.append("-loglevel")
-        cmd.append("error")
 
+def audible_outputs(meta: "Metadata", outputs: [(int, str)], options: dict) -> [(int, str)]:
+    """
+    Return the outputs whose track peaks at or above the silence threshold
+    (in dBFS). The levels of all channels are measured in one extra read of
+    the take, for the splits where the samples don't pass through
+    mixpresplit itself.
+    """
+    levels = wav.channel_levels(meta.filepath, meta.codec, meta.filepaths[1:])
+    return [(channel, patched_outpath) for channel, patched_outpath in outputs if wav.decibels(levels[channel][0]) >= options["silence-threshold"]]
+
+
+def sort_silent(meta: "Metadata", outputs: [(int, str)], timing: dict) -> ([(int, str)], [(int, str)]):
+    """
+    Divide the outputs of a finished unit into the written ones and the ones
+    that were skipped because they are silent, which are noted in the metadata
+    """
+    if "written" not in timing:
+        return outputs, []
+    written = timing["written"]
+    smallest = min(meta.tracks.keys())
+    kept = [(channel, patched_outpath) for channel, patched_outpath in outputs if patched_outpath in written]
+    silent = [(channel, patched_outpath) for channel, patched_outpath in outputs if patched_outpath not in written]
+    meta.silent_tracks += [meta.tracks[channel + smallest].tracknumber for channel, _ in silent]
+    return kept, silent
+
+
+def work_units(meta: "Metadata", outputs: [(int, str)], options: dict) -> [(tuple, [(int, str)])]:
+    """
+    Divide the outputs of a take into units of work that can run
+    independently. Returns a list of (unit, outputs) pairs, where unit
+    is passed to run_unit and outputs are the (channel, outpath) pairs
+    the unit writes.
+    """
+    # What the unit reports its progress and timing with
+    context = {
+        "take" : meta.filename,
+        "source" : meta.filepath,
+        "duration" : meta.total_seconds,
+        "bytes" : source_bytes([(meta, outputs)]),
+        "events" : options["events"]
+    }
+    return [((kind, args, context), unit_outputs) for (kind, args), unit_outputs in unit_commands(meta, outputs, options)]
+
+
+def unit_commands(meta: "Metadata", outputs: [(int, str)], options: dict) -> [(tuple, [(int, str)])]:
+    """
+    Return the (kind, arguments) of the units of work_units with their outputs
+    """
+    if not outputs:
+        return []
+    measure = options["stats"] and meta.codec in wav.NATIVE_CODECS
+    checksum = options["checksums"] and meta.codec in wav.NATIVE_CODECS
+    # The silent tracks are found in the worker, where the samples are read anyway
+    silence = options["silence-threshold"] if options["skip-silent"] and meta.codec in wav.NATIVE_CODECS else None
+
+    # De-interleave the PCM in-process and fan the tracks out to parallel FLAC encoders
+    if options["native"] and options["flac"]:
+        from mixpresplit import flac
+        encoders = [(channel, patched_outpath, flac_encoder_command(meta, patched_outpath, options)) for channel, patched_outpath in outputs]
+        return [(("flac", (meta.filepath, meta.codec, encoders, options["flac-encoders"] or flac.default_encoders(), wav.BLOCK_FRAMES, meta.filepaths[1:], measure, checksum, silence)), outputs)]
+
+    # De-interleave the PCM in-process, reading the source once
+    if options["native"]:
+        return [(("native", (meta.filepath, meta.codec, outputs, options["overwrite"], wav.BLOCK_FRAMES, meta.filepaths[1:], measure, checksum, silence)), outputs)]
+
+    # ffmpeg can't leave out silent tracks, they are measured in an extra
+    # read first and the rest is written in a single pass
+    if silence is not None:
+        return [(("ffmpeg-silent", (meta, outputs, options)), outputs)]
+    return ffmpeg_commands(meta, outputs, options, options["single-pass"])
+
+
+def ffmpeg_commands(meta: "Metadata", outputs: [(int, str)], options: dict, single_pass: bool) -> [(tuple, [(int, str)])]:
+    """
+    Return the (kind, arguments) of the ffmpeg units of unit_commands
+    """
+    measure = options["stats"] and meta.codec in wav.NATIVE_CODECS
+    checksum = options["checksums"] and meta.codec in wav.NATIVE_CODECS
+
+    # ffmpeg doesn't hand the samples over, so the first unit of the take
+    # measures and hashes the source in an extra read
+    measured = (meta.filepath, meta.codec, outputs, meta.filepaths[1:]) if measure else None
+    hashed = (meta.filepath, meta.codec, meta.filepaths[1:]) if checksum else None
+
+    # Read the source once and write all tracks from that one pass
+    if single_pass:
+        hashed_outputs = [p for _, p in outputs] if checksum else []
+        return [(("ffmpeg", (single_pass_command(meta, outputs, options), hashed_outputs, measured, hashed)), outputs)]
+
+    # Run one ffmpeg per track
+    units = []
+    for channel, patched_outpath in outputs:
+        hashed_outputs = [patched_outpath] if checksum else []
+        units.append((("ffmpeg", (split_command(meta, channel, patched_outpath, options), hashed_outputs, measured, hashed)), [(channel, patched_outpath)]))
+        measured = hashed = None
+    return units
+
+
+def unit_phase(kind: str) -> str:
+    """
+    Return the phase a unit of the kind is logged as
+    """
+    return "write" if kind == "native" else "encode"
+
+
+def run_ffmpeg(cmd: [str], report: "progress.ProgressReporter", duration: float) -> None:
+    """
+    Run ffmpeg, raises a CalledProcessError if it fails. If events are
+    logged, its progress is followed through a -progress pipe.
+    """
+    import subprocess
+    if not report.log.enabled:
+        subprocess.check_output(cmd)
+        return
+    process = subprocess.Popen(cmd + ["-progress", "pipe:1", "-nostats"], stdout=subprocess.PIPE)
+    with process:
+        progress.follow_ffmpeg(process, report, duration)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+
+def run_unit(unit: tuple) -> (dict, dict, dict):
+    """
+    Run a single unit of work as returned by work_units. Returns a dict
+    with a note for the outpaths that get one when they are printed, a
+    dict with the checksums of the source and the outpaths (if asked for)
+    and the timing of the unit (its seconds and those of single tracks
+    where they are known).
+    """
+    kind, args, context = unit
+    log = progress.log()
+    if log.path != context["events"]:
+        log = progress.open_log(context["events"])
+    phase = unit_phase(kind)
+    report = progress.ProgressReporter(log, phase, context["take"], context["duration"])
+    log.emit("start", phase=phase, take=context["take"])
+    started = time.perf_counter()
+
+    notes = {}
+    checksums = {}
+    tracks = {}
+    written = None
+    if kind == "native":
+        *args, checksum, silence = args
+        written = wav.split_wav(*args, checksums=checksums if checksum else None, progress=report if log.enabled else None, silence_threshold=silence)
+    elif kind == "flac":
+        from mixpresplit import flac
+        *args, checksum, silence = args
+        speeds = flac.encode_flac(*args, checksums=checksums if checksum else None, progress=report if log.enabled else None, silence_threshold=silence)
+        notes = {outpath: "encoded at {:.1f}x realtime".format(speed) for outpath, speed in speeds.items()}
+        tracks = {outpath: context["duration"] / speed for outpath, speed in speeds.items() if context["duration"]}
+        written = list(speeds.keys())
+    elif kind == "ffmpeg-silent":
+        meta, outputs, options = args
+        audible = audible_outputs(meta, outputs, options)
+        for (_, ffmpeg_args), _ in ffmpeg_commands(meta, audible, options, True) if audible else []:
+            run_ffmpeg(ffmpeg_args[0], report, context["duration"])
+            checksums = ffmpeg_followups(ffmpeg_args, context)
+        written = [patched_outpath for _, patched_outpath in audible]
+    else:
+        run_ffmpeg(args[0], report, context["duration"])
+        checksums = ffmpeg_followups(args, context)
+    timing = {"seconds" : time.perf_counter() - started, "tracks" : tracks}
+    # What is missing from the written outputs was left out because it is silent
+    if written is not None:
+        timing["written"] = written
+    return notes, checksums, timing
+
+
+def ffmpeg_followups(args: tuple, context: dict) -> dict:
+    """
+    Measure and hash what an ffmpeg unit wrote, reading the source again
+    where needed (a phase of its own). Returns the checksums.
+    """
+    _, hashed_outputs, measured, hashed = args
+    checksums = {}
+    if measured is None and not hashed_outputs:
+        return checksums
+    from mixpresplit import verify
+    started = time.perf_counter()
+    if measured is not None:
+        stats.measure_outputs(*measured)
+    if hashed is not None:
+        checksums[hashed[0]] = verify.hash_sources(*hashed)
+    for outpath in hashed_outputs:
+        checksums[outpath] = verify.hash_payload(outpath)
+    progress.log().emit("done", phase="read", take=context["take"], seconds=round(time.perf_counter() - started, 3))
+    return checksums
+
+
+def log_unit(unit: tuple, unit_outputs: [(int, str)], timing: dict) -> None:
+    """
+    Log a unit that finished (in the main process, for the summary)
+    """
+    kind, _, context = unit
+    progress.log().unit_done(unit_phase(kind), context["take"], [p for _, p in unit_outputs], timing["seconds"], context["bytes"], context["duration"], timing["tracks"], context["source"])
+
+
+def create_directories(outputs: [(int, str)]) -> None:
+    """
+    Create the directories of the outputs if they don't exist
+    """
+    for _, patched_outpath in outputs:
+        if not os.path.isdir(patched_outpath):
+            os.makedirs(os.path.dirname(patched_outpath), exist_ok=True)
+
+
+def report_outputs(outputs: [(int, str)], options: dict, notes: dict=None) -> [str]:
+    """
+    Print the written outputs (with their notes) and return their paths
+    """
+    written_to = []
+    for channel, patched_outpath in outputs:
         if not options["dry-run"]:
-            subprocess.check_output(cmd)
-            print("    [{}] -> {}".format(channel, patched_outpath))
+            if notes and patched_outpath in notes:
+                print("    [{}] -> {} ({})".format(channel, patched_outpath, notes[patched_outpath]))
+            else:
+                print("    [{}] -> {}".format(channel, patched_outpath))
             written_to.append(patched_outpath)
         else:
             print("    [{}] -> {} (Dry Run)".format(channel, patched_outpath))
+    return written_to
+
+
+def report_silent(outputs: [(int, str)]) -> None:
+    """
+    Print the outputs that were not written because they are silent
+    """
+    for channel, patched_outpath in outputs:
+        print("    [{}] -> {} (Silent, not written)".format(channel, patched_outpath))
+
+
+def skip_complete(meta: "Metadata", outputs: [(int, str)], options: dict, manifest: "Manifest") -> ([(int, str)], [(int, str)]):
+    """
+    Split the outputs into the ones that still have to be written and the
+    ones the manifest knows as complete. Leftovers of interrupted runs are
+    removed, so they can be written again.
+    """
+    if manifest is None:
+        return outputs, []
+
+    fmt = output_format(meta, options)
+    missing = []
+    complete = []
+    for channel, patched_outpath in outputs:
+        if not options["rewrite"] and manifest.is_complete(meta.filepath, channel, fmt, patched_outpath):
+            complete.append((channel, patched_outpath))
+            continue
+        if manifest.is_interrupted(patched_outpath) and os.path.isfile(patched_outpath):
+            os.remove(patched_outpath)
+        missing.append((channel, patched_outpath))
+    return missing, complete
+
+
+def report_complete(outputs: [(int, str)]) -> [str]:
+    """
+    Print the outputs that were skipped because they are up to date and return their paths
+    """
+    for channel, patched_outpath in outputs:
+        print("    [{}] -> {} (Up to date)".format(channel, patched_outpath))
+    return [patched_outpath for _, patched_outpath in outputs]
+
+
+def record_outputs(meta: "Metadata", outputs: [(int, str)], options: dict, manifest: "Manifest", event: str, checksums: dict=None) -> None:
+    """
+    Append a start or done record for each of the outputs to the manifest,
+    done records get the checksums of the output and the source if known
+    """
+    if manifest is None:
+        return
+    fmt = output_format(meta, options)
+    for channel, patched_outpath in outputs:
+        if event == "start":
+            manifest.start(meta.filepath, channel, fmt, patched_outpath)
+        elif checksums and patched_outpath in checksums:
+            manifest.done(meta.filepath, channel, fmt, patched_outpath, {
+                "md5" : checksums[patched_outpath],
+                "source_md5" : checksums.get(meta.filepath),
+                "source_codec" : meta.codec,
+                "continuations" : [os.path.abspath(p) for p in meta.filepaths[1:]]
+            })
+        else:
+            manifest.done(meta.filepath, channel, fmt, patched_outpath)
+
+
+def process_files(meta: "Metadata", outpath: str, options: dict, manifest: "Manifest"=None) -> [str]:
+    # Construct channel mapping and filenames for output
+    outputs = plan_outputs(meta, outpath, options)
+    return split_outputs(meta, outputs, options, manifest)
+
+
+def split_outputs(meta: "Metadata", outputs: [(int, str)], options: dict, manifest: "Manifest"=None) -> [str]:
+    """
+    Write the planned (channel, outpath) pairs of a take one after the other
+    """
+    # List of paths written to
+    written_to = []
+
+    # Skip what has been written completely by an earlier run
+    if not options["dry-run"]:
+        outputs, complete = skip_complete(meta, outputs, options, manifest)
+        written_to += report_complete(complete)
+
+    # Create Outpaths if they don't exist
+    if not options["dry-run"]:
+        create_directories(outputs)
+
+    # The checksum of the source may only come with the first unit of the take
+    checksums = {}
+    for unit, unit_outputs in work_units(meta, outputs, options):
+        if not options["dry-run"]:
+            record_outputs(meta, unit_outputs, options, manifest, "start")
+            notes, unit_checksums, timing = run_unit(unit)
+            log_unit(unit, unit_outputs, timing)
+            checksums.update(unit_checksums)
+            unit_outputs, silent = sort_silent(meta, unit_outputs, timing)
+            record_outputs(meta, unit_outputs, options, manifest, "done", checksums)
+            report_silent(silent)
+        else:
+            notes = {}
+        written_to += report_outputs(unit_outputs, options, notes)
 
     return written_to
 
 
-def filter_tracks(track: dict, options: dict) -> bool:
+def describe_take(meta: "Metadata", total_takes: int) -> str:
     """
-    Filter out tracks 
+    Return the line that is printed before a take is split
     """
+    filename = meta.filename
+    if meta.continuations:
+        filename = "{} (+{} continuation files)".format(filename, len(meta.continuations))
+    return "\n{} (Take [{}/{}] from {}): Splitting {} ({} channels, Duration: {}) ...".format(meta.scene, meta.take, total_takes, meta.datestring, filename, len(meta.tracks.keys()), meta.duration)
 
-    # Parse all filters for include tracks
-    if options["tracks"] is not None:
-        matches = re.findall(filter_track_pattern, options["tracks"])
-    else:
-        # If there is no filter, just use it
-        return True
 
-    included = False
-    # First exclude
-    for match in matches:
-        # True if match starts with ! and replace it if it exists
-        invert = match.startswith("!")
-        match = match[:1].replace('!', '') + match[1:]
-        # Match for ranges like 1-3
-        if re.match(filter_track_pattern_range, match):
-            start, end = [int(i) for i in match.split("-")]
-            if track["tracknumber"] in range(start, end+1):
-                included = included or True
-        # Match for single digit
-        elif re.match(filter_track_pattern_digit, match):
-            if track["tracknumber"] == int(match):
-                included = included or True
-        # Match for strings
-        elif re.match(filter_track_pattern_word, match):
-            if match.lower() == "all":
-                included = included or True
-            elif match.lower() == "mixdown":
-                if "MixL" in track["trackname"] or "MixR" in track["trackname"]:
-                    included = included or True
-            elif match in track["trackname"]:
-                included = included or True
-
-        # XOR the two bools "included" and "inverted":
-        # Included
-        # |  Invert
-        # |   |     XOR
-        # 0   0   =  0         
-        # 0   1   =  1         
-        # 1   0   =  1         
-        # 1   1   =  0     
-        included = included != invert
-    
-    return included
+def submit_take(scheduler: "IOScheduler", meta: "Metadata", outputs: [(int, str)], options: dict, manifest: "Manifest"=None) -> tuple:
+    """
+    Queue the work units for the planned outputs of a take in the scheduler.
+    Return the submitted take for collect_take.
+    """
+    outputs, complete = skip_complete(meta, outputs, options, manifest)
+    create_directories(outputs)
+    units = work_units(meta, outputs, options)
+    for _, unit_outputs in units:
+        record_outputs(meta, unit_outputs, options, manifest, "start")
+    futures = [scheduler.submit(run_unit, unit, meta.filepaths, [p for _, p in unit_outputs]) for unit, unit_outputs in units]
+    return (meta, complete, units, futures)
+
+
+def collect_take(submitted: tuple, options: dict, total_takes: int, manifest: "Manifest"=None) -> [str]:
+    """
+    Wait for the work units of a submitted take and print its outputs
+    """
+    meta, complete, units, futures = submitted
+    print(describe_take(meta, total_takes))
+    written_to = report_complete(complete)
+    checksums = {}
+    for (unit, unit_outputs), future in zip(units, futures):
+        notes, unit_checksums, timing = future.result()
+        log_unit(unit, unit_outputs, timing)
+        checksums.update(unit_checksums)
+        unit_outputs, silent = sort_silent(meta, unit_outputs, timing)
+        record_outputs(meta, unit_outputs, options, manifest, "done", checksums)
+        report_silent(silent)
+        written_to += report_outputs(unit_outputs, options, notes)
+    return written_to
+
+
+def create_scheduler(executor: "concurrent.futures.Executor", options: dict) -> "IOScheduler":
+    """
+    Return a scheduler that starts the units on the executor within the
+    limits per device
+    """
+    return IOScheduler(executor, options["jobs"], options["device-readers"], options["device-writers"])
+
+
+def process_files_parallel(takes: [("Metadata", [(int, str)])], options: dict, total_takes: int, manifest: "Manifest"=None) -> [str]:
+    """
+    Split the planned (meta, outputs) takes with a pool of options["jobs"]
+    worker processes. The output is printed in the same order as the
+    sequential split, grouped by take. If a unit fails no new units are started and the
+    exception of the failed unit is raised once the running ones ended.
+    """
+    import concurrent.futures
+    written_to = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options["jobs"]) as executor:
+        scheduler = create_scheduler(executor, options)
+        # Queue everything up front, so the pool can be kept busy across takes
+        submitted = [submit_take(scheduler, meta, outputs, options, manifest) for meta, outputs in takes]
+        try:
+            for take in submitted:
+                written_to += collect_take(take, options, total_takes, manifest)
+        except BaseException:
+            # Don't start any further units
+            scheduler.cancel()
+            raise
+        finally:
+            scheduler.close()
+            for line in scheduler.report():
+                print(line)
+
+    return written_to
+
+
+def watch_inpaths(inpaths: [str], outpath: str, options: dict, manifest: "Manifest"=None, cache: "MetadataCache"=None, watcher: "Watcher"=None, polls: int=None) -> [str]:
+    """
+    Stay resident and split every take that lands in one of the inpaths as
+    soon as it has been written completely. Up to options["jobs"] work units
+    run at the same time, the takes are reported in the order they arrived.
+    Runs until interrupted (or for the given number of polls).
+    """
+    import subprocess
+    import concurrent.futures
+    watcher = watcher or Watcher(inpaths, ignore=IGNORE_PATTERNS + tuple(options["ignore"]), recursive=options["recursive"])
+    written_to = []
+    queued = []
+    total_takes = 0
+    print("Watching {} for new takes (Press Ctrl+C to stop) ...".format(", ".join(inpaths)))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options["jobs"]) as executor:
+        scheduler = create_scheduler(executor, options)
+        try:
+            while polls is None or polls > 0:
+                # A file that can't be read is reported once, the watcher only retries it if it changes
+                metas = []
+                for path in watcher.poll():
+                    try:
+                        metas += read_metadatas([path], cache)
+                    except Exception as e:
+                        print("Error:    Skipped {}, it can't be read ({}: {})".format(path, type(e).__name__, e))
+                # Only continuation files that become ready together can be joined
+                if options["stitch"]:
+                    metas = stitch_takes(metas)
+                metas = filter_takes(metas, options)
+                if options["only-circled"]:
+                    metas = [m for m in metas if m.circled]
+
+                for meta in metas:
+                    total_takes += 1
+                    try:
+                        if options["dry-run"]:
+                            print(describe_take(meta, total_takes))
+                            written_to += process_files(meta, outpath, options, manifest)
+                        else:
+                            queued.append(submit_take(scheduler, meta, plan_outputs(meta, outpath, options), options, manifest))
+                    except Exception as e:
+                        print("Error:    Skipped {} ({}: {})".format(meta.filepath, type(e).__name__, e))
+
+                # Report the takes that are done, a failed take doesn't stop the watch
+                while queued and all(future.done() for future in queued[0][3]):
+                    take = queued.pop(0)
+                    try:
+                        written_to += collect_take(take, options, total_takes, manifest)
+                    except (subprocess.CalledProcessError, OSError, wav.WavFormatError) as e:
+                        print("Error:    {}".format(e))
+
+                if polls is not None:
+                    polls -= 1
+                    if polls == 0:
+                        break
+                time.sleep(options["interval"])
+
+            # Wait for what is still running
+            for take in queued:
+                try:
+                    written_to += collect_take(take, options, total_takes, manifest)
+                except (subprocess.CalledProcessError, OSError, wav.WavFormatError) as e:
+                    print("Error:    {}".format(e))
+        except KeyboardInterrupt:
+            scheduler.cancel()
+            print("\nStopped watching, takes that were still running may be incomplete")
+        finally:
+            scheduler.close()
+
+    return written_to
+
+
+def split_takes(takes: [("Metadata", [(int, str)])], options: dict, total_takes: int, manifest: "Manifest"=None) -> [str]:
+    """
+    Split the planned (meta, outputs) takes, with a pool of workers if more
+    than one job is allowed. Return the paths written to.
+    """
+    if options["jobs"] > 1 and not options["dry-run"]:
+        import subprocess
+        try:
+            return process_files_parallel(takes, options, total_takes, manifest)
+        except (subprocess.CalledProcessError, OSError, wav.WavFormatError) as e:
+            print("Error:    {}".format(e))
+            print("Stopped after the running jobs finished, some of the outputs may be incomplete")
+            sys.exit(1)
+
+    import subprocess
+    written_to = []
+    for meta, outputs in takes:
+        print(describe_take(meta, total_takes))
+        try:
+            written_to += split_outputs(meta, outputs, options, manifest)
+        except (subprocess.CalledProcessError, OSError, wav.WavFormatError) as e:
+            print("Error:    {}".format(e))
+            print("Stopped, the outputs of this take may be incomplete")
+            sys.exit(1)
+    return written_to
+
+
+def absolute_metadata(meta: "Metadata") -> dict:
+    """
+    Return the metadata as a dict with absolute paths to the sources
+    """
+    d = meta.to_dict()
+    d["filepath"] = os.path.abspath(meta.filepath)
+    d["continuations"] = [absolute_metadata(c) for c in meta.continuations]
+    return d
+
+
+def build_plan(takes: [("Metadata", [(int, str)])], outpath: str, options: dict) -> dict:
+    """
+    Return the job plan for the planned (meta, outputs) takes as a JSON
+    serializable dict
+    """
+    plan_takes = []
+    for meta, outputs in takes:
+        codec, _ = output_codec(meta, options)
+        sources = [os.path.abspath(p) for p in meta.filepaths]
+        plan_takes.append({
+            "metadata" : absolute_metadata(meta),
+            "sources" : sources,
+            "outputs" : [{
+                "source" : sources[0],
+                "channel" : channel,
+                "codec" : codec,
+                "format" : output_format(meta, options),
+                "destination" : patched_outpath
+            } for channel, patched_outpath in outputs]
+        })
+
+    return {
+        "version" : PLAN_VERSION,
+        "created" : datetime.datetime.now().isoformat(timespec="seconds"),
+        "outpath" : outpath,
+        "options" : {key: options[key] for key in PLAN_OPTIONS},
+        "takes" : plan_takes
+    }
+
+
+def takes_from_plan(plan: dict) -> [("Metadata", [(int, str)])]:
+    """
+    Return the (meta, outputs) takes of a job plan
+    """
+    takes = []
+    for take in plan["takes"]:
+        meta = Metadata.from_dict(take["metadata"])
+        outputs = [(output["channel"], output["destination"]) for output in take["outputs"]]
+        takes.append((meta, outputs))
+    return takes
+
+
+def check_options(outpath: str, options: dict, inpaths: [str]=None) -> (str, str):
+    """
+    Return the (error, solution) of the first problem with OUTPATH and the
+    options, or None if they can be used. Raises a click.UsageError if
+    OUTPATH is missing.
+    """
+    # OUTPATH may only be left out with --execute, --batch and --verify. A
+    # single path is taken as OUTPATH by click, so the INPATHS are missing
+    # then, which is fine only if the takes come from the catalogue.
+    if not any(options[name] is not None for name in ["execute", "batch", "verify"]):
+        if outpath is None or (inpaths is not None and not inpaths and not options["catalogue"]):
+            raise click.UsageError("Missing argument 'OUTPATH'")
+
+    # Check if there is a equal number of replace and with options
+    if len(options["replace"]) != len(options["with"]):
+        return ("You wrote {} \"--replace\" and {} \"--with\" options!".format(len(options["replace"]), len(options["with"])),
+                "Use a \"--with\" option for each \"--replace\" option (same count)")
+
+    # Check OUTPATH for unknown keywords before anything is read
+    try:
+        compile_outpath(outpath, tuple(options["replace"]), tuple(options["with"]))
+    except OutpathError as e:
+        return (str(e), "Use only the keywords listed in \"mixpresplit -h\" or remove the curly braces")
+
+    # The query options select the takes from the catalogue
+    query = [name for name in ["scene", "tape", "since", "until", "track-name"] if options[name] is not None]
+    if query and not options["catalogue"]:
+        return ("\"--{}\" selects takes from the catalogue".format(query[0]),
+                "Add \"--catalogue\" (the INPATHS are added to the catalogue first)")
+    for name in ["since", "until"]:
+        if options[name] is not None and not date_pattern.match(options[name]):
+            return ("\"--{}\" expects a date like 2020-06-01, not \"{}\"".format(name, options[name]),
+                    "Write the date as YYYY-MM-DD")
+
+    # The native splitter only copies the samples, only the FLAC encoders can convert them
+    if options["native"] and not options["flac"] and (options["24"] or options["16"]):
+        return ("\"--native\" can't be combined with \"--24\" or \"--16\" (except with \"--flac\")",
+                "Drop \"--native\" to convert the files with ffmpeg")
+
+    # De-interleaving and measuring the levels is done with numpy
+    if (options["native"] or options["skip-silent"] or options["stats"]) and not wav.numpy_available():
+        return ("\"--native\", \"--skip-silent\" and \"--stats\" need numpy, which is not installed",
+                "Install it with \"pip install mixpresplit[native]\"")
+
+    return None
+
+
+def filter_tracks(track: "Track", options: dict) -> bool:
+    """
+    Filter out tracks 
+    """
+    # If there is no filter, just use it
+    if options["tracks"] is None:
+        return True
+    return compile_filter(options["tracks"]).matches(track.tracknumber, track.trackname)
 
 
 def filter_takes(metas: ["Metadata"], options: dict) -> ["Metadata"]:
     """
     Filter out takes 
     """
-
-    # Parse all filters for include takes
-    if options["takes"] is not None:
-        # Extract patterns from the user input
-        matches = re.findall(filter_take_pattern, options["takes"])
-    else:
-        # No filter has been defined, return all
+    # No filter has been defined, return all
+    if options["takes"] is None:
         return metas
 
-    # Iterate all incoming takes and keep the ones we selected
+    # Keep the takes we selected and print out the ignored ones
+    take_filter = compile_filter(options["takes"])
     filtered_metas = []
     for meta in metas:
-        included = False
-        # Go through each match of the user input
-        for match in matches:
-            # True if match starts with ! and replace it if it exists
-            invert = match.startswith("!")
-            match = match[:1].replace('!', '') + match[1:]
-            # Match for ranges like 1-3
-            if re.match(filter_take_pattern_range, match):
-                start, end = [int(i) for i in match.split("-")]
-                if meta.take in range(start, end+1):
-                    included = included or True
-            # Match for single digit
-            if re.match(filter_take_pattern_digit, match):
-                if meta.take == int(match):
-                    included = included or True
-            # Match for strings
-            if re.match(filter_take_pattern_word, match):
-                if match.lower() == "all":
-                    included = included or True
-
-            # XOR the two bools "included" and "inverted" and append it to the list
-            # Included
-            # |  Invert
-            # |   |     XOR
-            # 0   0   =  0         
-            # 0   1   =  1         
-            # 1   0   =  1         
-            # 1   1   =  0     
-            included = included != invert
-
-        # Use this take if anything matched
-        if included:
+        if take_filter.matches(meta.take):
             filtered_metas.append(meta)
-
-    # Print out the ignored takes
-    for meta in set(metas).difference(set(filtered_metas)):
-        print("Ignoring Take {} ({})".format(meta.take, meta.duration))
+        else:
+            print("Ignoring Take {} ({})".format(meta.take, meta.duration))
 
     return filtered_metas
 
@@ -465,6 +1312,8 @@ def open_filebrowser(written_to: [str]) -> None:
     # Find the biggest common path
     directory = find_common_dir(written_to)
     # Open system specific browser
+    import platform
+    import subprocess
     if platform.system() == "Windows":
         os.startfile(directory)
     elif platform.system() == "Darwin":
@@ -476,7 +1325,7 @@ def open_filebrowser(written_to: [str]) -> None:
 
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click.argument('inpaths', nargs=-1)
-@click.argument('outpath', nargs=1)
+@click.argument('outpath', nargs=1, required=False)
 @click.option('--overwrite/-y', is_flag=True, help="Overwrite existing files without asking")
 @click.option('--only-circled', is_flag=True, help="Use only circled takes")
 @click.option('--replace', multiple=True, help="Replace this string in OUTPATH")
@@ -488,7 +1337,40 @@ def open_filebrowser(written_to: [str]) -> None:
 @click.option('--flac', is_flag=True, help="Use FLAC instead of WAV for output")
 @click.option('--24', "bit24", is_flag=True, help="Output as 24 bit audio")
 @click.option('--16', "bit16", is_flag=True, help="Output as 16 bit audio")
-def main(inpaths, outpath, overwrite, only_circled, replace, with_, dry_run, open_, flac, bit24, bit16, tracks, takes):
+@click.option('--single-pass', is_flag=True, help="Read each polywav only once for all of its tracks")
+@click.option('--native', is_flag=True, help="Split in-process without ffmpeg (with --flac: feed parallel FLAC encoders)")
+@click.option('--flac-level', type=click.IntRange(0, 12), help="FLAC compression level (0-12, default: ffmpeg's default of 5)")
+@click.option('--flac-block-size', type=click.IntRange(16, 65535), help="FLAC block size in samples (default: chosen by ffmpeg)")
+@click.option('--flac-encoders', type=click.IntRange(min=1), help="Number of FLAC encoders per take with --native --flac (default: number of CPUs)")
+@click.option('--skip-silent', is_flag=True, help="Don't write tracks that are silent (see --silence-threshold). Measured while splitting, without --native the take is read once more for it")
+@click.option('--silence-threshold', default=-60.0, type=click.FloatRange(max=0.0), help="Tracks that peak below this level in dBFS are silent (default: -60)")
+@click.option('--checksums', is_flag=True, help="Store checksums of the sources and outputs in the manifest (see --verify)")
+@click.option('--verify', 'verify_path', help="Don't split, check the outputs in the manifest of this directory against their checksums and sources")
+@click.option('--stats', 'stats_', is_flag=True, help="Write the levels (.json) and a waveform overview (.dat) next to each track")
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), help="Number of tracks/takes to split at the same time")
+@click.option('--device-readers', default=READERS_PER_DEVICE, type=click.IntRange(min=1), help="Number of files read at the same time from one device with --jobs (default: {})".format(READERS_PER_DEVICE))
+@click.option('--device-writers', default=WRITERS_PER_DEVICE, type=click.IntRange(min=1), help="Number of jobs writing at the same time to one device (default: {})".format(WRITERS_PER_DEVICE))
+@click.option('--events', 'events_path', help="Log progress events as JSON lines to this file (- for stderr)")
+@click.option('--summary', is_flag=True, help="Print the slowest takes and tracks at the end")
+@click.option('--no-preflight', is_flag=True, help="Start even if the outputs don't fit on the destination")
+@click.option('--no-cache', is_flag=True, help="Don't use the cache of already scanned files")
+@click.option('--flat', is_flag=True, help="Only use the wav files right in INPATHS, not in the folders below")
+@click.option('--ignore', multiple=True, help="Skip files and folders matching this pattern (e.g. \"Backup*\"), junk like .Trashes and ._* files is always skipped")
+@click.option('--catalogue', is_flag=True, help="Add INPATHS to the catalogue and select the takes from it (see --scene, --tape, --since, --until, --track-name)")
+@click.option('--scene', help="With --catalogue only use takes of this scene")
+@click.option('--tape', help="With --catalogue only use takes of this tape")
+@click.option('--since', help="With --catalogue only use takes recorded on or after this date (YYYY-MM-DD)")
+@click.option('--until', help="With --catalogue only use takes recorded on or before this date (YYYY-MM-DD)")
+@click.option('--track-name', help="With --catalogue only use takes with a track whose name contains this")
+@click.option('--rewrite', is_flag=True, help="Write all files again, even if they are up to date")
+@click.option('--stitch/--no-stitch', default=True, help="Join takes that were split into several files (default: stitch)")
+@click.option('--watch', is_flag=True, help="Keep running and split new takes as soon as they have been written")
+@click.option('--interval', default=2.0, type=click.FloatRange(min=0.1), help="Seconds between two checks for new takes with --watch")
+@click.option('--plan', 'plan_path', help="Don't split, write the job plan to this JSON file")
+@click.option('--execute', 'execute_path', help="Split as planned in this JSON file (instead of INPATHS and OUTPATH)")
+@click.option('--shard', help="With --execute only split this share of the plan (e.g. 2/4)")
+@click.option('--batch', 'batch_path', help="Run the jobs in this file (one line of INPATHS, OUTPATH and options per job, - for stdin) in one process")
+def main(inpaths, outpath, overwrite, only_circled, replace, with_, dry_run, open_, flac, bit24, bit16, tracks, takes, single_pass, native, flac_level, flac_block_size, flac_encoders, skip_silent, silence_threshold, checksums, verify_path, stats_, jobs, device_readers, device_writers, events_path, summary, no_preflight, no_cache, flat, ignore, catalogue, scene, tape, since, until, track_name, rewrite, stitch, watch, interval, plan_path, execute_path, shard, batch_path):
     """
         ============================ MIXPRESPLIT ================================
         This is a CLI-Utility that helps splitting polyWav files that are made by a Sounddevices MixPre Recorder.
@@ -530,25 +1412,94 @@ def main(inpaths, outpath, overwrite, only_circled, replace, with_, dry_run, ope
         "open" : open_,
         "flac" : flac,
         "24" : bit24,
-        "16" : bit16
+        "16" : bit16,
+        "single-pass" : single_pass,
+        "native" : native,
+        "flac-level" : flac_level,
+        "flac-block-size" : flac_block_size,
+        "flac-encoders" : flac_encoders,
+        "skip-silent" : skip_silent,
+        "silence-threshold" : silence_threshold,
+        "checksums" : checksums,
+        "verify" : verify_path,
+        "stats" : stats_,
+        "jobs" : jobs,
+        "device-readers" : device_readers,
+        "device-writers" : device_writers,
+        "events" : events_path,
+        "summary" : summary,
+        "preflight" : not no_preflight,
+        "cache" : not no_cache,
+        "recursive" : not flat,
+        "ignore" : ignore,
+        "catalogue" : catalogue,
+        "scene" : scene,
+        "tape" : tape,
+        "since" : since,
+        "until" : until,
+        "track-name" : track_name,
+        "rewrite" : rewrite,
+        "stitch" : stitch,
+        "watch" : watch,
+        "interval" : interval,
+        "plan" : plan_path,
+        "execute" : execute_path,
+        "shard" : shard,
+        "batch" : batch_path
     }
 
+    # Run many jobs without starting the interpreter for each
+    if options["batch"] is not None:
+        run_batch(inpaths, outpath, options)
+        return
 
-    # Check if there is a equal number of replace and with options, warn and exit if not
-    if len(options["replace"]) != len(options["with"]):
-        print("Error:    You wrote {} \"--replace\" and {} \"--with\" options!".format(len(options["replace"]), len(options["with"])))
-        print("Solution: Use a \"--with\" option for each \"--replace\" option (same count)")
+
+    # Log the phases of the run (and start with empty timings)
+    progress.open_log(options["events"])
+
+    # Check a destination that was written with --checksums
+    if options["verify"] is not None:
+        verify_destination(inpaths, outpath, options)
+        return
+
+    # Split as planned before, without reading the sources again
+    if options["execute"] is not None:
+        execute_plan(inpaths, outpath, options)
+        return
+
+    # Check the arguments before anything is read
+    problem = check_options(outpath, options, inpaths)
+    if problem is not None:
+        print("Error:    {}".format(problem[0]))
+        print("Solution: {}".format(problem[1]))
         exit()
+
+    # Stay resident and split the takes as they arrive
+    if options["watch"]:
+        cache = MetadataCache() if options["cache"] else None
+        manifest = None
+        if not options["dry-run"]:
+            manifest = Manifest(manifest_directory(outpath))
+        written_to = watch_inpaths(inpaths, outpath, options, manifest, cache)
+        print_summary(options)
+        if options["open"] and not options["dry-run"]:
+            open_filebrowser(written_to)
+        return
     
-    # Get a flat list of wavfiles from all inpaths
-    infiles = []
-    for inpath in inpaths:
-        wavs = get_wavs_files(inpath)
-        for wav in wavs:
-            infiles.append(wav)
+    started = time.perf_counter()
+    if options["catalogue"]:
+        # Select the takes by a query of the catalogue (updated with the inpaths)
+        metas = catalogue_metadatas(inpaths, options)
+        progress.log().emit("done", phase="scan", files=len(metas), seconds=round(time.perf_counter() - started, 3))
+    else:
+        # Read the track metadata of the wav files while they are found
+        cache = MetadataCache() if options["cache"] else None
+        metas = scan_inpaths(inpaths, options, cache)
+        progress.log().emit("done", phase="scan", files=len(metas), seconds=round(time.perf_counter() - started, 3))
 
-    # Read the track metadata
-    metas = [read_metadata(i) for i in infiles]
+    # Join takes the recorder split into several files
+    if options["stitch"]:
+        metas = stitch_takes(metas)
 
     # Filter by takes
     metas = filter_takes(metas, options)
@@ -562,15 +1513,29 @@ def main(inpaths, outpath, overwrite, only_circled, replace, with_, dry_run, ope
     if options["only-circled"]:
         metas = [m for m in metas if m.circled]
 
-    # Stores the paths that are beeing written to
-    written_to = []
-    
+    # Construct channel mapping and filenames for the outputs of each take
+    started = time.perf_counter()
+    takes = [(meta, plan_outputs(meta, outpath, options)) for meta in metas]
+    progress.log().emit("done", phase="plan", takes=len(takes), outputs=sum(len(outputs) for _, outputs in takes), bytes=source_bytes(takes), seconds=round(time.perf_counter() - started, 3))
+
+    # Write the plan for a later --execute instead of splitting
+    if options["plan"] is not None:
+        plan = build_plan(takes, outpath, options)
+        write_plan(options["plan"], plan)
+        print("Wrote the plan for {} take(s) with {} output(s) to {}".format(len(takes), sum(len(outputs) for _, outputs in takes), options["plan"]))
+        return
+
+    # Remember what has been written, so an interrupted run can be resumed
+    manifest = None
+    if not options["dry-run"]:
+        manifest = Manifest(manifest_directory(outpath))
+
+    # Don't start what can't be completed
+    if options["preflight"]:
+        run_preflight(takes, options, manifest)
+
     # Split the polywavs
-    for meta in metas:
-        print("\n{} (Take [{}/{}] from {}): Splitting {} ({} channels, Duration: {}) ...".format(meta.scene, meta.take, total_takes, meta.datestring, meta.filename, len(meta.tracks.keys()), meta.duration))
-        written_to_for_meta = process_files(meta, outpath, options)
-        for p in written_to_for_meta:
-            written_to.append(p)
+    written_to = split_measured(takes, options, total_takes, manifest)
 
     if options["open"]:
         if not options["dry-run"]:
@@ -579,6 +1544,268 @@ def main(inpaths, outpath, overwrite, only_circled, replace, with_, dry_run, ope
             print("Note: Didn't open filebrowser because no files have been written (dry-run)")
 
 
+def execute_plan(inpaths: [str], outpath: str, options: dict) -> None:
+    """
+    Split the takes of the plan given with --execute (or a shard of them)
+    """
+    if inpaths or outpath is not None:
+        print("Error:    \"--execute\" takes the sources and OUTPATH from the plan")
+        print("Solution: Drop INPATHS and OUTPATH or create a new plan with \"--plan\"")
+        exit()
+
+    try:
+        plan = read_plan(options["execute"])
+        takes = takes_from_plan(plan)
+        total_takes = len(takes)
+        if options["shard"] is not None:
+            index, count = parse_shard(options["shard"])
+            weights = [meta.samplecount * meta.channels for meta, _ in takes]
+            takes = shard_takes(takes, index, count, weights)
+        # A machine only needs the sources of its own shard
+        check_sources([path for meta, _ in takes for path in meta.filepaths])
+    except PlanError as e:
+        print("Error:    {}".format(e))
+        print("Solution: Create a new plan with \"--plan\" and pass it to \"--execute\"")
+        exit()
+
+    # The format of the outputs is decided by the plan, "--overwrite" can be added
+    options = dict(options)
+    for key in PLAN_OPTIONS:
+        if key == "overwrite":
+            options[key] = plan["options"].get(key) or options[key]
+        else:
+            options[key] = plan["options"].get(key)
+
+    problem = check_options(plan["outpath"], options)
+    if problem is not None:
+        print("Error:    {}".format(problem[0]))
+        print("Solution: {}".format(problem[1]))
+        exit()
+
+    print("Processing {} of {} planned take(s)".format(len(takes), total_takes))
+    manifest = None
+    if not options["dry-run"]:
+        manifest = Manifest(manifest_directory(plan["outpath"]))
+    if options["preflight"]:
+        run_preflight(takes, options, manifest)
+    written_to = split_measured(takes, options, total_takes, manifest)
+
+    if options["open"] and not options["dry-run"]:
+        open_filebrowser(written_to)
+
+
+def read_batch(path: str) -> [(int, [str])]:
+    """
+    Return the (line number, arguments) of the jobs in a batch file. Each
+    line is split like a shell would, empty lines and comments are skipped.
+    """
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+
+    jobs = []
+    for number, line in enumerate(lines, 1):
+        args = shlex.split(line, comments=True)
+        if not args:
+            continue
+        if "--batch" in args:
+            raise ValueError("line {} of {} starts another batch".format(number, path))
+        jobs.append((number, args))
+    return jobs
+
+
+def run_batch(inpaths: [str], outpath: str, options: dict) -> None:
+    """
+    Run the jobs of the file given with --batch one after the other, as if
+    mixpresplit was called with the arguments of each line. A job that
+    fails doesn't stop the others, the batch exits with 1 if any failed.
+    """
+    if inpaths or outpath is not None:
+        print("Error:    \"--batch\" takes INPATHS and OUTPATH of each job from the batch file")
+        print("Solution: Drop INPATHS and OUTPATH or add them as a line to the batch file")
+        exit()
+
+    try:
+        jobs = read_batch(options["batch"])
+    except (OSError, ValueError) as e:
+        print("Error:    Couldn't read the batch file: {}".format(e))
+        print("Solution: Write one job per line, e.g. \"/media/card /media/nas/{take} --takes 4\"")
+        exit()
+
+    # (line number, message) of the jobs that failed
+    failed = []
+    for n, (number, args) in enumerate(jobs, 1):
+        print("\n=== Job [{}/{}]: {}".format(n, len(jobs), " ".join(shlex.quote(a) for a in args)))
+        try:
+            main.main(args=args, prog_name="mixpresplit", standalone_mode=False)
+        except click.ClickException as e:
+            e.show()
+            failed.append((number, e.format_message()))
+        except (click.Abort, SystemExit):
+            # Errors of a job end with exit() after printing a solution
+            failed.append((number, "see the error above"))
+        except Exception as e:
+            # Anything unexpected only ends this job
+            message = "{}: {}".format(type(e).__name__, e)
+            print("Error:    {}".format(message))
+            failed.append((number, message))
+
+    print("\n{} of {} job(s) done, {} failed".format(len(jobs) - len(failed), len(jobs), len(failed)))
+    if failed:
+        print("Failed jobs in lines: {}".format(", ".join(str(number) for number, _ in failed)))
+        for number, message in failed:
+            print("    Line {}: {}".format(number, message))
+        sys.exit(1)
+
+
+def output_sizes(takes: [("Metadata", [(int, str)])], options: dict, manifest: "Manifest"=None) -> [(str, int, bool)]:
+    """
+    Return the (outpath, bytes, estimated) space each output still needs,
+    estimated is False where the bytes are an upper bound (WAV without
+    sidecars). Outputs the manifest knows as complete need none, files that
+    are overwritten free their current size.
+    """
+    sizes = []
+    for meta, outputs in takes:
+        if meta.samplecount is None:
+            continue
+        bits = output_bits(meta, options)
+        fmt = output_format(meta, options)
+        for channel, patched_outpath in outputs:
+            if manifest is not None and not options["rewrite"] and manifest.is_complete(meta.filepath, channel, fmt, patched_outpath):
+                continue
+            if options["flac"]:
+                size, estimated = preflight.flac_bytes(meta.samplecount, bits), True
+            else:
+                size, estimated = preflight.wav_bytes(meta.samplecount, bits), False
+            if options["stats"]:
+                size += 2 * (meta.samplecount // stats.SAMPLES_PER_PIXEL + 1) + 4096
+                estimated = True
+            if options["overwrite"] and os.path.isfile(patched_outpath):
+                size -= os.path.getsize(patched_outpath)
+            sizes.append((patched_outpath, size, estimated))
+    return sizes
+
+
+def throughput_key(options: dict) -> str:
+    """
+    Return the mode the throughput of a run is measured for
+    """
+    if options["native"]:
+        mode = "native"
+    elif options["single-pass"]:
+        mode = "single-pass"
+    else:
+        mode = "ffmpeg"
+    for key in ["flac", "24", "16"]:
+        if options[key]:
+            mode += "/" + key
+    return "{}/j{}".format(mode, options["jobs"])
+
+
+def source_bytes(takes: [("Metadata", [(int, str)])]) -> int:
+    """
+    Return the bytes of samples of the takes that have outputs
+    """
+    return sum(meta.samplecount * meta.channels * wav.NATIVE_CODECS.get(meta.codec, (None, 32))[1] // 8 for meta, outputs in takes if outputs and meta.samplecount)
+
+
+def run_preflight(takes: [("Metadata", [(int, str)])], options: dict, manifest: "Manifest"=None) -> None:
+    """
+    Print the space the outputs need on each filesystem and the estimated
+    duration. Exits if the outputs don't fit (except for dry runs).
+    """
+    devices = preflight.space_by_device(output_sizes(takes, options, manifest))
+    for space in devices:
+        print("Needs {}{} for {} output(s) on {} ({} free)".format("about " if space.estimated else "up to ", preflight.format_bytes(space.needed), space.outputs, space.directory, preflight.format_bytes(space.free)))
+
+    rate = preflight.ThroughputHistory().get(throughput_key(options))
+    if rate is not None and devices:
+        seconds = source_bytes(takes) / rate
+        print("Estimated duration: {} (at {}/s measured in earlier runs)".format(datetime.timedelta(seconds=round(seconds)), preflight.format_bytes(rate)))
+
+    full = [space for space in devices if not space.fits]
+    if full and not options["dry-run"]:
+        for space in full:
+            print("Error:    Not enough space on {}, an estimated {} are needed but only {} are free".format(space.directory, preflight.format_bytes(space.needed), preflight.format_bytes(space.free)))
+        print("Solution: Free some space, split fewer takes/tracks or pass \"--no-preflight\" to start anyway")
+        exit()
+
+
+def split_measured(takes: [("Metadata", [(int, str)])], options: dict, total_takes: int, manifest: "Manifest"=None) -> [str]:
+    """
+    Split the takes, remember the throughput for later estimates and print
+    the summary if asked for
+    """
+    started = time.perf_counter()
+    written_to = split_takes(takes, options, total_takes, manifest)
+    seconds = time.perf_counter() - started
+    if not options["dry-run"]:
+        preflight.ThroughputHistory().record(throughput_key(options), source_bytes(takes), seconds)
+        duration = sum(meta.total_seconds for meta, outputs in takes if outputs)
+        progress.log().emit("done", phase="split", takes=len(takes), outputs=len(written_to), seconds=round(seconds, 3), bytes=source_bytes(takes), realtime=progress.realtime(duration, seconds))
+        print_summary(options)
+    return written_to
+
+
+def print_summary(options: dict) -> None:
+    """
+    Print the slowest takes and tracks of the run (with --summary)
+    """
+    lines = progress.summary_lines(progress.log())
+    if options["summary"] and lines:
+        print("")
+        for line in lines:
+            print(line)
+
+
+def verify_destination(inpaths: [str], outpath: str, options: dict) -> None:
+    """
+    Check the outputs in the manifest of the directory given with --verify
+    against their checksums and sources, one take per job
+    """
+    if inpaths or outpath is not None:
+        print("Error:    \"--verify\" takes the outputs from the manifest of the given directory")
+        print("Solution: Drop INPATHS and OUTPATH")
+        exit()
+
+    manifest = Manifest(options["verify"])
+    records = [r for r in manifest.records.values() if r["event"] == "done"]
+    checked = [r for r in records if "md5" in r]
+    if not checked:
+        print("Error:    There are no checksums in {}".format(manifest.path))
+        print("Solution: Split into this directory with \"--checksums\" first")
+        exit()
+
+    # Group the outputs by take, so each source is read only once
+    takes = OrderedDict()
+    for record in checked:
+        takes.setdefault((record["source"], tuple(record.get("continuations", []))), []).append(record)
+
+    print("Verifying {} output(s) of {} take(s) in {}".format(len(checked), len(takes), options["verify"]))
+    if len(records) > len(checked):
+        print("    Skipping {} output(s) that were written without checksums".format(len(records) - len(checked)))
+
+    import concurrent.futures
+    from mixpresplit import verify
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options["jobs"]) as executor:
+        for (source, _), results in zip(takes.keys(), executor.map(verify.verify_take, takes.values())):
+            print("\n{}:".format(source))
+            for output, problem in results:
+                if problem is None:
+                    print("    {} (OK)".format(output))
+                else:
+                    print("    {} (Failed: {})".format(output, problem))
+                    failed += 1
+
+    print("\n{} of {} output(s) verified, {} failed".format(len(checked) - failed, len(checked), failed))
+    if failed:
+        sys.exit(1)
+
+
 
 
 if __name__ == "__main__":
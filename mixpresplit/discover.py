@@ -0,0 +1,135 @@
+#-*- coding: utf-8 -*-
+"""
+Discovery of the wav files in the INPATHS.
+
+Cards and archives hold the recordings in nested project folders, next to
+the junk operating systems leave on removable media (.Trashes, ._ files
+with the resource forks of macOS, ...), which are not recordings and can't
+be read as such. The INPATHS are walked recursively with os.scandir, the
+folders are listed by a few threads at the same time and the paths are
+handed on as soon as they are found, so reading the headers of the first
+files overlaps with listing the rest.
+
+Files and folders that match one of the ignore patterns are skipped, as
+are folders with a manifest below the INPATHS: those hold the outputs of
+an earlier split. Each file and folder is visited only once, even if it
+can be reached by several INPATHS or symlinks (they are told apart by
+device and inode).
+"""
+
+import os
+import fnmatch
+
+from mixpresplit.manifest import MANIFEST_NAME
+
+
+# Names of files and folders that are never recordings (shell style patterns)
+IGNORE_PATTERNS = (".Trash*", ".Trashes", "._*", ".Spotlight-V100", ".fseventsd", ".TemporaryItems", ".DocumentRevisions-V100", "$RECYCLE.BIN", "System Volume Information")
+
+# Number of folders that are listed at the same time
+DISCOVERY_WORKERS = 4
+
+
+def is_ignored(name: str, patterns: [str]=IGNORE_PATTERNS) -> bool:
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def is_wav(name: str) -> bool:
+    return name.lower().endswith(".wav")
+
+
+def file_key(stat: os.stat_result) -> (int, int):
+    """
+    Return what tells files and folders apart, even behind links
+    """
+    return stat.st_dev, stat.st_ino
+
+
+class Discovery():
+    def __init__(self, recursive: bool=True, ignore: [str]=IGNORE_PATTERNS, workers: int=DISCOVERY_WORKERS) -> "Discovery":
+        self.recursive = recursive
+        self.ignore = tuple(ignore)
+        self.workers = workers
+        # (st_dev, st_ino) of the files and folders found so far
+        self.seen = set()
+
+    def first_visit(self, key: (int, int)) -> bool:
+        """
+        True if the file or folder hasn't been found before
+        """
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+    def list_directory(self, directory: str, top: bool=False) -> ((int, int), [(str, (int, int))], [str]):
+        """
+        Return the key of a folder, its wav files (with their keys) and the
+        folders to descend into. The key is None if the folder can't be
+        listed, only a folder that can't be listed at the top raises an
+        OSError. Safe to call from several threads, nothing is marked as
+        found here (see visit).
+        """
+        try:
+            key = file_key(os.stat(directory))
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            if top:
+                raise
+            return None, [], []
+
+        # The outputs of an earlier split are no recordings
+        if not top and any(entry.name == MANIFEST_NAME for entry in entries):
+            return key, [], []
+
+        files = []
+        directories = []
+        for entry in entries:
+            if is_ignored(entry.name, self.ignore):
+                continue
+            try:
+                if entry.is_dir():
+                    if self.recursive:
+                        directories.append(entry.path)
+                elif is_wav(entry.name) and entry.is_file():
+                    files.append((entry.path, file_key(entry.stat())))
+            except OSError:
+                continue
+        return key, files, directories
+
+    def visit(self, listing: tuple) -> ([str], [str]):
+        """
+        Return the files of a listing that haven't been found before and the
+        folders to descend into, nothing if the folder was visited already
+        """
+        key, files, directories = listing
+        if key is None or not self.first_visit(key):
+            return [], []
+        return [path for path, file in files if self.first_visit(file)], directories
+
+    def walk(self, inpaths: [str]):
+        """
+        Yield the paths of the wav files in the inpaths as they are found.
+        The folders are listed in parallel but visited in order, so the
+        same path of a file that can be reached twice wins on every run.
+        """
+        import concurrent.futures
+        from collections import deque
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque(executor.submit(self.list_directory, inpath, True) for inpath in inpaths)
+            try:
+                while pending:
+                    files, directories = self.visit(pending.popleft().result())
+                    pending.extend(executor.submit(self.list_directory, d) for d in directories)
+                    yield from files
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+def discover(inpaths: [str], recursive: bool=True, ignore: [str]=IGNORE_PATTERNS):
+    """
+    Yield the paths of the wav files in the inpaths (see Discovery)
+    """
+    return Discovery(recursive, ignore).walk(inpaths)
@@ -0,0 +1,83 @@
+#-*- coding: utf-8 -*-
+"""
+Compiled filters for --tracks and --takes.
+
+A filter is parsed once into a list of tokens. Its result only depends on
+the number (and name) of a track or take, so it is remembered for each of
+them and evaluating a filter again is a single dict lookup.
+"""
+
+import re
+import functools
+
+
+# A filter is a list of ranges (1-3), numbers (4) and words (foo), each optionally inverted (!)
+filter_token_pattern = re.compile(r'(!?\d+-\d+|!?\d+|!?[A-z0-9-_]+)')
+filter_range_pattern = re.compile(r'^(\d+)-(\d+)$')
+filter_number_pattern = re.compile(r'^\d+$')
+
+
+class Filter():
+    def __init__(self, text: str) -> "Filter":
+        self.text = text
+        # List of (invert, kind, value)
+        self.tokens = []
+        # Results by (number, name)
+        self.results = {}
+
+        for token in filter_token_pattern.findall(text):
+            invert = token.startswith("!")
+            token = token.lstrip("!")
+            range_match = filter_range_pattern.match(token)
+            if range_match is not None:
+                start, end = int(range_match.group(1)), int(range_match.group(2))
+                self.tokens.append((invert, "range", (start, end)))
+            elif filter_number_pattern.match(token):
+                self.tokens.append((invert, "range", (int(token), int(token))))
+            elif token.lower() == "all":
+                self.tokens.append((invert, "all", None))
+            elif token.lower() == "mixdown":
+                self.tokens.append((invert, "mixdown", None))
+            else:
+                self.tokens.append((invert, "word", token))
+
+    def token_matches(self, kind: str, value, number: int, name: str) -> bool:
+        if kind == "range":
+            return value[0] <= number <= value[1]
+        if kind == "all":
+            return True
+        # Names are only known for tracks
+        if name is None:
+            return False
+        if kind == "mixdown":
+            return "MixL" in name or "MixR" in name
+        return value in name
+
+    def evaluate(self, number: int, name: str=None) -> bool:
+        """
+        Apply the tokens from left to right: once a token matched the item
+        is included, every inverted token flips the result
+        """
+        included = False
+        for invert, kind, value in self.tokens:
+            included = included or self.token_matches(kind, value, number, name)
+            included = included != invert
+        return included
+
+    def matches(self, number: int, name: str=None) -> bool:
+        key = (number, name)
+        result = self.results.get(key)
+        if result is None:
+            result = self.results[key] = self.evaluate(number, name)
+        return result
+
+    def __repr__(self) -> str:
+        return "Filter({!r})".format(self.text)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_filter(text: str) -> "Filter":
+    """
+    Return the compiled filter for the text, each text is only parsed once
+    """
+    return Filter(text)
@@ -0,0 +1,180 @@
+#-*- coding: utf-8 -*-
+"""
+FLAC encoding with a single decode of the polywav.
+
+The polywav is de-interleaved in-process like with the native splitter and
+each channel is streamed through a pipe into its own ffmpeg FLAC encoder,
+so the encoders run in parallel on all cores while the source is read only
+once. If a take has more tracks than encoders may run at the same time,
+the tracks are encoded in batches and the source is read once per batch.
+"""
+
+import os
+import time
+import queue
+import tempfile
+import threading
+import subprocess
+
+from mixpresplit import wav, stats, verify
+
+
+# Number of blocks that may wait for an encoder before the decoder blocks
+QUEUE_BLOCKS = 8
+
+
+def default_encoders() -> int:
+    return os.cpu_count() or 1
+
+
+class EncoderPipe():
+    """
+    A running encoder that is fed through a queue by a thread of its own,
+    so writing to one encoder doesn't hold up the others
+    """
+    def __init__(self, cmd: [str]) -> "EncoderPipe":
+        self.cmd = cmd
+        self.errors = tempfile.TemporaryFile()
+        self.queue = queue.Queue(maxsize=QUEUE_BLOCKS)
+        self.started = time.perf_counter()
+        self.finished = None
+        self.broken = False
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.errors)
+        self.thread = threading.Thread(target=self.feed, daemon=True)
+        self.thread.start()
+
+    def feed(self) -> None:
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.broken:
+                continue
+            try:
+                self.process.stdin.write(data)
+            except (BrokenPipeError, OSError):
+                # The encoder failed, its exit code tells why
+                self.broken = True
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.wait()
+        self.finished = time.perf_counter()
+
+    def write(self, data: bytes) -> None:
+        self.queue.put(data)
+
+    def close(self) -> None:
+        """
+        Wait for the encoder, raises a CalledProcessError if it failed
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.errors.seek(0)
+        stderr = self.errors.read()
+        self.errors.close()
+        if self.process.returncode != 0:
+            raise subprocess.CalledProcessError(self.process.returncode, self.cmd, stderr=stderr)
+
+    @property
+    def seconds(self) -> float:
+        return self.finished - self.started
+
+
+def encode_flac(path: str, codec: str, encoders: [(int, str, [str])], workers: int, block_frames: int=wav.BLOCK_FRAMES, continuations: [str]=(), measure: bool=False, checksums: dict=None, progress=None, silence_threshold: float=None) -> dict:
+    """
+    Encode the (channel, outpath, encoder command) triples of the polywav at
+    path with at most workers encoders at the same time. The encoder
+    commands have to read the raw samples of one channel from stdin.
+    With measure the sidecars of each batch are computed from its blocks.
+    If a dict is passed as checksums, the checksum of the samples of the
+    take (taken while the first batch reads them) is stored in it under
+    path and the one of each written file under its outpath. progress is
+    called with the fraction that is done after each block.
+    With a silence_threshold (in dBFS) the peaks of all channels are taken
+    from the blocks of the first batch: its silent outputs are removed and
+    the encoders of silent outputs in later batches are not started.
+    Returns the encode speed (times realtime) of each outpath that was
+    written (and kept).
+    """
+    parts, channels, samplerate, _ = wav.read_parts(path, codec, continuations)
+    sample_size = wav.NATIVE_CODECS[codec][1] // 8
+    frame_count = sum(frames for _, _, frames in parts)
+    duration = frame_count / samplerate
+    batches = -(-len(encoders) // workers)
+
+    speeds = {}
+    silent = []
+    for start in range(0, len(encoders), workers):
+        batch = [encoder for encoder in encoders[start:start + workers] if encoder[1] not in silent]
+        if not batch:
+            continue
+        outputs = [(channel, outpath) for channel, outpath, _ in batch]
+        pipes = []
+        hooks = []
+        if silence_threshold is not None and start == 0:
+            peaks = wav.PeakMeter(channels, codec)
+            hooks.append(peaks.add_block)
+        if measure:
+            meter = stats.TrackMeter([channel for channel, _ in outputs], samplerate)
+            hooks.append(lambda block: meter.add_block(block, codec))
+        if checksums is not None and start == 0:
+            source_hash = verify.new_hash()
+            hooks.append(source_hash.update)
+        if progress is not None:
+            # Each batch reads the whole take
+            done = [start // workers * frame_count]
+            def count(block):
+                done[0] += len(block)
+                progress(done[0] / max(batches * frame_count, 1))
+            hooks.append(count)
+
+        def on_block(block):
+            for hook in hooks:
+                hook(block)
+
+        try:
+            for _, _, cmd in batch:
+                pipes.append(EncoderPipe(cmd))
+            for part, data_offset, frames in parts:
+                with open(part, "rb") as f:
+                    wav.write_blocks(f, data_offset, frames, channels, sample_size, outputs, pipes, block_frames, on_block if hooks else None)
+        except BaseException:
+            # Stop the encoders without hiding the error of the decode
+            for pipe in pipes:
+                try:
+                    pipe.close()
+                except Exception:
+                    pass
+            raise
+
+        # Let all encoders of the batch finish before reporting a failure
+        failure = None
+        for pipe in pipes:
+            try:
+                pipe.close()
+            except subprocess.CalledProcessError as e:
+                failure = failure or e
+        if failure is not None:
+            raise failure
+
+        if silence_threshold is not None and start == 0:
+            silent = peaks.silent([(channel, outpath) for channel, outpath, _ in encoders], silence_threshold)
+            for _, outpath in outputs:
+                if outpath in silent:
+                    os.remove(outpath)
+        if measure:
+            stats.write_sidecars(meter, [outpath for _, outpath in outputs], silent)
+        if checksums is not None:
+            if start == 0:
+                checksums[path] = source_hash.hexdigest()
+            # The encoded files are only known once the encoders are done
+            for _, outpath in outputs:
+                if outpath not in silent:
+                    checksums[outpath] = verify.hash_payload(outpath)
+        for (_, outpath), pipe in zip(outputs, pipes):
+            if outpath not in silent:
+                speeds[outpath] = duration / max(pipe.seconds, 1e-9)
+
+    return speeds
@@ -0,0 +1,122 @@
+#-*- coding: utf-8 -*-
+"""
+Manifest of the outputs written to a destination.
+
+The manifest is a JSON lines file in the destination directory. Before an
+output is written a "start" record is appended, after it has been written
+completely a "done" record with its size and modification time follows.
+A later run can then skip outputs that are complete and still unchanged,
+and knows that outputs which were started but never finished are leftovers
+of an interrupted run that can safely be written again. With --checksums
+the done records also hold the checksums of the output and its source
+(see verify.py).
+"""
+
+import os
+import json
+
+
+MANIFEST_NAME = ".mixpresplit-manifest.jsonl"
+
+
+def manifest_directory(outpath: str) -> str:
+    """
+    Return the deepest directory of OUTPATH that doesn't depend on any keyword
+    """
+    static = outpath.split("{", 1)[0]
+    return os.path.abspath(os.path.dirname(static) or ".")
+
+
+class Manifest():
+    def __init__(self, directory: str) -> "Manifest":
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.records = {}
+        self.load()
+
+    def load(self) -> "Manifest":
+        """
+        Read the manifest, the latest record of each output wins. A broken
+        last line (e.g. from a crash while writing it) is ignored.
+        """
+        lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.records[record["output"]] = record
+                    lines += 1
+        except OSError:
+            return self
+
+        # Drop superseded records once they make up most of the file
+        if lines > 2 * len(self.records) + 100:
+            self.compact()
+        return self
+
+    def compact(self) -> "Manifest":
+        temporary = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(temporary, "w", encoding="utf-8") as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(temporary, self.path)
+        return self
+
+    def append(self, record: dict) -> "Manifest":
+        self.records[record["output"]] = record
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        return self
+
+    @staticmethod
+    def source_record(source: str, channel: int, output_format: str, outpath: str) -> dict:
+        stat = os.stat(source)
+        return {
+            "output" : os.path.abspath(outpath),
+            "source" : os.path.abspath(source),
+            "source_size" : stat.st_size,
+            "source_mtime" : stat.st_mtime_ns,
+            "channel" : channel,
+            "format" : output_format
+        }
+
+    def is_complete(self, source: str, channel: int, output_format: str, outpath: str) -> bool:
+        """
+        True if the output has been written completely from the same source
+        channel in the same format and hasn't changed since
+        """
+        record = self.records.get(os.path.abspath(outpath))
+        if record is None or record["event"] != "done":
+            return False
+        expected = self.source_record(source, channel, output_format, outpath)
+        if any(record[key] != value for key, value in expected.items()):
+            return False
+        try:
+            stat = os.stat(outpath)
+        except OSError:
+            return False
+        return stat.st_size == record["size"] and stat.st_mtime_ns == record["mtime"]
+
+    def is_interrupted(self, outpath: str) -> bool:
+        """
+        True if writing the output was started but never finished
+        """
+        record = self.records.get(os.path.abspath(outpath))
+        return record is not None and record["event"] == "start"
+
+    def start(self, source: str, channel: int, output_format: str, outpath: str) -> "Manifest":
+        record = self.source_record(source, channel, output_format, outpath)
+        record["event"] = "start"
+        return self.append(record)
+
+    def done(self, source: str, channel: int, output_format: str, outpath: str, checksums: dict=None) -> "Manifest":
+        record = self.source_record(source, channel, output_format, outpath)
+        record.update(checksums or {})
+        stat = os.stat(outpath)
+        record["event"] = "done"
+        record["size"] = stat.st_size
+        record["mtime"] = stat.st_mtime_ns
+        return self.append(record)
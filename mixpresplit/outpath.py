@@ -0,0 +1,137 @@
+#-*- coding: utf-8 -*-
+"""
+Compiled OUTPATH templates.
+
+OUTPATH is split once into literal text and keywords. Rendering the path
+of a take or track then only looks up the values of the keywords and joins
+the parts, the values of a take are computed once for all of its tracks.
+"""
+
+import re
+import functools
+
+
+# Keywords and their aliases -> name of the value
+KEYWORDS = {
+    "date" : "date",
+    "hour" : "hour",
+    "h" : "hour",
+    "min" : "min",
+    "m" : "min",
+    "sec" : "sec",
+    "s" : "sec",
+    "scene" : "scene",
+    "take" : "take",
+    "tape" : "tape",
+    "circled" : "circled",
+    "tracknumber" : "tracknumber",
+    "track" : "tracknumber",
+    "n" : "tracknumber",
+    "trackname" : "trackname",
+    "name" : "trackname",
+}
+
+# Values that differ between the tracks of a take
+TRACK_VALUES = ["tracknumber", "trackname"]
+
+keyword_pattern = re.compile(r"\{([^{}]*)\}")
+
+
+class OutpathError(ValueError):
+    pass
+
+
+class OutpathTemplate():
+    def __init__(self, outpath: str, replace: (str,)=(), with_: (str,)=()) -> "OutpathTemplate":
+        """
+        Compile OUTPATH, raises an OutpathError for unknown keywords
+        """
+        self.outpath = outpath
+        self.replacements = list(zip(replace, with_))
+        # List of (name of the value or None for literal text, text)
+        self.tokens = []
+
+        position = 0
+        for match in keyword_pattern.finditer(outpath):
+            if match.start() > position:
+                self.tokens.append((None, outpath[position:match.start()]))
+            keyword = match.group(1)
+            if keyword not in KEYWORDS:
+                raise OutpathError("Unknown keyword {} in \"{}\"".format(match.group(0), outpath))
+            self.tokens.append((KEYWORDS[keyword], match.group(0)))
+            position = match.end()
+        if position < len(outpath):
+            self.tokens.append((None, outpath[position:]))
+
+    def take_values(self, meta: "Metadata") -> dict:
+        """
+        Return the values of the keywords that are the same for all tracks of a take
+        """
+        hour, minute, second = meta.timestring.split(":")[:3]
+        values = {
+            "date" : meta.datestring,
+            "hour" : hour,
+            "min" : minute,
+            "sec" : second,
+            "scene" : meta.scene,
+            "take" : str(meta.take),
+            "tape" : meta.tape,
+        }
+        # Without a circle the keyword stays as it is
+        if meta.circled:
+            values["circled"] = "CIRCLED"
+        return values
+
+    def bind(self, meta: "Metadata") -> [(str, str)]:
+        """
+        Return the tokens with the values of the take filled in, so only the
+        track keywords are left to render for each of its tracks
+        """
+        values = self.take_values(meta)
+        tokens = []
+        for name, text in self.tokens:
+            if name in TRACK_VALUES:
+                tokens.append((name, text))
+                continue
+            if name is not None:
+                text = values.get(name, text)
+            # Join neighbouring literal text
+            if tokens and tokens[-1][0] is None:
+                tokens[-1] = (None, tokens[-1][1] + text)
+            else:
+                tokens.append((None, text))
+        return tokens
+
+    def render(self, meta: "Metadata", channel: int=0, tokens: [(str, str)]=None) -> str:
+        """
+        Return the path of a take (channel 0, the track keywords stay as they
+        are) or of one of its tracks, with the --replace/--with rules applied.
+        Pass the result of bind as tokens to render several tracks of a take.
+        """
+        if tokens is None:
+            tokens = self.tokens
+            values = self.take_values(meta)
+        else:
+            values = {}
+        if channel != 0:
+            track = meta.tracks[channel]
+            values["tracknumber"] = str(track.tracknumber)
+            values["trackname"] = track.trackname
+
+        path = "".join([text if name is None else values.get(name, text) for name, text in tokens])
+
+        # The rules apply to the whole path in order, a rule may match the result of an earlier one
+        for r, w in self.replacements:
+            path = path.replace(r, w)
+        return path
+
+    def __repr__(self) -> str:
+        return "OutpathTemplate({!r})".format(self.outpath)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_outpath(outpath: str, replace: (str,)=(), with_: (str,)=()) -> "OutpathTemplate":
+    """
+    Return the compiled template for OUTPATH, each OUTPATH is only parsed once
+    """
+    return OutpathTemplate(outpath, replace, with_)
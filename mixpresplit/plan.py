@@ -0,0 +1,86 @@
+#-*- coding: utf-8 -*-
+"""
+Job plans written by --plan and read by --execute.
+
+A plan is a JSON file that holds everything needed to split the takes
+without reading the metadata of the sources again: the metadata of each
+take, the options that decide the output format and, for each output,
+its source channel, format and destination.
+"""
+
+import os
+import re
+import json
+
+
+# Bump this whenever the layout of the plan changes
+PLAN_VERSION = 1
+
+# Options that decide what is written, they are taken from the plan on --execute
+PLAN_OPTIONS = ["flac", "24", "16", "flac-level", "flac-block-size", "single-pass", "native", "stats", "skip-silent", "silence-threshold", "overwrite"]
+
+shard_pattern = re.compile(r"^(\d+)/(\d+)$")
+
+
+class PlanError(ValueError):
+    pass
+
+
+def write_plan(path: str, plan: dict) -> None:
+    temporary = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=2)
+    os.replace(temporary, path)
+
+
+def read_plan(path: str) -> dict:
+    """
+    Read and check a plan, raises a PlanError if it can't be used
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PlanError("Can't read the plan {}: {}".format(path, e))
+    if not isinstance(plan, dict) or plan.get("version") != PLAN_VERSION:
+        raise PlanError("{} is not a plan of this version of mixpresplit".format(path))
+    return plan
+
+
+def check_sources(sources: [str]) -> None:
+    """
+    Raises a PlanError if one of the sources (of the takes that are going
+    to be split) doesn't exist
+    """
+    for source in sources:
+        if not os.path.isfile(source):
+            raise PlanError("The source {} of the plan doesn't exist".format(source))
+
+
+def parse_shard(text: str) -> (int, int):
+    """
+    Parse a shard like "2/4" into (index, count), index starts at 1
+    """
+    match = shard_pattern.match(text)
+    if match is None:
+        raise PlanError("The shard \"{}\" is not of the form INDEX/COUNT (e.g. 2/4)".format(text))
+    index, count = int(match.group(1)), int(match.group(2))
+    if not 1 <= index <= count:
+        raise PlanError("The shard index of \"{}\" has to be between 1 and {}".format(text, count))
+    return index, count
+
+
+def shard_takes(takes: list, index: int, count: int, weights: [int]) -> list:
+    """
+    Return the takes of the index-th of count shards. The takes are spread
+    over the shards so each gets about the same total weight (e.g. bytes),
+    every shard computes the same spread independently.
+    """
+    loads = [0] * count
+    assigned = [[] for _ in range(count)]
+    by_weight = sorted(range(len(takes)), key=lambda n: (-weights[n], n))
+    for n in by_weight:
+        lightest = loads.index(min(loads))
+        loads[lightest] += weights[n]
+        assigned[lightest].append(n)
+    return [takes[n] for n in sorted(assigned[index - 1])]
@@ -0,0 +1,148 @@
+#-*- coding: utf-8 -*-
+"""
+Checks that run before anything is written.
+
+The size of every output is estimated from the metadata: a WAV output
+needs its samples plus at most a fixed reserve for the header (so its
+estimate is an upper bound), a FLAC output is estimated from the bits of
+its samples. The estimates are summed up per destination filesystem and
+compared with the free space there, so a split that can't complete doesn't
+start and leave partial files behind.
+
+The duration of a split is estimated from the throughput (bytes of the
+sources per second) of earlier runs with the same mode, which is kept in
+a small file next to the metadata cache.
+"""
+
+import os
+import json
+import shutil
+from collections import OrderedDict
+
+from mixpresplit import wav
+from mixpresplit.cache import default_cache_path
+
+
+# Expected size of a FLAC file relative to the PCM samples it holds (on the safe side)
+FLAC_RATIO = 0.75
+
+# Bytes reserved for the header of a FLAC file (STREAMINFO, seek table, tags)
+FLAC_HEADER_RESERVE = 8192
+
+# Runs shorter than this don't tell much about the throughput
+MIN_MEASURE_SECONDS = 1.0
+
+# Weight of a new measurement in the stored throughput
+MEASURE_WEIGHT = 0.5
+
+
+def wav_bytes(frames: int, bits: int) -> int:
+    """
+    Return the estimated size of a mono wav file, an upper bound as
+    RF64_HEADER_RESERVE bytes are counted for the header
+    """
+    data = frames * (bits // 8)
+    return wav.RF64_HEADER_RESERVE + data + (data & 1)
+
+
+def flac_bytes(frames: int, bits: int) -> int:
+    """
+    Return the estimated size of a mono FLAC file
+    """
+    return FLAC_HEADER_RESERVE + int(frames * (bits / 8) * FLAC_RATIO)
+
+
+def existing_parent(path: str) -> str:
+    """
+    Return the path or its nearest parent that exists
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+class DeviceSpace():
+    def __init__(self, directory: str, free: int) -> "DeviceSpace":
+        self.directory = directory
+        self.free = free
+        self.needed = 0
+        self.estimated = False
+        self.outputs = 0
+
+    @property
+    def fits(self) -> bool:
+        return self.needed <= self.free
+
+
+def space_by_device(sizes: [(str, int, bool)]) -> [DeviceSpace]:
+    """
+    Sum up the (outpath, bytes, estimated) sizes of the outputs per
+    filesystem and look up the free space of each
+    """
+    devices = OrderedDict()
+    for outpath, size, estimated in sizes:
+        parent = existing_parent(os.path.dirname(os.path.abspath(outpath)))
+        device = os.stat(parent).st_dev
+        if device not in devices:
+            devices[device] = DeviceSpace(parent, shutil.disk_usage(parent).free)
+        space = devices[device]
+        space.needed += size
+        space.estimated = space.estimated or estimated
+        space.outputs += 1
+    return list(devices.values())
+
+
+def format_bytes(size: int) -> str:
+    for unit in ["B", "kB", "MB", "GB"]:
+        if abs(size) < 1000:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1000
+    return "{:.1f} TB".format(size)
+
+
+def default_history_path() -> str:
+    """
+    Return the location of the measured throughputs (next to the metadata cache)
+    """
+    return os.path.join(os.path.dirname(default_cache_path()), "throughput.json")
+
+
+class ThroughputHistory():
+    def __init__(self, path: str=None) -> "ThroughputHistory":
+        self.path = path or default_history_path()
+        self.rates = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.rates = {key: float(rate) for key, rate in json.load(f).items()}
+        except (OSError, ValueError, AttributeError, TypeError):
+            self.rates = {}
+
+    def get(self, key: str) -> float:
+        """
+        Return the bytes per second measured for the mode or None
+        """
+        return self.rates.get(key)
+
+    def record(self, key: str, source_bytes: int, seconds: float) -> "ThroughputHistory":
+        """
+        Add a measurement of a run, too short runs are ignored
+        """
+        if seconds < MIN_MEASURE_SECONDS or source_bytes <= 0:
+            return self
+        rate = source_bytes / seconds
+        if key in self.rates:
+            rate = (1 - MEASURE_WEIGHT) * self.rates[key] + MEASURE_WEIGHT * rate
+        self.rates[key] = rate
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(self.rates, f, indent=2)
+            os.replace(temporary, self.path)
+        except OSError:
+            pass
+        return self
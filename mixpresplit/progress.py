@@ -0,0 +1,164 @@
+#-*- coding: utf-8 -*-
+"""
+Progress events and timings.
+
+With --events every phase of a run (scan, plan, and the read, encode and
+write phases of each unit of work) is logged as a JSON object per line to
+a file or to stderr ("-"), with a timestamp and, where it applies, the
+bytes processed and the realtime factor. While a unit runs, "progress"
+events report how far it got: ffmpeg reports through its -progress pipe,
+the native splitter after each block.
+
+Worker processes append to the same file, each event is written with a
+single write, so lines of different processes don't mix.
+
+The timings of the units are collected in the main process as well and
+summed up in a table of the slowest takes and tracks (--summary).
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+
+# Seconds between two progress events of the same unit
+PROGRESS_INTERVAL = 0.5
+
+# Number of takes and tracks listed in the summary
+SUMMARY_ROWS = 5
+
+
+class EventLog():
+    def __init__(self, path: str=None) -> "EventLog":
+        """
+        Log to the file at path (appending), to stderr for "-", or nowhere
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.units = []
+        self.fd = None
+        if path is not None and path != "-":
+            self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def emit(self, event: str, **fields) -> None:
+        if not self.enabled:
+            return
+        record = {"time": round(time.time(), 3), "event": event}
+        record.update(fields)
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self.lock:
+            if self.fd is not None:
+                os.write(self.fd, line)
+            else:
+                sys.stderr.write(line.decode("utf-8"))
+                sys.stderr.flush()
+
+    def unit_done(self, phase: str, take: str, outputs: [str], seconds: float, source_bytes: int, duration: float, tracks: dict=None, source: str=None) -> None:
+        """
+        Log a finished unit of work and remember its timing for the summary.
+        The summary lists the take under its source path (takes of different
+        folders may share a filename).
+        """
+        self.units.append((source or take, outputs, seconds, duration, tracks or {}))
+        self.emit("done", phase=phase, take=take, outputs=outputs, seconds=round(seconds, 3), bytes=source_bytes, realtime=realtime(duration, seconds))
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def realtime(duration: float, seconds: float) -> float:
+    """
+    Return how many times faster than realtime audio of duration was processed
+    """
+    if not duration or seconds <= 0:
+        return None
+    return round(duration / seconds, 1)
+
+
+class ProgressReporter():
+    """
+    Turns the progress of a running unit into events, at most one per
+    PROGRESS_INTERVAL
+    """
+    def __init__(self, log: "EventLog", phase: str, take: str, duration: float) -> "ProgressReporter":
+        self.log = log
+        self.phase = phase
+        self.take = take
+        self.duration = duration
+        self.started = time.perf_counter()
+        self.last = None
+
+    def __call__(self, fraction: float) -> None:
+        now = time.perf_counter()
+        if self.last is not None and now - self.last < PROGRESS_INTERVAL and fraction < 1:
+            return
+        self.last = now
+        self.log.emit("progress", phase=self.phase, take=self.take, fraction=round(min(fraction, 1.0), 4), realtime=realtime(self.duration * fraction, now - self.started))
+
+
+def follow_ffmpeg(process: "subprocess.Popen", report: "ProgressReporter", duration: float) -> None:
+    """
+    Read the key=value blocks ffmpeg writes to -progress pipe:1 until it ends
+    """
+    position = 0.0
+    for line in process.stdout:
+        key, _, value = line.decode("utf-8", "replace").strip().partition("=")
+        if key == "out_time_us" and value.isdigit():
+            position = int(value) / 1e6
+        elif key == "progress" and duration:
+            report(1.0 if value == "end" else position / duration)
+
+
+def summary_lines(log: "EventLog", rows: int=SUMMARY_ROWS) -> [str]:
+    """
+    Return a table of the slowest takes and tracks of the run
+    """
+    takes = {}
+    tracks = []
+    for take, outputs, seconds, duration, track_seconds in log.units:
+        total, take_duration = takes.get(take, (0.0, duration))
+        takes[take] = (total + seconds, take_duration)
+        # A unit with a single output is the time of its track
+        if len(outputs) == 1 and not track_seconds:
+            track_seconds = {outputs[0]: seconds}
+        for output, track_time in track_seconds.items():
+            tracks.append((track_time, output, duration))
+
+    lines = []
+    if takes:
+        lines.append("Slowest takes:")
+        lines.append("    {:>9}  {:>9}  {}".format("Seconds", "Realtime", "Take"))
+        for take, (seconds, duration) in sorted(takes.items(), key=lambda item: -item[1][0])[:rows]:
+            lines.append("    {:>9.2f}  {:>8}x  {}".format(seconds, realtime(duration, seconds) or "-", take))
+    if tracks:
+        lines.append("Slowest tracks:")
+        lines.append("    {:>9}  {:>9}  {}".format("Seconds", "Realtime", "Track"))
+        for seconds, output, duration in sorted(tracks, key=lambda item: -item[0])[:rows]:
+            lines.append("    {:>9.2f}  {:>8}x  {}".format(seconds, realtime(duration, seconds) or "-", output))
+    return lines
+
+
+# The log of this process, see open_log
+_log = EventLog()
+
+
+def open_log(path: str) -> "EventLog":
+    """
+    Start logging the events of this process to path (None to stop)
+    """
+    global _log
+    _log.close()
+    _log = EventLog(path)
+    return _log
+
+
+def log() -> "EventLog":
+    return _log
@@ -0,0 +1,198 @@
+#-*- coding: utf-8 -*-
+"""
+I/O aware scheduling of work units.
+
+Recordings usually come from a single SD card or card reader and are
+written to a single NAS or RAID. Running many units against the same card
+at once makes it seek between files, so the scheduler limits the number of
+files that are read at the same time per source device and the number of
+units that write at the same time per destination device (devices are told
+apart by st_dev). Units that read the same file share one reader slot:
+they stream through the file together and it is read from the card once.
+
+Units are started in the order they were submitted as soon as a worker and
+their devices are free. The time a free worker had to wait for a device is
+summed up per device.
+"""
+
+import os
+import time
+import threading
+from collections import defaultdict
+
+
+# Default number of files read at the same time from one device
+READERS_PER_DEVICE = 2
+
+# Default number of units writing at the same time to one device
+WRITERS_PER_DEVICE = 4
+
+
+def device_of(path: str) -> int:
+    """
+    Return the st_dev of the path, or of its nearest existing parent
+    """
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+class ScheduledUnit():
+    def __init__(self, future: "concurrent.futures.Future", fn, arg, reads: [str], writes: [str]) -> "ScheduledUnit":
+        self.future = future
+        self.fn = fn
+        self.arg = arg
+        # Source files by device
+        self.reads = defaultdict(set)
+        for path in reads:
+            self.reads[device_of(path)].add(os.path.abspath(path))
+        self.writes = {device_of(os.path.dirname(os.path.abspath(path))) for path in writes}
+
+
+class IOScheduler():
+    def __init__(self, executor: "concurrent.futures.Executor", workers: int, readers_per_device: int=READERS_PER_DEVICE, writers_per_device: int=WRITERS_PER_DEVICE) -> "IOScheduler":
+        self.executor = executor
+        self.workers = workers
+        self.readers_per_device = readers_per_device
+        self.writers_per_device = writers_per_device
+        self.pending = []
+        self.running = 0
+        # Device -> {source file -> number of running units reading it}
+        self.reading = defaultdict(lambda: defaultdict(int))
+        # Device -> number of running units writing to it
+        self.writing = defaultdict(int)
+        # Device -> seconds a free worker waited for it, and an example path on it
+        self.waited = defaultdict(float)
+        self.names = {}
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.dispatch, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, arg, reads: [str], writes: [str]) -> "concurrent.futures.Future":
+        """
+        Queue fn(arg), which reads the files reads and writes the files writes
+        """
+        # Imported here, the CLI only loads the scheduler for its defaults
+        import concurrent.futures
+        future = concurrent.futures.Future()
+        unit = ScheduledUnit(future, fn, arg, reads, writes)
+        for device, paths in unit.reads.items():
+            self.names.setdefault(("read", device), os.path.dirname(sorted(paths)[0]))
+        for path in writes:
+            self.names.setdefault(("write", device_of(os.path.dirname(os.path.abspath(path)))), os.path.dirname(os.path.abspath(path)))
+        with self.condition:
+            self.pending.append(unit)
+            self.condition.notify()
+        return future
+
+    def blocking(self, unit: "ScheduledUnit") -> [(str, int)]:
+        """
+        Return the devices that keep the unit from being started
+        """
+        blocked = []
+        for device, paths in unit.reads.items():
+            active = self.reading[device]
+            new_files = len([p for p in paths if p not in active])
+            # A unit that reads more files than allowed (a stitched take) can still run alone
+            if new_files and active and len(active) + new_files > self.readers_per_device:
+                blocked.append(("read", device))
+        for device in unit.writes:
+            if self.writing[device] >= self.writers_per_device:
+                blocked.append(("write", device))
+        return blocked
+
+    def start(self, unit: "ScheduledUnit") -> None:
+        for device, paths in unit.reads.items():
+            for path in paths:
+                self.reading[device][path] += 1
+        for device in unit.writes:
+            self.writing[device] += 1
+        self.running += 1
+        inner = self.executor.submit(unit.fn, unit.arg)
+        inner.add_done_callback(lambda inner: self.finish(unit, inner))
+
+    def finish(self, unit: "ScheduledUnit", inner: "concurrent.futures.Future") -> None:
+        with self.condition:
+            for device, paths in unit.reads.items():
+                for path in paths:
+                    self.reading[device][path] -= 1
+                    if self.reading[device][path] == 0:
+                        del self.reading[device][path]
+            for device in unit.writes:
+                self.writing[device] -= 1
+            self.running -= 1
+            self.condition.notify()
+        if inner.cancelled():
+            import concurrent.futures
+            unit.future.set_exception(concurrent.futures.CancelledError())
+        elif inner.exception() is not None:
+            unit.future.set_exception(inner.exception())
+        else:
+            unit.future.set_result(inner.result())
+
+    def dispatch(self) -> None:
+        """
+        Start the queued units in order as soon as a worker and their devices are free
+        """
+        with self.condition:
+            last = time.monotonic()
+            while not (self.closed and not self.pending):
+                # Drop the units that were cancelled before they started
+                self.pending = [u for u in self.pending if not u.future.cancelled()]
+
+                blocked = set()
+                for unit in list(self.pending):
+                    if self.running >= self.workers:
+                        break
+                    unit_blocked = self.blocking(unit)
+                    if unit_blocked:
+                        blocked.update(unit_blocked)
+                        continue
+                    if unit.future.set_running_or_notify_cancel():
+                        self.start(unit)
+                    self.pending.remove(unit)
+
+                self.condition.wait(timeout=0.5)
+
+                # A free worker waited for the devices of the units it couldn't start
+                now = time.monotonic()
+                if self.running < self.workers:
+                    for device in blocked:
+                        self.waited[device] += now - last
+                last = now
+
+    def close(self) -> None:
+        """
+        Wait until all queued units have been started
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def cancel(self) -> None:
+        """
+        Cancel all units that didn't start yet
+        """
+        with self.condition:
+            for unit in self.pending:
+                unit.future.cancel()
+            self.condition.notify()
+
+    def report(self) -> [str]:
+        """
+        Return a line for each device the pipeline had to wait for
+        """
+        lines = []
+        for (kind, device), seconds in sorted(self.waited.items(), key=lambda item: -item[1]):
+            if seconds >= 0.05:
+                direction = "reading from" if kind == "read" else "writing to"
+                lines.append("Waited {:.1f} s for {} {} (device {})".format(seconds, direction, self.names.get((kind, device), "?"), device))
+        return lines
@@ -0,0 +1,220 @@
+#-*- coding: utf-8 -*-
+"""
+Per-track statistics and waveform overviews, measured while the samples
+pass through the split.
+
+For each output two sidecars are written next to it:
+- `<output>.json` with the peak and RMS level and a rough loudness value
+- `<output>.dat` with a waveform overview in the binary format of
+  audiowaveform (version 1, 8 bit), which waveform viewers like peaks.js
+  can display directly
+
+The loudness follows the gating of ITU-R BS.1770 (400 ms blocks, absolute
+gate at -70, relative gate at -10) but without the K-weighting filter, so
+it is only a rough estimate of the LUFS value.
+"""
+
+import os
+import json
+import math
+import struct
+
+from mixpresplit import wav
+
+
+# Number of samples summarised by one min/max pair of the waveform overview
+SAMPLES_PER_PIXEL = 512
+
+# Version and flags (bit 0: 8 bit resolution) of the audiowaveform data format
+WAVEFORM_VERSION = 1
+WAVEFORM_8BIT = 0x1
+
+
+def loudness(energy: float) -> float:
+    """
+    Return the loudness of a mean square value as in BS.1770
+    """
+    return -0.691 + 10 * math.log10(energy) if energy > 0 else float("-inf")
+
+
+def finite(value: float, digits: int=2) -> float:
+    """
+    Round a level for JSON, which has no infinity (silence becomes null)
+    """
+    return round(value, digits) + 0.0 if math.isfinite(value) else None
+
+
+class TrackMeter():
+    def __init__(self, channels: [int], samplerate: int, samples_per_pixel: int=SAMPLES_PER_PIXEL) -> "TrackMeter":
+        """
+        Measure the given channels of blocks of frames x channels samples
+        """
+        import numpy as np
+
+        self.channels = list(channels)
+        self.samplerate = samplerate
+        self.samples_per_pixel = samples_per_pixel
+        # Loudness is gated in blocks of 4 segments of 100 ms
+        self.segment = max(samplerate // 10, 1)
+        self.frames = 0
+        # Sum of squares of each channel x segment
+        self.energies = []
+        self.minimums = []
+        self.maximums = []
+        # Frames that don't fill a whole segment or pixel yet (channels x frames)
+        self.segment_rest = np.zeros((len(self.channels), 0), dtype=np.float32)
+        self.pixel_rest = np.zeros((len(self.channels), 0), dtype=np.float32)
+
+    def add_block(self, block, codec: str) -> None:
+        """
+        Add a block as yielded by wav.read_blocks
+        """
+        self.add(wav.block_samples(block, codec))
+
+    def add(self, samples) -> None:
+        """
+        Add frames x channels samples (see wav.block_samples). Only the
+        measured channels are kept, as a copy, so samples may be a view
+        of a mapping that is closed afterwards.
+        """
+        import numpy as np
+
+        # Channels x frames, numpy reduces contiguous rows much faster than narrow columns
+        samples = samples.T[self.channels]
+        self.frames += samples.shape[1]
+
+        # The energy of each complete segment, the rest waits for the next block
+        data = np.concatenate([self.segment_rest, samples], axis=1)
+        count = data.shape[1] // self.segment
+        if count:
+            segments = data[:, :count * self.segment].reshape(len(self.channels), count, self.segment)
+            self.energies.append(np.einsum("ijk,ijk->ij", segments, segments, dtype=np.float64))
+        self.segment_rest = data[:, count * self.segment:].copy()
+
+        # The minimum and maximum of each complete pixel, the peak is taken from them
+        data = np.concatenate([self.pixel_rest, samples], axis=1)
+        count = data.shape[1] // self.samples_per_pixel
+        if count:
+            pixels = data[:, :count * self.samples_per_pixel].reshape(len(self.channels), count, self.samples_per_pixel)
+            self.minimums.append(pixels.min(axis=2))
+            self.maximums.append(pixels.max(axis=2))
+        self.pixel_rest = data[:, count * self.samples_per_pixel:].copy()
+
+    def extremes(self) -> ("numpy.ndarray", "numpy.ndarray"):
+        """
+        Return the minimums and maximums of all pixels as channels x pixels,
+        the last pixel may summarise fewer samples
+        """
+        import numpy as np
+
+        minimums = list(self.minimums)
+        maximums = list(self.maximums)
+        if self.pixel_rest.shape[1]:
+            minimums.append(self.pixel_rest.min(axis=1)[:, np.newaxis])
+            maximums.append(self.pixel_rest.max(axis=1)[:, np.newaxis])
+        if not minimums:
+            empty = np.zeros((len(self.channels), 0), dtype=np.float32)
+            return empty, empty
+        return np.concatenate(minimums, axis=1), np.concatenate(maximums, axis=1)
+
+    def waveforms(self) -> ["numpy.ndarray"]:
+        """
+        Return the min/max pairs of each channel as int8 pixels x 2
+        """
+        import numpy as np
+
+        minimums, maximums = self.extremes()
+        pairs = np.stack([minimums, maximums], axis=2)
+        pairs = np.clip(np.round(pairs * 127), -128, 127).astype(np.int8)
+        return list(pairs)
+
+    def loudness(self) -> ["float"]:
+        """
+        Return the gated loudness of each channel (without K-weighting)
+        """
+        import numpy as np
+
+        if not self.energies:
+            return [float("-inf")] * len(self.channels)
+        energies = np.concatenate(self.energies, axis=1) / self.segment
+        # 400 ms blocks with an overlap of 75 %, short takes are a single block
+        if energies.shape[1] >= 4:
+            blocks = (energies[:, :-3] + energies[:, 1:-2] + energies[:, 2:-1] + energies[:, 3:]) / 4
+        else:
+            blocks = energies.mean(axis=1)[:, np.newaxis]
+
+        values = []
+        for levels in blocks:
+            gated = levels[[loudness(e) > -70 for e in levels]]
+            if len(gated) == 0:
+                values.append(float("-inf"))
+                continue
+            relative = loudness(gated.mean()) - 10
+            gated = gated[[loudness(e) > relative for e in gated]]
+            values.append(loudness(gated.mean()))
+        return values
+
+    def results(self) -> [dict]:
+        """
+        Return the statistics of each channel
+        """
+        import numpy as np
+
+        minimums, maximums = self.extremes()
+        peaks = np.maximum(maximums.max(axis=1, initial=0), -minimums.min(axis=1, initial=0))
+        squares = np.square(self.segment_rest, dtype=np.float64).sum(axis=1)
+        if self.energies:
+            squares += np.concatenate(self.energies, axis=1).sum(axis=1)
+
+        values = []
+        for n, level in enumerate(self.loudness()):
+            rms = math.sqrt(squares[n] / self.frames) if self.frames else 0.0
+            values.append({
+                "samplerate" : self.samplerate,
+                "frames" : self.frames,
+                "duration" : round(self.frames / self.samplerate, 3),
+                "peak_dbfs" : finite(wav.decibels(float(peaks[n]))),
+                "rms_dbfs" : finite(wav.decibels(rms)),
+                "loudness" : finite(level),
+            })
+        return values
+
+
+def waveform_bytes(pairs: "numpy.ndarray", samplerate: int, samples_per_pixel: int) -> bytes:
+    """
+    Return a waveform overview in the audiowaveform data format
+    """
+    header = struct.pack("<iIiiI", WAVEFORM_VERSION, WAVEFORM_8BIT, samplerate, samples_per_pixel, len(pairs))
+    return header + pairs.tobytes()
+
+
+def write_sidecars(meter: "TrackMeter", outpaths: [str], skip: [str]=()) -> None:
+    """
+    Write the statistics and the waveform of each measured channel next to
+    the according output (except the outputs in skip)
+    """
+    for outpath, values, pairs in zip(outpaths, meter.results(), meter.waveforms()):
+        if outpath in skip:
+            continue
+        values = dict(values, file=os.path.basename(outpath), waveform=os.path.basename(outpath) + ".dat", samples_per_pixel=meter.samples_per_pixel)
+        with open(outpath + ".dat", "wb") as f:
+            f.write(waveform_bytes(pairs, meter.samplerate, meter.samples_per_pixel))
+        with open(outpath + ".json", "w", encoding="utf-8") as f:
+            json.dump(values, f, indent=2)
+
+
+def measure_outputs(path: str, codec: str, outputs: [(int, str)], continuations: [str]=(), block_frames: int=wav.BLOCK_FRAMES) -> None:
+    """
+    Measure the channels of outputs in one read of the polywav at path and
+    write their sidecars (for splits where the samples don't pass through
+    mixpresplit itself)
+    """
+    parts, channels, samplerate, _ = wav.read_parts(path, codec, continuations)
+    sample_size = wav.NATIVE_CODECS[codec][1] // 8
+    meter = TrackMeter([channel for channel, _ in outputs], samplerate)
+    for part, data_offset, frames in parts:
+        with open(part, "rb") as f:
+            for block in wav.read_blocks(f, data_offset, frames, channels, sample_size, block_frames):
+                meter.add_block(block, codec)
+                del block
+    write_sidecars(meter, [outpath for _, outpath in outputs])
@@ -0,0 +1,236 @@
+#-*- coding: utf-8 -*-
+"""
+A columnar table of takes and tracks for large catalogues.
+
+A Metadata object per take is fine for a card, for whole seasons of
+archived cards the objects and their track dicts dominate memory and the
+time of the garbage collector. The table keeps every field in a column of
+its own: numbers in typed arrays and strings (scene, tape, date, names,
+directories) as indices into a pool in which each distinct string is
+stored once. Files that continue a take are rows of their own that point
+to the row of the take.
+
+Filters are evaluated once per distinct value of a column and the result
+is mapped over the whole column (with numpy for long columns, if it is
+installed).
+metadata(row) returns the take as a Metadata object again, so selected
+takes can be planned and split like scanned ones.
+"""
+
+import os
+import sys
+from array import array
+
+from mixpresplit import wav
+from mixpresplit.cli import Metadata
+
+
+# Columns shorter than this are filtered without numpy (its overhead would dominate)
+NUMPY_MIN_ROWS = 10000
+
+class StringPool():
+    """
+    Stores each distinct string (or None) once and hands out its index
+    """
+    def __init__(self) -> "StringPool":
+        self.values = []
+        self.ids = {}
+
+    def add(self, text: str) -> int:
+        index = self.ids.get(text)
+        if index is None:
+            index = self.ids[text] = len(self.values)
+            self.values.append(sys.intern(text) if isinstance(text, str) else text)
+        return index
+
+    def __getitem__(self, index: int) -> str:
+        return self.values[index]
+
+    def matching(self, predicate) -> {int}:
+        """
+        Return the indices of the strings the predicate is true for
+        """
+        return {index for index, text in enumerate(self.values) if predicate(text)}
+
+
+def optional(value: int) -> int:
+    return -1 if value is None else value
+
+
+def restore(value: int) -> int:
+    return None if value == -1 else value
+
+
+def use_numpy(column: array) -> bool:
+    return len(column) >= NUMPY_MIN_ROWS and wav.numpy_available()
+
+
+def column_in(column: array, allowed: {int}):
+    """
+    Return a mask that is true where the value of the column is one of the
+    allowed values
+    """
+    if use_numpy(column):
+        import numpy as np
+        values = np.frombuffer(column, dtype=np.dtype(column.typecode))
+        return np.isin(values, np.fromiter(allowed, dtype=values.dtype, count=len(allowed)))
+    return [value in allowed for value in column]
+
+
+def mask_and(a, b):
+    if isinstance(a, list):
+        return [x and y for x, y in zip(a, b)]
+    return a & b
+
+
+class TakeTable():
+    def __init__(self) -> "TakeTable":
+        self.strings = StringPool()
+        # One row per file
+        self.directory = array("i")
+        self.filename = []
+        self.datestring = array("i")
+        self.timestring = array("i")
+        self.codec = array("i")
+        self.samplerate = array("i")
+        self.channels = array("i")
+        self.scene = array("i")
+        self.take = array("q")
+        self.tape = array("i")
+        self.circled = array("b")
+        self.speed = array("i")
+        self.samplecount = array("q")
+        self.time_reference = array("q")
+        # Row of the take a file continues, -1 for the first file of a take.
+        # The continuations of a take are the rows right after it.
+        self.parent = array("q")
+        # First row in the track columns and number of tracks of each file
+        self.track_start = array("q")
+        self.track_count = array("i")
+        # One row per track
+        self.track_file = array("q")
+        self.track_channel = array("i")
+        self.track_number = array("i")
+        self.track_name = array("i")
+
+    @classmethod
+    def from_metas(cls, metas: ["Metadata"]) -> "TakeTable":
+        table = cls()
+        for meta in metas:
+            table.append(meta)
+        return table
+
+    def append(self, meta: "Metadata", parent: int=-1) -> int:
+        """
+        Add a take (and its continuations) and return its row
+        """
+        row = len(self.filename)
+        directory, filename = os.path.split(meta.filepath)
+        self.directory.append(self.strings.add(directory))
+        self.filename.append(filename)
+        for column in ["datestring", "timestring", "codec", "scene", "tape", "speed"]:
+            getattr(self, column).append(self.strings.add(getattr(meta, column)))
+        self.samplerate.append(meta.samplerate)
+        self.channels.append(meta.channels)
+        self.take.append(meta.take)
+        self.circled.append(bool(meta.circled))
+        self.samplecount.append(optional(meta.samplecount))
+        self.time_reference.append(optional(meta.time_reference))
+        self.parent.append(parent)
+        self.track_start.append(len(self.track_file))
+        self.track_count.append(len(meta.tracks))
+        for channel, track in meta.tracks.items():
+            self.track_file.append(row)
+            self.track_channel.append(channel)
+            self.track_number.append(track.tracknumber)
+            self.track_name.append(self.strings.add(track.trackname))
+        for continuation in meta.continuations:
+            self.append(continuation, row)
+        return row
+
+    def __len__(self) -> int:
+        """
+        The number of takes (continuations are part of their take)
+        """
+        return self.parent.count(-1)
+
+    def take_rows(self) -> [int]:
+        return [row for row, parent in enumerate(self.parent) if parent == -1]
+
+    def filepath(self, row: int) -> str:
+        return os.path.join(self.strings[self.directory[row]], self.filename[row])
+
+    def rows(self, take_filter: "Filter"=None, circled: bool=None, first_date: str=None, last_date: str=None, track_filter: "Filter"=None) -> [int]:
+        """
+        Return the rows of the takes that pass the take filter, are (not)
+        circled, were recorded between the dates (YYYY-MM-DD, inclusive)
+        and have at least one track that passes the track filter
+        """
+        # Each filter is evaluated once per distinct value and then applied to the column
+        selected = column_in(self.parent, {-1})
+        if take_filter is not None:
+            allowed = {take for take in set(self.take) if take_filter.matches(take)}
+            selected = mask_and(selected, column_in(self.take, allowed))
+        if circled is not None:
+            selected = mask_and(selected, column_in(self.circled, {int(circled)}))
+        if first_date is not None or last_date is not None:
+            dates = self.strings.matching(lambda d: isinstance(d, str) and (first_date is None or d >= first_date) and (last_date is None or d <= last_date))
+            selected = mask_and(selected, column_in(self.datestring, dates))
+        if track_filter is not None:
+            selected = mask_and(selected, self.with_track(track_filter, isinstance(selected, list)))
+        if isinstance(selected, list):
+            return [row for row, a in enumerate(selected) if a]
+        return selected.nonzero()[0].tolist()
+
+    def with_track(self, track_filter: "Filter", plain: bool):
+        """
+        Return a mask of the rows that have a track that passes the filter
+        """
+        names = self.strings.values
+        numbers = set(self.track_number)
+        # Keys of the (number, name) pairs that pass
+        allowed = {number * len(names) + name for name in set(self.track_name) for number in numbers if track_filter.matches(number, names[name])}
+        if plain:
+            rows = {row for row, number, name in zip(self.track_file, self.track_number, self.track_name) if number * len(names) + name in allowed}
+            return [row in rows for row in range(len(self.parent))]
+        import numpy as np
+        keys = np.frombuffer(self.track_number, dtype=np.int32).astype(np.int64) * len(names) + np.frombuffer(self.track_name, dtype=np.int32)
+        passed = np.isin(keys, np.fromiter(allowed, dtype=np.int64, count=len(allowed)))
+        mask = np.zeros(len(self.parent), dtype=bool)
+        mask[np.frombuffer(self.track_file, dtype=np.int64)[passed]] = True
+        return mask
+
+    def metadata(self, row: int) -> "Metadata":
+        """
+        Return the take of the row as Metadata (with its continuations)
+        """
+        strings = self.strings
+        meta = Metadata()
+        meta.set_filepath(self.filepath(row))
+        meta.datestring = strings[self.datestring[row]]
+        meta.timestring = strings[self.timestring[row]]
+        meta.codec = strings[self.codec[row]]
+        meta.samplerate = self.samplerate[row]
+        meta.channels = self.channels[row]
+        meta.scene = strings[self.scene[row]]
+        meta.take = self.take[row]
+        meta.tape = strings[self.tape[row]]
+        meta.circled = bool(self.circled[row])
+        meta.speed = strings[self.speed[row]]
+        meta.samplecount = restore(self.samplecount[row])
+        meta.time_reference = restore(self.time_reference[row])
+        start = self.track_start[row]
+        for n in range(start, start + self.track_count[row]):
+            meta.add_track(self.track_channel[n], self.track_number[n], strings[self.track_name[n]])
+        # The continuations follow the row of their take
+        child = row + 1
+        while child < len(self.parent) and self.parent[child] == row:
+            meta.continuations.append(self.metadata(child))
+            child += 1
+        return meta
+
+    def metadatas(self, rows: [int]=None) -> ["Metadata"]:
+        """
+        Return the takes of the rows (all takes by default) as Metadata
+        """
+        return [self.metadata(row) for row in (self.take_rows() if rows is None else rows)]
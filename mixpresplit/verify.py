@@ -0,0 +1,169 @@
+#-*- coding: utf-8 -*-
+"""
+Checksums of the sources and outputs, and the verification of a destination.
+
+With --checksums the MD5 of the sample data of each take (the data chunks
+of the polywav and its continuations) and of each output (the data chunk
+of a WAV, the whole file of anything else) are stored in the manifest.
+The native WAV split hashes the blocks while they pass through, the other
+splits hash the files once they have been written.
+
+--verify checks the outputs of a manifest against their checksums and,
+if the sources are still there, against the sources: the source is read
+once and each block of it has to match the samples of the outputs that
+were copied without conversion, channel by channel.
+"""
+
+import os
+import hashlib
+
+from mixpresplit import wav
+
+
+# Checksum of the sample data
+HASH_ALGORITHM = "md5"
+
+# Number of bytes hashed at once when a file is read
+READ_SIZE = 1 << 20
+
+
+def new_hash() -> "hashlib._Hash":
+    return hashlib.new(HASH_ALGORITHM)
+
+
+class HashingWriter():
+    """
+    A file that hashes everything written to it after it was wrapped
+    """
+    def __init__(self, f) -> "HashingWriter":
+        self.f = f
+        self.hash = new_hash()
+
+    def write(self, data: bytes) -> int:
+        self.hash.update(data)
+        return self.f.write(data)
+
+    def close(self) -> None:
+        self.f.close()
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+def payload_range(path: str) -> (int, int):
+    """
+    Return the (offset, size) of the data that is hashed for a file: the
+    data chunk of a wav file, the whole file otherwise
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        try:
+            chunks = wav.read_chunks(f)
+        except wav.WavFormatError:
+            return 0, size
+    if b"data" not in chunks:
+        return 0, size
+    offset, data_size = chunks[b"data"]
+    # Clamp the data size to what is really there
+    return offset, min(data_size, size - offset)
+
+
+def update_range(hash_object, path: str, offset: int, size: int) -> None:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while size > 0:
+            data = f.read(min(READ_SIZE, size))
+            if not data:
+                break
+            hash_object.update(data)
+            size -= len(data)
+
+
+def hash_payload(path: str) -> str:
+    """
+    Return the checksum of the data of a written output
+    """
+    hash_object = new_hash()
+    update_range(hash_object, path, *payload_range(path))
+    return hash_object.hexdigest()
+
+
+def hash_sources(path: str, codec: str, continuations: [str]=()) -> str:
+    """
+    Return the checksum of the sample data of a take (polywav and continuations)
+    """
+    parts, channels, _, _ = wav.read_parts(path, codec, continuations)
+    block_align = channels * wav.NATIVE_CODECS[codec][1] // 8
+    hash_object = new_hash()
+    for part, data_offset, frames in parts:
+        update_range(hash_object, part, data_offset, frames * block_align)
+    return hash_object.hexdigest()
+
+
+def compare_samples(sources: [str], codec: str, copies: [dict]) -> ({str: str}, str):
+    """
+    Read the take once and compare each block of it with the outputs that
+    hold a channel of it unchanged (their records). Returns the problem of
+    each output that doesn't match and the checksum of the take.
+    """
+    parts, channels, _, _ = wav.read_parts(sources[0], codec, sources[1:])
+    sample_size = wav.NATIVE_CODECS[codec][1] // 8
+    source_hash = new_hash()
+    expected = sum(frames for _, _, frames in parts) * sample_size
+    problems = {}
+    files = {}
+    try:
+        for record in copies:
+            offset, size = payload_range(record["output"])
+            f = open(record["output"], "rb")
+            f.seek(offset)
+            files[record["output"]] = f
+            if size != expected:
+                problems[record["output"]] = "has {} bytes of samples instead of {}".format(size, expected)
+
+        for part, data_offset, frames in parts:
+            with open(part, "rb") as f:
+                for block in wav.read_blocks(f, data_offset, frames, channels, sample_size, wav.BLOCK_FRAMES):
+                    source_hash.update(block)
+                    for record in copies:
+                        if record["output"] in problems:
+                            continue
+                        samples = block[:, record["channel"], :].tobytes()
+                        if files[record["output"]].read(len(samples)) != samples:
+                            problems[record["output"]] = "differs from channel {} of the source".format(record["channel"])
+                    del block
+    finally:
+        for f in files.values():
+            f.close()
+    return problems, source_hash.hexdigest()
+
+
+def verify_take(records: [dict]) -> [(str, str)]:
+    """
+    Verify the outputs of one take (their manifest records). Returns an
+    (output, problem) pair for each output, the problem is None if the
+    output is fine.
+    """
+    problems = {}
+    for record in records:
+        output = record["output"]
+        if not os.path.isfile(output):
+            problems[output] = "is missing"
+        elif hash_payload(output) != record["md5"]:
+            problems[output] = "doesn't match its checksum"
+
+    sources = [record["source"]] + record.get("continuations", [])
+    codec = record.get("source_codec")
+    if all(os.path.isfile(source) for source in sources) and codec in wav.NATIVE_CODECS:
+        # Outputs in the format of the source have to re-interleave to it (comparing needs numpy)
+        if wav.numpy_available():
+            copies = [r for r in records if r["format"] == codec and r["output"] not in problems]
+            mismatches, source_md5 = compare_samples(sources, codec, copies)
+            problems.update(mismatches)
+        else:
+            source_md5 = hash_sources(sources[0], codec, sources[1:])
+        if source_md5 != record.get("source_md5"):
+            for r in records:
+                problems.setdefault(r["output"], "was written from a source that has changed since")
+
+    return [(r["output"], problems.get(r["output"])) for r in records]
@@ -0,0 +1,101 @@
+#-*- coding: utf-8 -*-
+"""
+Polling watcher for wav files that appear in (hot) folders.
+
+A file is reported once it stopped growing and its header has been
+finalised by the recorder or copy tool, so it is never read half-written.
+The folders are found with the rules of a normal run (see discover.py),
+but each one is only listed again when its modification time changed,
+files that are still being written are just stat'ed on each poll.
+"""
+
+import os
+
+from mixpresplit import wav
+from mixpresplit.discover import IGNORE_PATTERNS, Discovery
+
+
+class Watcher():
+    def __init__(self, inpaths: [str], settle: int=1, ignore: [str]=IGNORE_PATTERNS, recursive: bool=True) -> "Watcher":
+        """
+        Watch the given directories (and the folders below them if
+        recursive). A file is ready once its size and modification time
+        didn't change for settle polls. Files and folders matching one of
+        the ignore patterns are skipped.
+        """
+        self.inpaths = list(inpaths)
+        self.settle = settle
+        self.ignore = tuple(ignore)
+        self.recursive = recursive
+        # The modification time and listing of each directory when it was listed last
+        self.directories = {}
+        # Files that are not ready yet: path -> (size, mtime, stable polls)
+        self.pending = {}
+        # Files that have been reported: path -> (size, mtime)
+        self.reported = {}
+
+    def scan(self) -> None:
+        """
+        List the directories that changed since the last poll and start
+        tracking the wav files that are new or changed
+        """
+        # Files and folders are told apart anew on each poll, in the same order
+        discovery = Discovery(self.recursive, self.ignore)
+        directories = {}
+        queue = [(inpath, True) for inpath in self.inpaths]
+        while queue:
+            directory, top = queue.pop(0)
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            listing = self.directories.get(directory)
+            if listing is None or listing[0] != mtime:
+                try:
+                    listing = (mtime, discovery.list_directory(directory, top))
+                except OSError:
+                    continue
+            directories[directory] = listing
+            files, subdirectories = discovery.visit(listing[1])
+            queue += [(subdirectory, False) for subdirectory in subdirectories]
+            for path in files:
+                if path not in self.pending and path not in self.reported:
+                    self.pending[path] = (None, None, 0)
+        # Folders that are gone are forgotten
+        self.directories = directories
+
+        # Files that were reported are only watched again if they change
+        for path, (size, mtime) in list(self.reported.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.reported[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                del self.reported[path]
+                self.pending[path] = (None, None, 0)
+
+    def poll(self) -> [str]:
+        """
+        Return the files that became ready since the last poll
+        """
+        self.scan()
+        ready = []
+        for path, (size, mtime, stable) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == (size, mtime):
+                stable += 1
+            else:
+                stable = 0
+            self.pending[path] = (stat.st_size, stat.st_mtime_ns, stable)
+
+            if stable >= self.settle and wav.is_finalised(path):
+                del self.pending[path]
+                self.reported[path] = (stat.st_size, stat.st_mtime_ns)
+                ready.append(path)
+
+        return sorted(ready)
@@ -0,0 +1,710 @@
+#-*- coding: utf-8 -*-
+"""
+Native reading and writing of (poly)wav files without ffmpeg.
+
+The mono files written here follow the layout ffmpeg's wav muxer produces
+for `-write_bext 1 -bitexact` (fmt, fact for float, bext, data), so they
+can be used interchangeably with the files of the ffmpeg based split.
+"""
+
+import os
+import re
+import math
+import mmap
+import struct
+import xml.parsers.expat as expat
+from collections import namedtuple
+
+
+# Number of frames that are de-interleaved at once by the native splitter
+BLOCK_FRAMES = 65536
+
+# Codec tags used in the fmt chunk
+WAVE_FORMAT_PCM        = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Sizes of the fixed part of the bext chunk
+BEXT_FIELDS = [("description", 256), ("originator", 32), ("originator_reference", 32), ("origination_date", 10), ("origination_time", 8)]
+BEXT_FIXED_SIZE = 602
+
+# Codecs the native splitter can write (codec -> codec tag, bits per sample)
+NATIVE_CODECS = {
+    "pcm_f32le" : (WAVE_FORMAT_IEEE_FLOAT, 32),
+    "pcm_s24le" : (WAVE_FORMAT_PCM, 24),
+    "pcm_s16le" : (WAVE_FORMAT_PCM, 16),
+}
+
+# Number of frames folded into one row when measuring the levels
+LEVEL_FOLD = 64
+
+# Number of bytes of the iXML chunk that are parsed at once
+IXML_READ_SIZE = 1024
+
+# Patterns for the fast iXML scan
+ixml_value_pattern = re.compile(r"<(SCENE|TAKE|TAPE)>([^<]*)</\1>")
+ixml_track_field_pattern = re.compile(r"<(CHANNEL_INDEX|INTERLEAVE_INDEX|NAME)>([^<]*)</\1>")
+
+# The parts of the header read_metadata needs. The names follow wavinfo,
+# so the result of read_header can be used in place of a WavInfoReader.
+WavAudioFormat = namedtuple("WavAudioFormat", "audio_format channel_count sample_rate byte_rate block_align bits_per_sample")
+WavDataDescriptor = namedtuple("WavDataDescriptor", "byte_count frame_count")
+WavBext = namedtuple("WavBext", "description originator_date originator_time time_reference")
+WavIXML = namedtuple("WavIXML", "scene take tape track_list")
+IXMLTrack = namedtuple("IXMLTrack", "channel_index interleave_index name")
+WavHeader = namedtuple("WavHeader", "fmt bext ixml data")
+
+# Largest size a RIFF file or chunk can have, bigger files have to be RF64
+RIFF_LIMIT = 0xFFFFFFFF
+
+# Bytes reserved for the header of a mono file when deciding whether it has to be RF64
+RF64_HEADER_RESERVE = 4096
+
+# The "pan=1" output of the ffmpeg split is a single channel with the mask 0x1
+MONO_CHANNEL_MASK = 0x1
+
+
+class WavFormatError(Exception):
+    pass
+
+
+def read_chunks(f) -> dict:
+    """
+    Walk the top level chunks of an opened RIFF/WAVE (or RF64/BW64) file and
+    return a dict that maps each chunk id to its (offset, size). Only the
+    chunk headers are read, the position of the data is found by seeking
+    over the chunks. For RF64 files the 64 bit sizes of the ds64 chunk are
+    used in place of the 32 bit placeholders.
+    """
+    f.seek(0)
+    header = f.read(12)
+    if len(header) != 12 or header[:4] not in [b"RIFF", b"RF64", b"BW64"] or header[8:12] != b"WAVE":
+        raise WavFormatError("Not a RIFF/WAVE file")
+    rf64 = header[:4] != b"RIFF"
+
+    chunks = {}
+    big_sizes = {}
+    position = 12
+    while True:
+        f.seek(position)
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            break
+        ident, size = struct.unpack("<4sI", chunk_header)
+
+        # The ds64 chunk directly follows WAVE and holds the sizes that don't fit 32 bit
+        if rf64 and ident == b"ds64" and position == 12:
+            ds64 = f.read(size)
+            if len(ds64) < 28:
+                raise WavFormatError("Short ds64 chunk")
+            _, big_sizes[b"data"], _, table_length = struct.unpack("<QQQI", ds64[:28])
+            for n in range(table_length):
+                if len(ds64) >= 28 + 12 * (n + 1):
+                    table_ident, table_size = struct.unpack("<4sQ", ds64[28 + 12 * n:40 + 12 * n])
+                    big_sizes[table_ident] = table_size
+        elif rf64 and size == RIFF_LIMIT:
+            if ident not in big_sizes:
+                raise WavFormatError("No 64 bit size for the {} chunk".format(ident))
+            size = big_sizes[ident]
+
+        # Keep the first occurence of a chunk
+        if ident not in chunks:
+            chunks[ident] = (position + 8, size)
+        # Chunks are padded to an even size
+        position += 8 + size + (size & 1)
+
+    return chunks
+
+
+def read_chunk(f, chunks: dict, ident: bytes) -> bytes:
+    """
+    Return the payload of a chunk found by read_chunks or None
+    """
+    if ident not in chunks:
+        return None
+    offset, size = chunks[ident]
+    f.seek(offset)
+    return f.read(size)
+
+
+def bext_string(b: bytes) -> str:
+    """
+    Decode a bext text field, which ends at the first NUL
+    """
+    return b.split(b"\0", 1)[0].decode("ascii")
+
+
+def element_depths(xml: str, positions: [int]) -> [int]:
+    """
+    Return the number of elements that are open at each of the (ascending)
+    positions in a document without comments, CDATA sections or processing
+    instructions other than the XML declaration
+    """
+    depths = []
+    depth = 0
+    previous = 0
+    for position in positions:
+        segment = xml[previous:position]
+        closing = segment.count("</")
+        depth += segment.count("<") - segment.count("<?") - 2 * closing - segment.count("/>")
+        depths.append(depth)
+        previous = position
+    return depths
+
+
+def scan_ixml(xml: bytes) -> "WavIXML":
+    """
+    Extract the scene, take, tape and the track list from the beginning of
+    an iXML document (up to </TRACK_LIST>) with plain string searches.
+    Returns None if the document uses anything beyond plain elements and
+    text, in that case it has to be parsed properly.
+    """
+    if b"<!" in xml or b"&" in xml or xml.count(b"<?") > 1:
+        return None
+    try:
+        xml = xml.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+    # Each of the values and the track list have to be direct children of the root
+    matches = list(ixml_value_pattern.finditer(xml))
+    values = dict((match.group(1), match.group(2) or None) for match in matches)
+    if len(matches) != 3 or len(values) != 3 or xml.count("<TRACK_LIST>") != 1:
+        return None
+    track_list_start = xml.index("<TRACK_LIST>")
+    positions = sorted([match.start() for match in matches] + [track_list_start])
+    if element_depths(xml, positions) != [1, 1, 1, 1]:
+        return None
+
+    track_list = []
+    body = xml[track_list_start:xml.index("</TRACK_LIST>")]
+    for track in body.split("</TRACK>")[:-1]:
+        # Keep the first occurence of each field
+        fields = dict(reversed(ixml_track_field_pattern.findall(track)))
+        track_list.append(IXMLTrack(
+            channel_index=fields.get("CHANNEL_INDEX", ""),
+            interleave_index=fields.get("INTERLEAVE_INDEX", ""),
+            name=fields.get("NAME", "")))
+
+    return WavIXML(scene=values["SCENE"], take=values["TAKE"], tape=values["TAPE"], track_list=track_list)
+
+
+def parse_ixml(f, offset: int, size: int) -> "WavIXML":
+    """
+    Parse the iXML chunk at offset incrementally and stop reading as soon
+    as the scene, take, tape and the track list are known. Plain documents
+    (like the ones written by the MixPre) are scanned by scan_ixml, anything
+    else is parsed with expat.
+    """
+    f.seek(offset)
+    xml = b""
+    remaining = size
+    while remaining > 0:
+        piece = f.read(min(IXML_READ_SIZE, remaining))
+        if not piece:
+            break
+        remaining -= len(piece)
+        # The chunk may be padded with NULs, which can't be part of the XML
+        if b"\0" in piece:
+            piece = piece.split(b"\0", 1)[0]
+            remaining = 0
+        xml += piece
+        # Stop reading once the track list has been read completely
+        end = xml.find(b"</TRACK_LIST>", max(0, len(xml) - len(piece) - 12))
+        if end != -1:
+            ixml = scan_ixml(xml[:end + 13])
+            if ixml is not None:
+                return ixml
+            break
+
+    f.seek(offset)
+    return parse_ixml_expat(f, size)
+
+
+def parse_ixml_expat(f, size: int) -> "WavIXML":
+    """
+    Parse the iXML chunk at the current position incrementally with expat
+    """
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+
+    values = {}
+    track_list = []
+    track = {}
+    path = []
+    text = []
+    state = {"track_list": "before"}
+
+    def start(tag, attributes):
+        path.append(tag)
+        if len(path) == 2 and tag == "TRACK_LIST" and state["track_list"] == "before":
+            state["track_list"] = "inside"
+        text.clear()
+
+    def end(tag):
+        depth = len(path)
+        if depth == 2:
+            if tag in ["SCENE", "TAKE", "TAPE"] and tag not in values:
+                values[tag] = "".join(text) or None
+            elif tag == "TRACK_LIST" and state["track_list"] == "inside":
+                state["track_list"] = "done"
+        elif state["track_list"] == "inside":
+            if tag == "TRACK":
+                track_list.append(IXMLTrack(
+                    channel_index=track.get("CHANNEL_INDEX", ""),
+                    interleave_index=track.get("INTERLEAVE_INDEX", ""),
+                    name=track.get("NAME", "")))
+                track.clear()
+            elif path[-2] == "TRACK" and tag in ["CHANNEL_INDEX", "INTERLEAVE_INDEX", "NAME"]:
+                track.setdefault(tag, "".join(text))
+        path.pop()
+        text.clear()
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text.append
+
+    remaining = size
+    while remaining > 0 and not (state["track_list"] == "done" and len(values) == 3):
+        piece = f.read(min(IXML_READ_SIZE, remaining))
+        if not piece:
+            break
+        remaining -= len(piece)
+        # The chunk may be padded with NULs, which can't be part of the XML
+        if b"\0" in piece:
+            piece = piece.split(b"\0", 1)[0]
+            remaining = 0
+        parser.Parse(piece, False)
+
+    if state["track_list"] == "before":
+        raise WavFormatError("iXML without TRACK_LIST")
+
+    return WavIXML(scene=values.get("SCENE"), take=values.get("TAKE"), tape=values.get("TAPE"), track_list=track_list)
+
+
+def read_header(path: str) -> "WavHeader":
+    """
+    Read the fmt, bext, iXML and data information of a wav file. Only the
+    chunk headers and the few fields that are needed are read.
+    """
+    with open(path, "rb") as f:
+        chunks = read_chunks(f)
+        if b"fmt " not in chunks or b"data" not in chunks:
+            raise WavFormatError("{} has no fmt or data chunk".format(path))
+
+        fmt = WavAudioFormat(*struct.unpack("<HHIIHH", read_chunk(f, chunks, b"fmt ")[:16]))
+
+        bext = None
+        if b"bext" in chunks:
+            offset, size = chunks[b"bext"]
+            # Description, Originator, OriginatorReference, OriginationDate, OriginationTime, TimeReference
+            f.seek(offset)
+            fields = f.read(min(size, 346))
+            if len(fields) < 346:
+                raise WavFormatError("{} has a short bext chunk".format(path))
+            bext = WavBext(description=bext_string(fields[0:256]), originator_date=bext_string(fields[320:330]), originator_time=bext_string(fields[330:338]), time_reference=struct.unpack("<Q", fields[338:346])[0])
+
+        ixml = None
+        if b"iXML" in chunks:
+            ixml = parse_ixml(f, *chunks[b"iXML"])
+
+        _, data_size = chunks[b"data"]
+        data = WavDataDescriptor(byte_count=data_size, frame_count=int(data_size / fmt.block_align))
+
+    return WavHeader(fmt=fmt, bext=bext, ixml=ixml, data=data)
+
+
+def is_finalised(path: str) -> bool:
+    """
+    True if the header of the wav file describes the whole file. Recorders
+    and copy tools write placeholder sizes while a file is still growing
+    and only fill in the real RIFF and data sizes when they are done.
+    """
+    try:
+        with open(path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            chunks = read_chunks(f)
+            f.seek(0)
+            riff, riff_size = struct.unpack("<4sI", f.read(8))
+            if riff != b"RIFF":
+                if b"ds64" not in chunks:
+                    return False
+                riff_size = struct.unpack("<Q", read_chunk(f, chunks, b"ds64")[:8])[0]
+    except (OSError, WavFormatError, struct.error):
+        return False
+
+    if b"fmt " not in chunks or b"data" not in chunks:
+        return False
+    data_offset, data_size = chunks[b"data"]
+    return riff_size + 8 == file_size and 0 < data_size and data_offset + data_size <= file_size
+
+
+def ffmpeg_bext(bext: bytes) -> bytes:
+    """
+    Return the bext payload ffmpeg writes for a source with the given bext
+    payload when -map_metadata 0 -write_bext 1 is used
+    """
+    if bext is None or len(bext) < BEXT_FIXED_SIZE:
+        bext = bytes(BEXT_FIXED_SIZE)
+
+    payload = bytearray()
+    position = 0
+    # Text fields are stored up to the first NUL and padded with zeros
+    for _, length in BEXT_FIELDS:
+        field = bext[position:position+length].split(b"\0", 1)[0]
+        payload += field.ljust(length, b"\0")
+        position += length
+
+    # TimeReference
+    payload += bext[position:position+8]
+    position += 8
+
+    # ffmpeg always writes version 1, the UMID is only kept for version >= 1
+    version = struct.unpack("<H", bext[position:position+2])[0]
+    payload += struct.pack("<H", 1)
+    position += 2
+    if version >= 1:
+        payload += bext[position:position+64]
+    else:
+        payload += bytes(64)
+
+    # Loudness and reserved fields are zeroed
+    payload += bytes(190)
+
+    # CodingHistory is only written if the source had one, terminated by a NUL
+    if len(bext) > BEXT_FIXED_SIZE:
+        payload += bext[BEXT_FIXED_SIZE:].split(b"\0", 1)[0] + b"\0"
+
+    return bytes(payload)
+
+
+def needs_rf64(frame_count: int, sample_size: int) -> bool:
+    """
+    True if a mono file with frame_count samples of sample_size bytes
+    doesn't fit into a RIFF file
+    """
+    return frame_count * sample_size + RF64_HEADER_RESERVE > RIFF_LIMIT
+
+
+def mono_header(codec: str, samplerate: int, bext: bytes, frame_count: int, rf64: bool=False) -> bytes:
+    """
+    Return the header (everything up to and including the data chunk
+    header) of a mono wav file. With rf64 the header of a RF64 file is
+    returned, just like ffmpeg's "-rf64 auto" writes it for large files.
+    """
+    codec_tag, bits = NATIVE_CODECS[codec]
+    block_align = bits // 8
+    data_size = frame_count * block_align
+
+    # WAVEFORMATEXTENSIBLE is used for anything with more than 16 bits
+    if bits > 16:
+        fmt = struct.pack("<HHIIHH", WAVE_FORMAT_EXTENSIBLE, 1, samplerate, samplerate * block_align, block_align, bits)
+        fmt += struct.pack("<HHI", 22, bits, MONO_CHANNEL_MASK)
+        fmt += struct.pack("<IIII", codec_tag, 0x00100000, 0xAA000080, 0x719B3800)
+    else:
+        fmt = struct.pack("<HHIIHH", codec_tag, 1, samplerate, samplerate * block_align, block_align, bits)
+
+    # The sizes of RF64 files are stored in the ds64 chunk, which is filled in below
+    chunks = []
+    if rf64:
+        chunks.append((b"ds64", bytes(28)))
+    chunks.append((b"fmt ", fmt))
+
+    # Everything that is not plain PCM gets a fact chunk with the sample count
+    if codec_tag != WAVE_FORMAT_PCM:
+        chunks.append((b"fact", struct.pack("<I", RIFF_LIMIT if rf64 else frame_count)))
+
+    chunks.append((b"bext", bext))
+
+    header = b"WAVE"
+    for ident, payload in chunks:
+        header += struct.pack("<4sI", ident, len(payload)) + payload
+        if len(payload) & 1:
+            header += b"\0"
+    header += struct.pack("<4sI", b"data", RIFF_LIMIT if rf64 else data_size)
+
+    riff_size = len(header) + data_size + (data_size & 1)
+    if rf64:
+        ds64 = struct.pack("<QQQI", riff_size, data_size, frame_count, 0)
+        header = header[:12] + ds64 + header[12 + len(ds64):]
+        return struct.pack("<4sI", b"RF64", RIFF_LIMIT) + header
+    return struct.pack("<4sI", b"RIFF", riff_size) + header
+
+
+def read_parts(path: str, codec: str, continuations: [str]=()) -> ([(str, int, int)], int, int, bytes):
+    """
+    Find the data of the polywav at path and of its continuations, which
+    have to share its layout. Returns a (path, data offset, frame count)
+    triple for each part, the number of channels, the samplerate and the
+    bext payload of the first part as ffmpeg would write it.
+    """
+    if codec not in NATIVE_CODECS:
+        raise WavFormatError("The native splitter can't handle {}".format(codec))
+    sample_size = NATIVE_CODECS[codec][1] // 8
+
+    # Find the data of all parts before anything is written
+    parts = []
+    bext = None
+    for part in [path] + list(continuations):
+        with open(part, "rb") as f:
+            chunks = read_chunks(f)
+            fmt = read_chunk(f, chunks, b"fmt ")
+            if fmt is None or b"data" not in chunks:
+                raise WavFormatError("{} has no fmt or data chunk".format(part))
+            _, channels, samplerate, _, block_align, _ = struct.unpack("<HHIIHH", fmt[:16])
+            if bext is None:
+                bext = ffmpeg_bext(read_chunk(f, chunks, b"bext"))
+                layout = (channels, samplerate, block_align)
+            elif (channels, samplerate, block_align) != layout:
+                raise WavFormatError("{} doesn't have the same format as {}".format(part, path))
+            if block_align != channels * sample_size:
+                raise WavFormatError("{} doesn't contain {} samples".format(part, codec))
+
+            data_offset, data_size = chunks[b"data"]
+            # Clamp the data size to what is really there (e.g. unfinished files)
+            data_size = min(data_size, os.fstat(f.fileno()).st_size - data_offset)
+            parts.append((part, data_offset, data_size // block_align))
+
+    return parts, channels, samplerate, bext
+
+
+def split_wav(path: str, codec: str, outputs: [(int, str)], overwrite: bool=False, block_frames: int=BLOCK_FRAMES, continuations: [str]=(), measure: bool=False, checksums: dict=None, progress=None, silence_threshold: float=None) -> [str]:
+    """
+    Split the polywav at path into mono wav files, one for each given
+    (channel, outpath) pair. The data chunk is memory mapped and
+    de-interleaved one block of block_frames frames at a time, only the
+    current block is mapped, so neither memory use nor address space
+    depend on the length of the recording. Outputs that would exceed
+    the RIFF size limit are written as RF64.
+
+    The samples of the continuations (further files of the same take with
+    the same layout) are appended to the outputs in the given order.
+
+    With measure the statistics and waveform sidecars of the outputs are
+    computed from the blocks on their way through (see stats.py). If a dict
+    is passed as checksums, the checksum of the samples of the take is
+    stored in it under path and the one of each output under its outpath.
+    progress is called with the fraction of the take that is done after
+    each block.
+
+    With a silence_threshold (in dBFS) the peak of each channel is taken
+    from the blocks as well and the outputs that stay below it are removed
+    once the take is written.
+    Returns the outputs that were written (and kept).
+    """
+    parts, channels, samplerate, bext = read_parts(path, codec, continuations)
+    sample_size = NATIVE_CODECS[codec][1] // 8
+    hooks = []
+    if measure:
+        from mixpresplit import stats
+        meter = stats.TrackMeter([channel for channel, _ in outputs], samplerate)
+        hooks.append(lambda block: meter.add_block(block, codec))
+    if checksums is not None:
+        from mixpresplit import verify
+        source_hash = verify.new_hash()
+        hooks.append(source_hash.update)
+    if silence_threshold is not None:
+        peaks = PeakMeter(channels, codec)
+        hooks.append(peaks.add_block)
+
+    frame_count = sum(frames for _, _, frames in parts)
+    header = mono_header(codec, samplerate, bext, frame_count, needs_rf64(frame_count, sample_size))
+    if progress is not None:
+        done = [0]
+        def count(block):
+            done[0] += len(block)
+            progress(done[0] / max(frame_count, 1))
+        hooks.append(count)
+
+    mode = "wb" if overwrite else "xb"
+    files = []
+    try:
+        for _, outpath in outputs:
+            files.append(open(outpath, mode))
+    except OSError:
+        # Don't leave the outputs that were created before behind
+        for out in files:
+            out.close()
+            os.remove(out.name)
+        raise
+    try:
+        for out in files:
+            out.write(header)
+        # Only the samples are hashed, not the header and the padding
+        writers = files
+        if checksums is not None:
+            writers = [verify.HashingWriter(out) for out in files]
+
+        def on_block(block):
+            for hook in hooks:
+                hook(block)
+
+        for part, data_offset, frames in parts:
+            with open(part, "rb") as f:
+                write_blocks(f, data_offset, frames, channels, sample_size, outputs, writers, block_frames, on_block if hooks else None)
+
+        # Pad the data chunk to an even size
+        if (frame_count * sample_size) & 1:
+            for out in files:
+                out.write(b"\0")
+    finally:
+        for out in files:
+            out.close()
+
+    silent = []
+    if silence_threshold is not None:
+        silent = peaks.silent(outputs, silence_threshold)
+        for outpath in silent:
+            os.remove(outpath)
+    if measure:
+        stats.write_sidecars(meter, [outpath for _, outpath in outputs], silent)
+    if checksums is not None:
+        checksums[path] = source_hash.hexdigest()
+        for (_, outpath), writer in zip(outputs, writers):
+            if outpath not in silent:
+                checksums[outpath] = writer.hexdigest()
+    return [outpath for _, outpath in outputs if outpath not in silent]
+
+
+def numpy_available() -> bool:
+    """
+    True if numpy, which the native splitter needs, can be imported
+    """
+    try:
+        import numpy
+    except ImportError:
+        return False
+    return True
+
+
+def read_blocks(f, data_offset: int, frame_count: int, channels: int, sample_size: int, block_frames: int):
+    """
+    Yield the frame_count frames starting at data_offset of the opened file
+    f as blocks of up to block_frames frames. Each block is a numpy view of
+    frames x channels x sample bytes into a mapping of just that block, it
+    is only valid until the next block is requested.
+    """
+    import numpy as np
+
+    block_align = channels * sample_size
+    for start in range(0, frame_count, block_frames):
+        count = min(block_frames, frame_count - start)
+        # Mappings have to start at a multiple of the allocation granularity
+        offset = data_offset + start * block_align
+        aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(f.fileno(), offset - aligned + count * block_align, access=mmap.ACCESS_READ, offset=aligned) as mm:
+            # View the block as frames x channels x sample bytes
+            block = np.frombuffer(mm, dtype=np.uint8, count=count * block_align, offset=offset - aligned)
+            block = block.reshape(count, channels, sample_size)
+            yield block
+            del block
+
+
+def write_blocks(f, data_offset: int, frame_count: int, channels: int, sample_size: int, outputs: [(int, str)], files: list, block_frames: int, on_block=None) -> None:
+    """
+    De-interleave frame_count frames starting at data_offset of the opened
+    file f and append the channels of outputs to the according files.
+    on_block is called with each block as well, it must not keep it.
+    """
+    for block in read_blocks(f, data_offset, frame_count, channels, sample_size, block_frames):
+        for (channel, _), out in zip(outputs, files):
+            out.write(block[:, channel, :].tobytes())
+        if on_block is not None:
+            on_block(block)
+        del block
+
+
+def block_samples(block, codec: str):
+    """
+    Return the samples of a block as float32 frames x channels, scaled so
+    that full scale is 1.0
+    """
+    import numpy as np
+
+    frames, channels, _ = block.shape
+    if codec == "pcm_f32le":
+        return np.ascontiguousarray(block).view("<f4").reshape(frames, channels)
+    if codec == "pcm_s16le":
+        return np.ascontiguousarray(block).view("<i2").reshape(frames, channels).astype(np.float32) / 2**15
+    # Assemble the 3 bytes of 24 bit samples in the upper bytes of int32, which keeps the sign
+    samples = np.zeros((frames, channels, 4), dtype=np.uint8)
+    samples[:, :, 1:] = block
+    return samples.view("<i4").reshape(frames, channels).astype(np.float32) / 2**31
+
+
+def reduce_channels(samples) -> ("numpy.ndarray", "numpy.ndarray"):
+    """
+    Return the peak and the sum of squares of each channel of frames x
+    channels samples. numpy reduces narrow columns slowly, so the frames
+    are folded into rows of LEVEL_FOLD frames first.
+    """
+    import numpy as np
+
+    frames, channels = samples.shape
+    peaks = np.zeros(channels, dtype=np.float64)
+    squares = np.zeros(channels, dtype=np.float64)
+    folded = frames - frames % LEVEL_FOLD
+    for part, rows in [(samples[:folded], LEVEL_FOLD), (samples[folded:], 1)]:
+        if len(part) == 0:
+            continue
+        wide = part.reshape(-1, rows * channels)
+        peak = np.maximum(wide.max(axis=0), -wide.min(axis=0))
+        peaks = np.maximum(peaks, peak.reshape(rows, channels).max(axis=0))
+        squares += np.square(wide).sum(axis=0, dtype=np.float64).reshape(rows, channels).sum(axis=0)
+    return peaks, squares
+
+
+def channel_levels(path: str, codec: str, continuations: [str]=(), block_frames: int=BLOCK_FRAMES) -> [(float, float)]:
+    """
+    Return the (peak, rms) level of each channel of the polywav at path (and
+    its continuations) relative to full scale, read in a single pass
+    """
+    import numpy as np
+
+    parts, channels, _, _ = read_parts(path, codec, continuations)
+    sample_size = NATIVE_CODECS[codec][1] // 8
+    peaks = np.zeros(channels, dtype=np.float64)
+    squares = np.zeros(channels, dtype=np.float64)
+    frame_count = 0
+    for part, data_offset, frames in parts:
+        with open(part, "rb") as f:
+            for block in read_blocks(f, data_offset, frames, channels, sample_size, block_frames):
+                samples = block_samples(block, codec)
+                block_peaks, block_squares = reduce_channels(samples)
+                peaks = np.maximum(peaks, block_peaks)
+                squares += block_squares
+                # The samples may be a view of the mapping, which is closed for the next block
+                del samples, block
+        frame_count += frames
+
+    rms = np.sqrt(squares / max(frame_count, 1))
+    return [(float(peak), float(level)) for peak, level in zip(peaks, rms)]
+
+
+class PeakMeter():
+    """
+    Follows the peak of each channel of the blocks of a split, so silent
+    tracks are found without reading the source again
+    """
+    def __init__(self, channels: int, codec: str) -> "PeakMeter":
+        import numpy as np
+        self.codec = codec
+        self.peaks = np.zeros(channels, dtype=np.float64)
+
+    def add_block(self, block) -> None:
+        import numpy as np
+        peaks, _ = reduce_channels(block_samples(block, self.codec))
+        self.peaks = np.maximum(self.peaks, peaks)
+
+    def silent(self, outputs: [(int, str)], threshold: float) -> [str]:
+        """
+        Return the outpaths whose channel peaks below the threshold (in dBFS)
+        """
+        return [outpath for channel, outpath in outputs if decibels(self.peaks[channel]) < threshold]
+
+
+def decibels(level: float) -> float:
+    """
+    Return a level relative to full scale in dBFS
+    """
+    return 20 * math.log10(level) if level > 0 else float("-inf")
@@ -0,0 +1,107 @@
+#-*- coding: utf-8 -*-
+"""
+Generator for synthetic MixPre-like polywav files with bext and iXML.
+"""
+
+import struct
+
+
+BITS_TO_FORMAT = {
+    32 : 0x0003,
+    24 : 0x0001,
+    16 : 0x0001,
+}
+
+
+def bext_chunk(scene: str, take: int, tape: str, date: str, time: str, circled: bool, tracknames: [str], time_reference: int=0) -> bytes:
+    """
+    Return a bext payload with a description like the one of the MixPre
+    """
+    lines = [
+        "sSPEED=030.000-ND",
+        "sTAKE={:03d}".format(take),
+        "sSCENE={}".format(scene),
+        "sTAPE={}".format(tape),
+        "sCIRCLED={}".format("TRUE" if circled else "FALSE"),
+    ]
+    lines += ["sTRK{}={}".format(n + 1, name) for n, name in enumerate(tracknames)]
+    description = "\r\n".join(lines).encode("ascii")[:256]
+
+    payload = description.ljust(256, b"\0")
+    payload += b"mixpresplit".ljust(32, b"\0")
+    payload += b"".ljust(32, b"\0")
+    payload += date.encode("ascii").ljust(10, b"\0")
+    payload += time.encode("ascii").ljust(8, b"\0")
+    payload += struct.pack("<QH", time_reference, 1)
+    payload += bytes(64 + 190)
+    payload += b"A=PCM\r\n\0"
+    return payload
+
+
+def ixml_chunk(scene: str, take: int, tape: str, circled: bool, tracknames: [str], total_files: int=1, file_set_index: str="A", family_uid: str="FAMILY") -> bytes:
+    """
+    Return an iXML payload with a track list like the one of the MixPre
+    """
+    tracks = []
+    for n, name in enumerate(tracknames):
+        tracks.append("\t\t<TRACK>\r\n\t\t\t<CHANNEL_INDEX>{0}</CHANNEL_INDEX>\r\n\t\t\t<INTERLEAVE_INDEX>{0}</INTERLEAVE_INDEX>\r\n\t\t\t<NAME>{1}</NAME>\r\n\t\t</TRACK>\r\n".format(n + 1, name))
+    xml = (
+        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\r\n<BWFXML>\r\n"
+        "\t<IXML_VERSION>1.5</IXML_VERSION>\r\n"
+        "\t<SCENE>{}</SCENE>\r\n\t<TAKE>{:03d}</TAKE>\r\n\t<TAPE>{}</TAPE>\r\n\t<CIRCLED>{}</CIRCLED>\r\n"
+        "\t<FILE_SET>\r\n\t\t<TOTAL_FILES>{}</TOTAL_FILES>\r\n\t\t<FAMILY_UID>{}</FAMILY_UID>\r\n\t\t<FILE_SET_INDEX>{}</FILE_SET_INDEX>\r\n\t</FILE_SET>\r\n"
+        "\t<TRACK_LIST>\r\n\t\t<TRACK_COUNT>{}</TRACK_COUNT>\r\n{}\t</TRACK_LIST>\r\n</BWFXML>\r\n"
+    ).format(scene, take, tape, "TRUE" if circled else "FALSE", total_files, family_uid, file_set_index, len(tracknames), "".join(tracks))
+    return xml.encode("utf-8")
+
+
+def chunk(ident: bytes, payload: bytes) -> bytes:
+    padding = b"\0" if len(payload) & 1 else b""
+    return struct.pack("<4sI", ident, len(payload)) + payload + padding
+
+
+def write_polywav(path: str, channels: int=10, frames: int=48000, bits: int=32, samplerate: int=48000,
+                  scene: str="Synthetic", take: int=1, tape: str="TAPE", date: str="2020-08-04", time: str="11:08:22",
+                  circled: bool=False, tracknames: [str]=None, rf64: bool=False, data: bytes=None, sparse: bool=False,
+                  time_reference: int=0, total_files: int=1, file_set_index: str="A", family_uid: str="FAMILY") -> str:
+    """
+    Write a polywav with the given layout. The samples are taken from data
+    (interleaved bytes), a counting pattern is used if no data is given.
+    With sparse the data chunk is only allocated (zeros), which allows
+    creating files of many GiB in no time on filesystems with sparse files.
+    """
+    if tracknames is None:
+        tracknames = ["MixL", "MixR"] + ["Track {}".format(n + 1) for n in range(channels - 2)]
+    block_align = channels * bits // 8
+    data_size = frames * block_align
+
+    if data is None and not sparse:
+        # Every sample holds the number of its channel in its lowest byte
+        frame = b"".join(bytes([n + 1]) + bytes(bits // 8 - 1) for n in range(channels))
+        data = frame * frames
+
+    fmt = struct.pack("<HHIIHH", BITS_TO_FORMAT[bits], channels, samplerate, samplerate * block_align, block_align, bits)
+    body = b""
+    if rf64:
+        body += chunk(b"ds64", bytes(28))
+    body += chunk(b"bext", bext_chunk(scene, take, tape, date, time, circled, tracknames, time_reference))
+    body += chunk(b"iXML", ixml_chunk(scene, take, tape, circled, tracknames, total_files, file_set_index, family_uid))
+    body += chunk(b"fmt ", fmt)
+
+    riff_size = 4 + len(body) + 8 + data_size + (data_size & 1)
+    if rf64:
+        ds64 = struct.pack("<QQQI", riff_size, data_size, frames, 0)
+        body = body[:8] + ds64 + body[8 + len(ds64):]
+        header = struct.pack("<4sI4s", b"RF64", 0xFFFFFFFF, b"WAVE") + body + struct.pack("<4sI", b"data", 0xFFFFFFFF)
+    else:
+        header = struct.pack("<4sI4s", b"RIFF", riff_size, b"WAVE") + body + struct.pack("<4sI", b"data", data_size)
+
+    with open(path, "wb") as f:
+        f.write(header)
+        if sparse:
+            f.truncate(len(header) + data_size + (data_size & 1))
+        else:
+            f.write(data)
+            if data_size & 1:
+                f.write(b"\0")
+    return path
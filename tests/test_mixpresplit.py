@@ -3,8 +3,12 @@ import pytest
 import click
 from click.testing import CliRunner
 import re
+import os
+import shutil
+import json
 import mixpresplit
 from mixpresplit.cli import *
+from mixpresplit.api import make_options
 
 TRACK_PATTERN = re.compile(r"\[(?P<number>\d)\] -> \.\./(?P<scene>[A-z0-9 _-]+)-(?P<take>\d+?)\.(?P<tracknumber>\d+?)_(?P<trackname>[A-z0-9_ -]+?)\.wav")
 
@@ -24,6 +28,16 @@ def runner():
     return CliRunner()
 
 
+@pytest.fixture(autouse=True)
+def metadata_cache(tmp_path, monkeypatch):
+    """
+    Keep the metadata cache of the tests out of the users cache directory
+    """
+    path = str(tmp_path / "cache" / "metadata.json")
+    monkeypatch.setenv("MIXPRESPLIT_CACHE", path)
+    return path
+
+
 def test_version():
     assert mixpresplit.__version__ == '0.1.8'
 
@@ -56,6 +70,16 @@ def test_basic(runner):
     assert result.exit_code == 0
 
 
+def test_missing_outpath(runner):
+    """
+    Test if a call without OUTPATH is an error instead of splitting nothing
+    """
+    for args in [["./testsamples/channeltests"], []]:
+        result = runner.invoke(main, args)
+        assert result.exit_code == 2
+        assert "Missing argument 'OUTPATH'" in result.output
+
+
 def test_channels(runner):
     """
     Test if all files map correctly to the corresponding channels
@@ -262,3 +286,980 @@ def test_filter_tracknotrange(runner):
     if result.exception:
         traceback.print_exception(*result.exc_info)
     assert result.exit_code == 0
+
+
+def test_single_pass(runner):
+    """
+    Test if --single-pass plans the same outputs as the per track split
+    """
+    input_directory = "./testsamples/channeltests"
+    arguments = ["--dry-run", "--takes", "1-3", "--tracks", "!7", input_directory, "../{scene}-{take}.{tracknumber}_{trackname}"]
+    result = runner.invoke(main, arguments)
+    result_single_pass = runner.invoke(main, ["--single-pass"] + arguments)
+
+    if result_single_pass.exception:
+        traceback.print_exception(*result_single_pass.exc_info)
+    assert result_single_pass.exit_code == 0
+    # The order of the ignored takes is not stable, so compare the splits only
+    assert result.output.split("Processing")[1] == result_single_pass.output.split("Processing")[1]
+
+
+def test_single_pass_command():
+    """
+    Test if the single pass command maps each channel to its own output
+    """
+    meta = read_metadata("./testsamples/channeltests/Testsample-001.WAV")
+    options = make_options(bit24=True, overwrite=True)
+    outputs = [(0, "a.wav"), (4, "b.wav")]
+    cmd = single_pass_command(meta, outputs, options)
+
+    # The source is only read once
+    assert cmd.count("-i") == 1
+    assert "[0:a]asplit=2[s0][s1];[s0]pan=1|c0=c0[c0];[s1]pan=1|c0=c4[c4]" in cmd
+
+    # Each output is preceded by its own mapping and codec options
+    for channel, outpath in outputs:
+        position = cmd.index(outpath)
+        assert cmd[cmd.index("[c{}]".format(channel)) - 1] == "-map"
+        assert cmd[position-2:position] == ["-sample_fmt", "s24"]
+
+
+def test_native(runner, tmp_path):
+    """
+    Test if the native splitter writes each channel of the source unchanged
+    """
+    np = pytest.importorskip("numpy")
+    from mixpresplit import wav
+    source = "./testsamples/channeltests/Testsample-001.WAV"
+    result = runner.invoke(main, ["--native", "--takes", "1", "./testsamples/channeltests", str(tmp_path / "{tracknumber}")])
+    if result.exception:
+        traceback.print_exception(*result.exc_info)
+    assert result.exit_code == 0
+
+    with open(source, "rb") as f:
+        chunks = wav.read_chunks(f)
+        samples = np.frombuffer(wav.read_chunk(f, chunks, b"data"), dtype="<f4").reshape(-1, 10)
+
+    meta = read_metadata(source)
+    for i, track in meta.tracks.items():
+        with open(str(tmp_path / "{}.wav".format(track["tracknumber"])), "rb") as f:
+            chunks = wav.read_chunks(f)
+            written = np.frombuffer(wav.read_chunk(f, chunks, b"data"), dtype="<f4")
+            assert struct.unpack("<I", wav.read_chunk(f, chunks, b"fact"))[0] == len(written)
+        assert np.array_equal(samples[:, i-1], written)
+
+    # Existing outputs stop the run with an error, no half created outputs are left
+    os.remove(str(tmp_path / "1.wav"))
+    result = runner.invoke(main, ["--native", "--rewrite", "--takes", "1", "./testsamples/channeltests", str(tmp_path / "{tracknumber}")])
+    assert result.exit_code == 1
+    assert "Error:" in result.output
+    assert not os.path.exists(str(tmp_path / "1.wav"))
+
+
+def test_jobs(runner, tmp_path):
+    """
+    Test if --jobs writes the same outputs in the same order as a sequential run
+    """
+    pytest.importorskip("numpy")
+    input_directory = "./testsamples/channeltests"
+    result = runner.invoke(main, ["--native", "--takes", "1-5", input_directory, str(tmp_path / "a" / "{take}-{tracknumber}")])
+    result_jobs = runner.invoke(main, ["--native", "--jobs", "4", "--takes", "1-5", input_directory, str(tmp_path / "b" / "{take}-{tracknumber}")])
+    if result_jobs.exception:
+        traceback.print_exception(*result_jobs.exc_info)
+    assert result_jobs.exit_code == 0
+    # The free space and the waiting times differ between the runs
+    output = "".join(l for l in result.output.splitlines(True) if not l.startswith("Needs"))
+    output_jobs = "".join(l for l in result_jobs.output.splitlines(True) if not l.startswith(("Waited", "Needs")))
+    assert output.split("Processing")[1] == output_jobs.split("Processing")[1].replace(str(tmp_path / "b"), str(tmp_path / "a"))
+
+    # Existing files are not overwritten, the run stops with an error instead
+    result_jobs = runner.invoke(main, ["--native", "--rewrite", "--jobs", "4", "--takes", "1-5", input_directory, str(tmp_path / "b" / "{take}-{tracknumber}")])
+    assert result_jobs.exit_code == 1
+    assert "Error:" in result_jobs.output
+
+    # So does a source the native splitter can't read
+    from tests.polywav import write_polywav
+    broken = tmp_path / "broken"
+    broken.mkdir()
+    write_polywav(str(broken / "T1.WAV"), channels=4, frames=100, take=1)
+    content = bytearray((broken / "T1.WAV").read_bytes())
+    block_align = content.index(b"fmt ") + 8 + 12
+    content[block_align:block_align + 2] = (5).to_bytes(2, "little")
+    (broken / "T1.WAV").write_bytes(bytes(content))
+    result_jobs = runner.invoke(main, ["--native", "--no-cache", "--jobs", "2", str(broken), str(tmp_path / "c" / "{take}-{tracknumber}")])
+    assert result_jobs.exit_code == 1
+    assert "Stopped after the running jobs finished" in result_jobs.output
+
+
+def test_metadata_cache(tmp_path):
+    """
+    Test if cached metadata equals freshly read metadata and if changed files are read again
+    """
+    from mixpresplit.cache import MetadataCache
+    paths = sorted(get_wavs_files("./testsamples/channeltests"))
+    metas = read_metadatas(paths, MetadataCache())
+    assert [m.to_dict() for m in metas] == [read_metadata(p).to_dict() for p in paths]
+
+    cache = MetadataCache()
+    assert len(cache.entries) == len(paths)
+    cached_metas = read_metadatas(paths, cache)
+    assert [m.to_dict() for m in cached_metas] == [m.to_dict() for m in metas]
+    # Reading everything from the cache doesn't write it again
+    assert not cache.changed
+
+    # A file is not taken from the cache anymore once it changed
+    path = str(tmp_path / "Testsample-001.WAV")
+    shutil.copy(paths[0], path)
+    read_metadatas([path], cache)
+    assert MetadataCache().get(path, os.stat(path)) is not None
+    os.utime(path, ns=(0, 0))
+    assert MetadataCache().get(path, os.stat(path)) is None
+
+    # Only the most recently used entries survive
+    cache = MetadataCache(max_entries=2)
+    for p in paths[:3]:
+        cache.get(p, os.stat(p))
+    cache.save()
+    assert set(MetadataCache().entries.keys()) == set(os.path.abspath(p) for p in paths[1:3])
+
+
+def test_read_header():
+    """
+    Test if the fast header reader results in the same metadata as wavinfo
+    """
+    from mixpresplit import wav
+    from wavinfo import WavInfoReader
+    for path in sorted(get_wavs_files("./testsamples/channeltests")):
+        header = wav.read_header(path)
+        reader = WavInfoReader(path)
+        assert header.fmt == reader.fmt
+        assert header.data == reader.data
+        assert header.bext.description == reader.bext.description
+        assert header.bext.originator_date == reader.bext.originator_date
+        assert header.bext.originator_time == reader.bext.originator_time
+        assert (header.ixml.scene, header.ixml.take, header.ixml.tape) == (reader.ixml.scene, reader.ixml.take, reader.ixml.tape)
+        assert [(t.channel_index, t.interleave_index, t.name) for t in header.ixml.track_list] == [(t.channel_index, t.interleave_index, t.name) for t in reader.ixml.track_list]
+
+
+def test_read_header_fallback(tmp_path):
+    """
+    Test if files the fast reader can't handle are read with wavinfo
+    """
+    path = str(tmp_path / "broken.wav")
+    with open("./testsamples/channeltests/Testsample-001.WAV", "rb") as f:
+        content = bytearray(f.read())
+    # Break the iXML without touching the chunk structure
+    position = content.index(b"<TRACK_LIST>")
+    content[position:position+12] = b"<TRACK_LIST "
+    with open(path, "wb") as f:
+        f.write(content)
+    meta = read_metadata(path)
+    assert meta.take == 1
+
+
+def test_resume(runner, tmp_path):
+    """
+    Test if complete outputs are skipped and interrupted ones are written again
+    """
+    pytest.importorskip("numpy")
+    from mixpresplit.manifest import Manifest
+    arguments = ["--native", "--takes", "1", "./testsamples/channeltests", str(tmp_path / "{take}" / "{tracknumber}")]
+    result = runner.invoke(main, arguments)
+    assert result.exit_code == 0
+    assert "(Up to date)" not in result.output
+
+    # Pretend the run was interrupted while writing track 3
+    manifest = Manifest(str(tmp_path))
+    record = dict(manifest.records[str(tmp_path / "1" / "3.wav")], event="start")
+    manifest.append(record)
+    with open(str(tmp_path / "1" / "3.wav"), "r+b") as f:
+        f.truncate(100)
+
+    result = runner.invoke(main, arguments)
+    if result.exception:
+        traceback.print_exception(*result.exc_info)
+    assert result.exit_code == 0
+    assert result.output.count("(Up to date)") == 9
+    assert "3.wav (Up to date)" not in result.output
+    assert os.path.getsize(str(tmp_path / "1" / "3.wav")) == os.path.getsize(str(tmp_path / "1" / "4.wav"))
+
+    # A changed output is written again
+    os.utime(str(tmp_path / "1" / "4.wav"), ns=(0, 0))
+    result = runner.invoke(main, ["--overwrite"] + arguments)
+    assert result.output.count("(Up to date)") == 9
+    assert "4.wav (Up to date)" not in result.output
+
+
+def test_rf64_metadata(tmp_path):
+    """
+    Test if the metadata of a RF64 file with more than 4 GiB of samples is read correctly
+    """
+    from tests.polywav import write_polywav
+    frames = 5 * 2**30 // 8
+    path = write_polywav(str(tmp_path / "large.wav"), channels=2, frames=frames, tracknames=["MixL", "MixR"], rf64=True, sparse=True)
+    meta = read_metadata(path)
+    assert meta.samplecount == frames
+    assert meta.channels == 2
+
+    # Each track has 2.5 GiB, it only exceeds the limit once converted to 64 bit
+    options = make_options()
+    assert "-rf64" not in split_command(meta, 0, "out.wav", options)
+    meta.samplecount *= 2
+    assert split_command(meta, 0, "out.wav", options)[-6:-4] == ["-rf64", "auto"]
+    assert "-rf64" not in split_command(meta, 0, "out.flac", dict(options, flac=True))
+
+
+def test_rf64_split(tmp_path, monkeypatch):
+    """
+    Test if RF64 sources are split natively and large outputs are written as RF64
+    """
+    np = pytest.importorskip("numpy")
+    from mixpresplit import wav
+    from tests.polywav import write_polywav
+    source = write_polywav(str(tmp_path / "source.wav"), channels=4, frames=100001, bits=24, rf64=True)
+
+    # Pretend every output is too large for RIFF
+    monkeypatch.setattr(wav, "RF64_HEADER_RESERVE", wav.RIFF_LIMIT)
+    wav.split_wav(source, "pcm_s24le", [(1, str(tmp_path / "1.wav")), (3, str(tmp_path / "3.wav"))], block_frames=4096)
+
+    for channel in [1, 3]:
+        with open(str(tmp_path / "{}.wav".format(channel)), "rb") as f:
+            assert f.read(4) == b"RF64"
+            chunks = wav.read_chunks(f)
+            data = np.frombuffer(wav.read_chunk(f, chunks, b"data"), dtype=np.uint8).reshape(-1, 3)
+        assert len(data) == 100001
+        assert (data[:, 0] == channel + 1).all() and not data[:, 1:].any()
+        assert chunks[b"data"][0] + chunks[b"data"][1] + 1 == os.path.getsize(str(tmp_path / "{}.wav".format(channel)))
+
+
+@pytest.mark.skipif(not os.environ.get("MIXPRESPLIT_LARGE_TESTS"), reason="writes more than 9 GiB, set MIXPRESPLIT_LARGE_TESTS=1")
+def test_rf64_split_large(tmp_path):
+    """
+    Test if splitting a source with tracks of more than 4 GiB results in RF64 files
+    """
+    pytest.importorskip("numpy")
+    from mixpresplit import wav
+    from tests.polywav import write_polywav
+    frames = 2**32 // 4 + 48000
+    source = write_polywav(str(tmp_path / "large.wav"), channels=2, frames=frames, tracknames=["MixL", "MixR"], rf64=True, sparse=True)
+    wav.split_wav(source, "pcm_f32le", [(1, str(tmp_path / "1.wav"))])
+    with open(str(tmp_path / "1.wav"), "rb") as f:
+        assert f.read(4) == b"RF64"
+        chunks = wav.read_chunks(f)
+    assert chunks[b"data"][1] == frames * 4
+    assert os.path.getsize(str(tmp_path / "1.wav")) == chunks[b"data"][0] + frames * 4
+
+
+def test_stitch(runner, tmp_path):
+    """
+    Test if takes that continue in further files are split into a single file per track
+    """
+    np = pytest.importorskip("numpy")
+    from mixpresplit import wav
+    from tests.polywav import write_polywav
+    input_directory = tmp_path / "in"
+    input_directory.mkdir()
+    parts = []
+    time_reference = 1000
+    for n, frames in enumerate([5000, 5000, 3001]):
+        data = np.full((frames, 4), n + 1, dtype="<f4").tobytes()
+        path = str(input_directory / "T1_{}.WAV".format(n))
+        parts.append(write_polywav(path, channels=4, frames=frames, take=1, data=data, time_reference=time_reference))
+        time_reference += frames
+    # A different take and a file of the same take that doesn't continue it
+    write_polywav(str(input_directory / "T2.WAV"), channels=4, frames=100, take=2, time_reference=time_reference)
+    write_polywav(str(input_directory / "T1_X.WAV"), channels=4, frames=100, take=1, scene="Other", time_reference=time_reference)
+
+    metas = stitch_takes(read_metadatas(sorted(get_wavs_files(str(input_directory)))))
+    assert len(metas) == 3
+    stitched = [m for m in metas if m.continuations][0]
+    assert stitched.filepaths == parts
+    assert stitched.samplecount == 13001
+
+    # Both ffmpeg commands read all parts in one go
+    options = make_options()
+    cmd = split_command(stitched, 2, "out.wav", options)
+    assert cmd.count("-i") == 3
+    assert "[0:a][1:a][2:a]concat=n=3:v=0:a=1,pan=1|c0=c2[c2]" in cmd
+    cmd = single_pass_command(stitched, [(2, "out.wav")], options)
+    assert "[0:a][1:a][2:a]concat=n=3:v=0:a=1,asplit=1[s0];[s0]pan=1|c0=c2[c2]" in cmd
+
+    result = runner.invoke(main, ["--native", "--takes", "1", str(input_directory), str(tmp_path / "out" / "{scene}-{take}-{tracknumber}")])
+    if result.exception:
+        traceback.print_exception(*result.exc_info)
+    assert result.exit_code == 0
+    assert result.output.count("(+2 continuation files)") == 1
+
+    with open(str(tmp_path / "out" / "Synthetic-1-1.wav"), "rb") as f:
+        chunks = wav.read_chunks(f)
+        samples = np.frombuffer(wav.read_chunk(f, chunks, b"data"), dtype="<f4")
+        assert struct.unpack("<I", wav.read_chunk(f, chunks, b"fact"))[0] == 13001
+    assert samples.tolist() == [1.0] * 5000 + [2.0] * 5000 + [3.0] * 3001
+
+    result = runner.invoke(main, ["--dry-run", "--no-stitch", "--takes", "1", str(input_directory), str(tmp_path / "out" / "{take}-{tracknumber}")])
+    assert "continuation" not in result.output
+
+
+def test_watch(tmp_path, capsys):
+    """
+    Test if takes are only picked up once they have been written completely
+    """
+    from mixpresplit import wav
+    from mixpresplit.manifest import MANIFEST_NAME
+    from mixpresplit.watch import Watcher
+    from tests.polywav import write_polywav
+    input_directory = tmp_path / "in"
+    input_directory.mkdir()
+    path = write_polywav(str(input_directory / "T1.WAV"), channels=4, frames=1000)
+    with open(path, "rb") as f:
+        finalised = f.read()
+
+    # A recorder that is still writing has placeholder sizes in the header
+    with open(path, "wb") as f:
+        f.write(finalised[:4] + bytes(4) + finalised[8:-4000])
+    assert not wav.is_finalised(path)
+    watcher = Watcher([str(input_directory)])
+    assert watcher.poll() == []
+    assert watcher.poll() == []
+
+    with open(path, "wb") as f:
+        f.write(finalised)
+    assert wav.is_finalised(path)
+    # The size has to be stable for a poll before the file is ready
+    assert watcher.poll() == []
+    assert watcher.poll() == [path]
+    assert watcher.poll() == []
+
+    # A take that lands later doesn't report the first one again
+    second = write_polywav(str(input_directory / "T2.WAV"), channels=4, frames=1000, take=2)
+    os.utime(str(input_directory), ns=(0, 0))
+    assert watcher.poll() == []
+    assert watcher.poll() == [second]
+    assert watcher.poll() == []
+    os.remove(second)
+
+    # Takes in subfolders are found like in a normal run, outputs of earlier splits aren't
+    card = tmp_path / "card"
+    (card / "Day 1").mkdir(parents=True)
+    (card / "split").mkdir()
+    (card / "split" / MANIFEST_NAME).write_text("")
+    write_polywav(str(card / "split" / "T1.WAV"), channels=4, frames=1000)
+    watcher = Watcher([str(card)])
+    assert watcher.poll() == []
+    nested = write_polywav(str(card / "Day 1" / "T3.WAV"), channels=4, frames=1000, take=3)
+    assert watcher.poll() == []
+    assert watcher.poll() == [nested]
+    assert Watcher([str(card)], settle=0, recursive=False).poll() == []
+
+    options = make_options(native=True, jobs=2, cache=False, watch=True, interval=0.1)
+    outpath = str(tmp_path / "out" / "{scene}-{take}-{tracknumber}")
+    manifest = Manifest(manifest_directory(outpath))
+    written_to = watch_inpaths([str(input_directory)], outpath, options, manifest, polls=3)
+    assert len(written_to) == 4
+    assert all(os.path.isfile(p) for p in written_to)
+
+    # A restarted watch skips what is up to date and splits the new take
+    write_polywav(str(input_directory / "T2.WAV"), channels=4, frames=1000, take=2)
+    written_to = watch_inpaths([str(input_directory)], outpath, options, manifest, polls=3)
+    assert len(written_to) == 8
+    assert os.path.isfile(str(tmp_path / "out" / "Synthetic-2-1.wav"))
+
+    # A wav that isn't from a MixPre is reported once and doesn't stop the watch
+    import wave
+    with wave.open(str(input_directory / "plain.wav"), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(48000)
+        f.writeframes(bytes(2000))
+    capsys.readouterr()
+    written_to = watch_inpaths([str(input_directory)], outpath, options, manifest, polls=4)
+    assert len(written_to) == 8
+    assert capsys.readouterr().out.count("plain.wav, it can't be read") == 1
+
+
+def test_compiled_filter():
+    """
+    Test the filter grammar, including numbers and ranges with several digits
+    """
+    from mixpresplit.filters import Filter, compile_filter
+    tracks = [(1, "MixL"), (2, "MixR"), (3, "Boom"), (4, "Lav Anna"), (12, "Track 12"), (15, "Track 15")]
+
+    def selected(text, names=True):
+        f = Filter(text)
+        return [n for n, name in tracks if f.matches(n, name if names else None)]
+
+    assert selected("all") == [1, 2, 3, 4, 12, 15]
+    assert selected("mixdown") == [1, 2]
+    assert selected("12") == [12]
+    assert selected("10-15") == [12, 15]
+    assert selected("3,12") == [3, 12]
+    assert selected("!12") == [1, 2, 3, 4, 15]
+    assert selected("Lav") == [4]
+    assert selected("!Track") == [1, 2, 3, 4]
+    # Takes have no names, so words (except all) never match
+    assert selected("mixdown", names=False) == []
+    assert selected("all", names=False) == [1, 2, 3, 4, 12, 15]
+    # Each text is only parsed once, results are remembered
+    f = compile_filter("1-4,!Boom")
+    assert compile_filter("1-4,!Boom") is f
+    assert f.matches(3, "Boom") is False
+    assert (3, "Boom") in f.results
+
+
+def test_outpath_template(runner):
+    """
+    Test the compiled OUTPATH templates and the check for unknown keywords
+    """
+    from mixpresplit.outpath import OutpathTemplate, OutpathError
+    meta = read_metadata("./testsamples/channeltests/Testsample-001.WAV")
+    channel = list(meta.tracks.keys())[-1]
+    track = meta.tracks[channel]
+    hour, minute, second = meta.timestring.split(":")
+
+    template = OutpathTemplate("out/{date}/{h}-{min}-{s}/{scene}_{take}_{tape}_{n}_{name}{circled}", replace=("out", "_"), with_=("in", "-"))
+    assert template.render(meta) == "in/{}/{}-{}-{}/{}-{}-{}-{{n}}-{{name}}{{circled}}".format(meta.datestring, hour, minute, second, meta.scene, meta.take, meta.tape)
+    assert template.render(meta, channel).endswith("-{}-{}{{circled}}".format(track["tracknumber"], track["trackname"]))
+    assert expand_outpath("{track}/{trackname}", meta, channel) == "{}/{}".format(track["tracknumber"], track["trackname"])
+
+    with pytest.raises(OutpathError):
+        OutpathTemplate("out/{date}/{foo}")
+    result = runner.invoke(main, ["--dry-run", "./testsamples/channeltests", "../{scene}/{tacke}"])
+    assert "Error:" in result.output and "{tacke}" in result.output
+    assert "Processing" not in result.output
+
+
+def test_plan_execute(runner, tmp_path, monkeypatch):
+    """
+    Test if a written plan can be executed (in shards) without the metadata of the sources
+    """
+    from tests.polywav import write_polywav
+    input_directory = tmp_path / "in"
+    input_directory.mkdir()
+    for take in range(1, 4):
+        write_polywav(str(input_directory / "T{}.WAV".format(take)), channels=4, frames=1000 * take, take=take)
+    plan_path = str(tmp_path / "plan.json")
+    outpath = str(tmp_path / "out" / "{scene}-{take}-{tracknumber}")
+
+    result = runner.invoke(main, ["--native", "--tracks", "1-2", "--flac-level", "8", "--plan", plan_path, str(input_directory), outpath])
+    assert result.exit_code == 0
+    assert "Wrote the plan for 3 take(s) with 6 output(s)" in result.output
+    assert not os.path.exists(str(tmp_path / "out"))
+    with open(plan_path) as f:
+        plan = json.load(f)
+    assert plan["options"]["native"] is True
+    assert plan["options"]["flac-level"] == 8
+    assert plan["takes"][0]["outputs"][0]["format"] == "pcm_f32le"
+    assert outpath.format(scene="Synthetic", take=1, tracknumber=1) + ".wav" in [o["destination"] for t in plan["takes"] for o in t["outputs"]]
+
+    # The shards don't overlap and together split the whole plan
+    written = []
+    for shard in ["1/2", "2/2"]:
+        result = runner.invoke(main, ["--execute", plan_path, "--shard", shard])
+        if result.exception:
+            traceback.print_exception(*result.exc_info)
+        assert result.exit_code == 0
+        written += re.findall(r"-> (.+\.wav)", result.output)
+    assert sorted(written) == sorted(o["destination"] for t in plan["takes"] for o in t["outputs"])
+    assert all(os.path.isfile(p) for p in written)
+
+    result = runner.invoke(main, ["--execute", plan_path, str(input_directory)])
+    assert "Error:" in result.output
+    result = runner.invoke(main, ["--execute", plan_path, "--shard", "3/2"])
+    assert "Error:" in result.output
+
+    # Only the sources of the shard have to exist (the longest take is in the first shard)
+    os.remove(str(input_directory / "T3.WAV"))
+    result = runner.invoke(main, ["--execute", plan_path, "--shard", "2/2"])
+    assert result.exit_code == 0
+    result = runner.invoke(main, ["--execute", plan_path, "--shard", "1/2"])
+    assert "T3.WAV of the plan doesn't exist" in result.output
+
+    # The options of the plan are checked like the ones of a normal run
+    monkeypatch.setattr("mixpresplit.wav.numpy_available", lambda: False)
+    result = runner.invoke(main, ["--execute", plan_path, "--shard", "2/2"])
+    assert "need numpy" in result.output
+
+
+def test_io_scheduler(tmp_path):
+    """
+    Test if the scheduler keeps to the number of files read at the same time per device
+    """
+    import time
+    import threading
+    import concurrent.futures
+    from mixpresplit.scheduler import IOScheduler
+    sources = []
+    for n in range(3):
+        sources.append(str(tmp_path / "{}.wav".format(n)))
+        with open(sources[-1], "wb") as f:
+            f.write(b"RIFF")
+
+    lock = threading.Lock()
+    reading = []
+    overlaps = []
+
+    def unit(source):
+        with lock:
+            reading.append(source)
+            overlaps.append(set(reading))
+        time.sleep(0.05)
+        with lock:
+            reading.remove(source)
+        return source
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        scheduler = IOScheduler(executor, 4, readers_per_device=1, writers_per_device=4)
+        # Two units (tracks) per source, they may share the reader slot
+        futures = [scheduler.submit(unit, source, [source], [str(tmp_path / "out" / "x.wav")]) for source in sources for _ in range(2)]
+        assert [f.result() for f in futures] == [s for s in sources for _ in range(2)]
+        scheduler.close()
+
+    # Never two different sources at the same time
+    assert all(len(sources_read) == 1 for sources_read in overlaps)
+    assert any("reading from" in line for line in scheduler.report())
+
+
+def test_flac_encoders(tmp_path):
+    """
+    Test if the channels of a single decode are fed to the encoders (a copy command stands in for ffmpeg)
+    """
+    np = pytest.importorskip("numpy")
+    import sys
+    import subprocess
+    from mixpresplit import flac
+    from tests.polywav import write_polywav
+    data = (np.arange(3000 * 4, dtype="<f4") % 4).tobytes()
+    path = write_polywav(str(tmp_path / "T1.WAV"), channels=4, frames=3000, data=data)
+    copy = [sys.executable, "-c", "import sys, shutil; shutil.copyfileobj(sys.stdin.buffer, open(sys.argv[1], 'wb'))"]
+
+    encoders = [(channel, str(tmp_path / "{}.raw".format(channel)), copy + [str(tmp_path / "{}.raw".format(channel))]) for channel in [0, 2, 3]]
+    speeds = flac.encode_flac(path, "pcm_f32le", encoders, 2, block_frames=1000)
+    assert sorted(speeds.keys()) == sorted(outpath for _, outpath, _ in encoders)
+    for channel, outpath, _ in encoders:
+        with open(outpath, "rb") as f:
+            assert np.frombuffer(f.read(), dtype="<f4").tolist() == [float(channel)] * 3000
+
+    with pytest.raises(subprocess.CalledProcessError):
+        flac.encode_flac(path, "pcm_f32le", [(0, "x", [sys.executable, "-c", "import sys; sys.exit(3)"])], 2)
+    # The encoders that already run don't hide why the batch failed
+    with pytest.raises(FileNotFoundError):
+        flac.encode_flac(path, "pcm_f32le", [(0, "x", [sys.executable, "-c", "import sys; sys.exit(3)"]), (1, "y", [str(tmp_path / "missing-encoder")])], 2)
+
+    meta = read_metadata(path)
+    options = make_options(flac=True, bit24=True, flac_level=8, flac_block_size=4608)
+    cmd = flac_encoder_command(meta, "out.flac", options)
+    assert cmd[:10] == ["ffmpeg", "-i", path, "-f", "f32le", "-ar", "48000", "-ac", "1", "-i"]
+    assert ["-compression_level", "8", "-frame_size", "4608"] == cmd[cmd.index("-compression_level"):cmd.index("-compression_level") + 4]
+    assert cmd[-1] == "-n"
+
+
+def test_skip_silent(runner, tmp_path):
+    """
+    Test if tracks below the silence threshold are measured and skipped
+    """
+    np = pytest.importorskip("numpy")
+    from mixpresplit import wav
+    from tests.polywav import write_polywav
+    input_directory = tmp_path / "in"
+    input_directory.mkdir()
+    samples = np.zeros((20000, 4), dtype="<f4")
+    samples[:, 0] = 0.5
+    samples[100, 2] = 0.01
+    samples[:, 3] = 1e-4
+    path = write_polywav(str(input_directory / "T1.WAV"), channels=4, frames=20000, data=samples.tobytes())
+
+    levels = wav.channel_levels(path, "pcm_f32le", block_frames=7000)
+    assert levels[0] == (0.5, 0.5)
+    assert levels[1] == (0.0, 0.0)
+    assert levels[2][0] == pytest.approx(0.01)
+    assert wav.decibels(levels[0][0]) == pytest.approx(-6.02, abs=0.01)
+    assert wav.decibels(levels[1][0]) == float("-inf")
+
+    # Dry runs don't read the audio, all tracks are listed
+    result = runner.invoke(main, ["--dry-run", "--skip-silent", str(input_directory), str(tmp_path / "{tracknumber}")])
+    assert result.exit_code == 0
+    assert re.findall(r"\[(\d)\] ->", result.output) == ["0", "1", "2", "3"]
+
+    # Track 2 at -40 dBFS is kept, the empty track and the one at -80 dBFS are not written
+    result = runner.invoke(main, ["--native", "--skip-silent", str(input_directory), str(tmp_path / "a" / "{tracknumber}")])
+    assert result.exit_code == 0
+    assert re.findall(r"\[(\d)\] -> \S+ \(Silent, not written\)", result.output) == ["1", "3"]
+    assert [f for f in sorted(os.listdir(str(tmp_path / "a"))) if f.endswith(".wav")] == ["1.wav", "9.wav"]
+
+    result = runner.invoke(main, ["--native", "--jobs", "2", "--skip-silent", "--silence-threshold", "-30", str(input_directory), str(tmp_path / "b" / "{tracknumber}")])
+    assert result.exit_code == 0
+    assert [f for f in sorted(os.listdir(str(tmp_path / "b"))) if f.endswith(".wav")] == ["9.wav"]
+
+
+def test_stats(runner, tmp_path):
+    """
+    Test if --stats writes the levels and the waveform next to each track
+    """
+    np = pytest.importorskip("numpy")
+    from mixpresplit import stats
+    from tests.polywav import write_polywav
+    input_directory = tmp_path / "in"
+    input_directory.mkdir()
+    samples = np.zeros((48000, 4), dtype="<f4")
+    samples[:, 0] = 0.5
+    samples[:1000, 0] = -1.0
+    path = write_polywav(str(input_directory / "T1.WAV"), channels=4, frames=48000, data=samples.tobytes())
+
+    result = runner.invoke(main, ["--native", "--stats", str(input_directory), str(tmp_path / "{tracknumber}")])
+    assert result.exit_code == 0
+
+    with open(str(tmp_path / "9.wav.json"), "r", encoding="utf-8") as f:
+        values = json.load(f)
+    # The first channel is the left mix track
+    assert values["frames"] == 48000
+    assert values["peak_dbfs"] == 0.0
+    assert values["waveform"] == "9.wav.dat"
+    # Mostly 0.5, the loud first 1000 frames raise it a little
+    assert -6.8 < values["loudness"] < -6.0
+
+    with open(str(tmp_path / "10.wav.json"), "r", encoding="utf-8") as f:
+        values = json.load(f)
+    assert values["peak_dbfs"] is None and values["loudness"] is None
+
+    with open(str(tmp_path / "9.wav.dat"), "rb") as f:
+        data = f.read()
+    version, flags, samplerate, samples_per_pixel, length = struct.unpack("<iIiiI", data[:20])
+    assert (version, flags, samplerate, samples_per_pixel) == (1, 1, 48000, stats.SAMPLES_PER_PIXEL)
+    assert length == -(-48000 // stats.SAMPLES_PER_PIXEL)
+    pairs = np.frombuffer(data[20:], dtype=np.int8).reshape(-1, 2)
+    assert len(pairs) == length
+    assert tuple(pairs[0]) == (-127, -127) and tuple(pairs[-1]) == (64, 64)
+
+    # Measuring while splitting gives the same as measuring the source afterwards
+    stats.measure_outputs(path, "pcm_f32le", [(0, str(tmp_path / "again"))], block_frames=7000)
+    with open(str(tmp_path / "again.dat"), "rb") as f:
+        assert f.read() == data
+
+
+def test_checksums_verify(runner, tmp_path):
+    """
+    Test if --checksums stores the checksums in the manifest and --verify
+    finds outputs that were changed afterwards
+    """
+    pytest.importorskip("numpy")
+    import hashlib
+    from mixpresplit import wav
+    from mixpresplit.manifest import Manifest
+    result = runner.invoke(main, ["--native", "--checksums", "--takes", "1", "./testsamples/channeltests", str(tmp_path / "{tracknumber}")])
+    assert result.exit_code == 0
+
+    records = list(Manifest(str(tmp_path)).records.values())
+    assert len(records) == 10
+    with open(records[0]["output"], "rb") as f:
+        chunks = wav.read_chunks(f)
+        assert records[0]["md5"] == hashlib.md5(wav.read_chunk(f, chunks, b"data")).hexdigest()
+    with open("./testsamples/channeltests/Testsample-001.WAV", "rb") as f:
+        chunks = wav.read_chunks(f)
+        assert records[0]["source_md5"] == hashlib.md5(wav.read_chunk(f, chunks, b"data")).hexdigest()
+
+    result = runner.invoke(main, ["--verify", str(tmp_path)])
+    assert result.exit_code == 0
+    assert result.output.count("(OK)") == 10
+    assert "10 of 10 output(s) verified, 0 failed" in result.output
+
+    # Flip a sample of one output
+    changed = records[3]["output"]
+    with open(changed, "r+b") as f:
+        offset, _ = wav.read_chunks(f)[b"data"]
+        f.seek(offset + 100)
+        value = f.read(1)
+        f.seek(offset + 100)
+        f.write(bytes([value[0] ^ 0xFF]))
+
+    result = runner.invoke(main, ["--verify", str(tmp_path), "--jobs", "2"])
+    assert result.exit_code == 1
+    assert "{} (Failed: doesn't match its checksum)".format(changed) in result.output
+    assert "9 of 10 output(s) verified, 1 failed" in result.output
+
+    # Even with a matching checksum the samples have to match the source channel
+    from mixpresplit import verify
+    record = dict(records[3], md5=verify.hash_payload(changed))
+    assert verify.verify_take([record]) == [(changed, "differs from channel {} of the source".format(record["channel"]))]
+
+
+def test_preflight(runner, tmp_path, monkeypatch):
+    """
+    Test if the space the outputs need is computed and a split that doesn't
+    fit is refused before anything is written
+    """
+    import shutil
+    from mixpresplit import preflight
+    meta = read_metadata("./testsamples/channeltests/Testsample-001.WAV")
+    outputs = [(channel, str(tmp_path / "{}.wav".format(channel))) for channel in meta.tracks.keys()]
+    options = make_options()
+    sizes = output_sizes([(meta, outputs)], options)
+    assert len(sizes) == len(outputs)
+    assert sizes[0][1] == preflight.wav_bytes(meta.samplecount, 32) and not sizes[0][2]
+    # The data chunk is padded to an even size
+    assert preflight.wav_bytes(3, 24) == 4096 + 10
+
+    flac_sizes = output_sizes([(meta, outputs)], dict(options, flac=True))
+    assert flac_sizes[0][2] and flac_sizes[0][1] < sizes[0][1]
+
+    # Pretend the destination is almost full
+    usage = shutil.disk_usage(str(tmp_path))
+    monkeypatch.setattr(preflight.shutil, "disk_usage", lambda path: usage._replace(free=1000))
+    result = runner.invoke(main, ["--native", "--takes", "1", "./testsamples/channeltests", str(tmp_path / "out" / "{tracknumber}")])
+    assert "Error:    Not enough space on {}".format(tmp_path) in result.output
+    assert not os.path.exists(str(tmp_path / "out"))
+
+    result = runner.invoke(main, ["--native", "--no-preflight", "--takes", "1", "./testsamples/channeltests", str(tmp_path / "out" / "{tracknumber}")])
+    assert result.exit_code == 0
+    assert len([n for n in os.listdir(str(tmp_path / "out")) if n.endswith(".wav")]) == len(outputs)
+
+    history = preflight.ThroughputHistory(str(tmp_path / "throughput.json"))
+    history.record("native/j1", 10 * 10**6, 2.0).record("native/j1", 20 * 10**6, 2.0)
+    assert preflight.ThroughputHistory(str(tmp_path / "throughput.json")).get("native/j1") == 7.5 * 10**6
+
+
+def test_events_summary(runner, tmp_path):
+    """
+    Test if --events logs the phases of a run as JSON lines and --summary
+    prints the slowest takes
+    """
+    pytest.importorskip("numpy")
+    events_path = str(tmp_path / "events.jsonl")
+    result = runner.invoke(main, ["--native", "--jobs", "2", "--takes", "1-3", "--events", events_path, "--summary", "./testsamples/channeltests", str(tmp_path / "out" / "{take}-{tracknumber}")])
+    if result.exception:
+        traceback.print_exception(*result.exc_info)
+    assert result.exit_code == 0
+
+    with open(events_path, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f]
+    phases = [(e["event"], e.get("phase")) for e in events]
+    assert phases[:2] == [("done", "scan"), ("done", "plan")]
+    assert phases[-1] == ("done", "split")
+    assert phases.count(("start", "write")) == phases.count(("done", "write")) == 3
+    # Every unit reports that it finished
+    finished = [e for e in events if e["event"] == "progress" and e["fraction"] == 1.0]
+    assert len(finished) == 3
+    done = [e for e in events if e["event"] == "done" and e["phase"] == "write"]
+    assert all(e["bytes"] > 0 and e["realtime"] > 0 and e["outputs"] for e in done)
+
+    assert "Slowest takes:" in result.output
+    assert result.output.count("Testsample-00") >= 3
+
+    # Takes of different folders with the same filename are listed apart
+    log = progress.EventLog()
+    log.unit_done("write", "T1.WAV", ["a/1.wav"], 2.0, 0, 1.0, source=os.path.join("a", "T1.WAV"))
+    log.unit_done("write", "T1.WAV", ["b/1.wav"], 1.0, 0, 1.0, source=os.path.join("b", "T1.WAV"))
+    lines = progress.summary_lines(log)
+    assert lines[2].endswith(os.path.join("a", "T1.WAV")) and "2.00" in lines[2]
+    assert lines[3].endswith(os.path.join("b", "T1.WAV")) and "1.00" in lines[3]
+
+
+def test_api(tmp_path, monkeypatch):
+    """
+    Test the Python API and the asyncio splitter
+    """
+    pytest.importorskip("numpy")
+    import asyncio
+    from mixpresplit import api
+    options = api.make_options(native=True, takes="1-2", bit24=False, cache=False)
+    assert options["takes"] == "1-2" and options["24"] is False
+    with pytest.raises(TypeError):
+        api.make_options(colour=True)
+    with pytest.raises(api.OptionsError) as e:
+        api.plan([], str(tmp_path / "{nonsense}"), options)
+    assert "nonsense" in str(e.value) and e.value.solution
+
+    # The options of the command line tool and the API are the same
+    from mixpresplit import cli
+    seen = []
+    split_takes = cli.split_takes
+    monkeypatch.setattr(cli, "split_takes", lambda takes, options, *args: seen.append(options) or [])
+    result = CliRunner().invoke(main, ["--dry-run", "--takes", "1", "./testsamples/channeltests", str(tmp_path / "dry" / "{tracknumber}")])
+    assert result.exit_code == 0
+    assert set(seen[0].keys()) == set(api.DEFAULT_OPTIONS.keys())
+    monkeypatch.setattr(cli, "split_takes", split_takes)
+
+    results = api.run(["./testsamples/channeltests"], str(tmp_path / "sync" / "{take}-{tracknumber}"), native=True, takes="1-2")
+    assert [r.meta.take for r in results] == [1, 2]
+    assert all(r.ok for r in results)
+    assert {o.status for r in results for o in r.outputs} == {"written"}
+    assert all(os.path.isfile(o.path) for r in results for o in r.outputs)
+    # A second run finds everything up to date
+    results = api.run(["./testsamples/channeltests"], str(tmp_path / "sync" / "{take}-{tracknumber}"), native=True, takes="1-2")
+    assert {o.status for r in results for o in r.outputs} == {"up-to-date"}
+
+    async def split_card(outpath):
+        async with api.AsyncSplitter(options, concurrency=2) as splitter:
+            return await splitter.run(["./testsamples/channeltests"], outpath)
+
+    results = asyncio.run(split_card(str(tmp_path / "async" / "{take}-{tracknumber}")))
+    assert [r.to_dict()["number"] for r in results] == [1, 2]
+    # A splitter can be created before the loop that runs it
+    splitter = api.AsyncSplitter(options, concurrency=2)
+    results = asyncio.run(splitter.run(["./testsamples/channeltests"], str(tmp_path / "early" / "{take}-{tracknumber}")))
+    splitter.close()
+    assert all(r.ok for r in results)
+    assert sorted(os.listdir(str(tmp_path / "async"))) == sorted(os.listdir(str(tmp_path / "sync")))
+
+    # Failures come back as a SplitError of the take
+    results = asyncio.run(split_card(str(tmp_path / "sync" / "{take}-{tracknumber}")))
+    assert all(r.ok for r in results)
+    rewrite = dict(options, rewrite=True)
+    async def split_again():
+        async with api.AsyncSplitter(rewrite) as splitter:
+            takes = api.plan(api.select(api.scan(["./testsamples/channeltests"], rewrite), rewrite), str(tmp_path / "async" / "{take}-{tracknumber}"), rewrite)
+            return await splitter.split_all(takes)
+    results = asyncio.run(split_again())
+    assert not results[0].ok and isinstance(results[0].error, api.SplitError)
+    assert isinstance(results[0].error.cause, FileExistsError)
+    with pytest.raises(api.SplitError):
+        results[0].raise_error()
+
+
+def test_startup_imports():
+    """
+    Test if importing the CLI leaves out the modules only some runs need
+    """
+    import sys
+    import subprocess
+    from benchmarks.startup import HEAVY_MODULES
+    code = "import sys, mixpresplit.cli; print(' '.join(m for m in {!r} if m in sys.modules))".format(HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    assert result.stdout.split() == []
+
+
+def test_batch(runner, tmp_path):
+    """
+    Test if the jobs of a batch file run in one call and a failed job doesn't stop the others
+    """
+    from tests.polywav import write_polywav
+    input_directory = tmp_path / "in"
+    input_directory.mkdir()
+    for take in range(1, 3):
+        write_polywav(str(input_directory / "T{}.WAV".format(take)), channels=4, frames=1000, take=take)
+    batch_path = str(tmp_path / "jobs.txt")
+    with open(batch_path, "w") as f:
+        f.write("# One job per take\n\n")
+        for take in range(1, 3):
+            f.write("'{}' '{}' --native --takes {} --tracks 1\n".format(input_directory, tmp_path / "out {}".format(take) / "{take}-{tracknumber}", take))
+        f.write("'{}' '{}' --tacks 1\n".format(input_directory, tmp_path / "out"))
+        # A missing card raises inside the job
+        f.write("/nonexistent/card '{}'\n".format(tmp_path / "out"))
+        f.write("'{}' '{}' --native --takes 1 --tracks 2\n".format(input_directory, tmp_path / "out 3" / "{take}-{tracknumber}"))
+
+    result = runner.invoke(main, ["--batch", batch_path])
+    if result.exception and not isinstance(result.exception, SystemExit):
+        traceback.print_exception(*result.exc_info)
+    assert result.exit_code == 1
+    assert "=== Job [5/5]" in result.output
+    assert "3 of 5 job(s) done, 2 failed" in result.output
+    assert "Failed jobs in lines: 5, 6" in result.output
+    assert "    Line 6: FileNotFoundError:" in result.output
+    assert os.path.exists(str(tmp_path / "out 3" / "1-2.wav"))
+    for take in range(1, 3):
+        assert [n for n in os.listdir(str(tmp_path / "out {}".format(take))) if n.endswith(".wav")] == ["{}-1.wav".format(take)]
+
+    result = runner.invoke(main, ["--batch", batch_path, str(input_directory)])
+    assert "Error:" in result.output
+
+
+def test_take_table():
+    """
+    Test if the columnar table selects the same takes as the filters and gives back the same metadata
+    """
+    from mixpresplit.table import TakeTable
+    from mixpresplit.filters import compile_filter
+    metas = read_metadatas(sorted(get_wavs_files("./testsamples/channeltests")))
+    assert not hasattr(metas[0], "__dict__")
+    assert metas[0].tracks[1]["trackname"] == metas[0].tracks[1].trackname
+    assert metas[0].scene is metas[1].scene
+
+    table = TakeTable.from_metas(metas)
+    assert len(table) == len(metas)
+    assert [m.to_dict() for m in table.metadatas()] == [m.to_dict() for m in metas]
+
+    options = {"takes": "1-5,!3", "tracks": "mixdown"}
+    rows = table.rows(compile_filter(options["takes"]), circled=False)
+    assert [m.filepath for m in table.metadatas(rows)] == [m.filepath for m in filter_takes(metas, options) if not m.circled]
+    rows = table.rows(track_filter=compile_filter(options["tracks"]))
+    assert [table.filepath(row) for row in rows] == [m.filepath for m in metas if any(filter_tracks(t, options) for t in m.tracks.values())]
+    assert table.rows(last_date="2000-01-01") == []
+    assert table.rows(first_date=metas[0].datestring, last_date=metas[0].datestring) == [row for row, m in enumerate(metas) if m.datestring == metas[0].datestring]
+
+
+def test_catalogue(runner, tmp_path):
+    """
+    Test if the catalogue is updated incrementally and selects the takes across cards by query
+    """
+    from mixpresplit.catalogue import Catalogue
+    from tests.polywav import write_polywav
+    cards = [tmp_path / "card1", tmp_path / "card2"]
+    for n, card in enumerate(cards):
+        card.mkdir()
+        write_polywav(str(card / "A.WAV"), channels=4, frames=100, scene="Forest", take=1, tape="CARD{}".format(n), date="2020-06-0{}".format(n + 1), circled=n == 1)
+        write_polywav(str(card / "B.WAV"), channels=4, frames=100, scene="Beach", take=2, tape="CARD{}".format(n), date="2020-06-0{}".format(n + 1), tracknames=["MixL", "MixR", "Boom", "Lav"])
+    outpath = str(tmp_path / "out" / "{tape}-{scene}-{take}-{tracknumber}")
+
+    result = runner.invoke(main, ["--catalogue", "--dry-run", str(cards[0]), str(cards[1]), outpath])
+    assert result.exit_code == 0
+    assert "(2 file(s) added, 0 updated, 0 removed)" in result.output
+    assert "Catalogue: 4 file(s) of 4 match" in result.output
+
+    # Without INPATHS the query runs across everything in the catalogue
+    result = runner.invoke(main, ["--catalogue", "--dry-run", "--scene", "Forest", "--only-circled", outpath])
+    assert result.exit_code == 0
+    assert set(re.findall(r"-> .+/(CARD\d-\w+)-\d-\d+\.wav", result.output)) == {"CARD1-Forest"}
+    result = runner.invoke(main, ["--catalogue", "--dry-run", "--track-name", "Boom", "--since", "2020-06-02", outpath])
+    assert set(re.findall(r"-> .+/(CARD\d-\w+)-\d-\d+\.wav", result.output)) == {"CARD1-Beach"}
+
+    # Only changed files are read again, removed files are dropped
+    os.remove(str(cards[0] / "B.WAV"))
+    write_polywav(str(cards[0] / "A.WAV"), channels=4, frames=200, scene="Forest", take=3, tape="CARD0", date="2020-06-01")
+    os.utime(str(cards[0] / "A.WAV"), ns=(1, 1))
+    result = runner.invoke(main, ["--catalogue", "--dry-run", str(cards[0]), outpath])
+    assert "(0 file(s) added, 1 updated, 1 removed)" in result.output
+    with Catalogue() as catalogue:
+        assert len(catalogue) == 3
+        assert [m.take for m in catalogue.query(tape="CARD0")] == [3]
+        assert [m.filepath for m in catalogue.query(until="2020-06-01")] == [os.path.abspath(str(cards[0] / "A.WAV"))]
+
+    # Takes of cards that aren't mounted are skipped
+    shutil.move(str(cards[1]), str(tmp_path / "archived"))
+    result = runner.invoke(main, ["--catalogue", "--dry-run", outpath])
+    assert "Skipping 2 file(s) that are not reachable" in result.output
+
+    result = runner.invoke(main, ["--scene", "Forest", str(cards[0]), outpath])
+    assert "Error:" in result.output and "--catalogue" in result.output
+    result = runner.invoke(main, ["--catalogue", "--since", "June", str(cards[0]), outpath])
+    assert "Error:" in result.output and "YYYY-MM-DD" in result.output
+
+
+def test_discover(runner, tmp_path):
+    """
+    Test if the wav files are found in nested folders, once each, without the junk and the outputs of earlier splits
+    """
+    from mixpresplit.discover import discover
+    from mixpresplit.manifest import MANIFEST_NAME
+    from tests.polywav import write_polywav
+    card = tmp_path / "card"
+    for folder in ["Project/Day 1", ".Trashes/501", "Backup", "split"]:
+        (card / folder).mkdir(parents=True)
+    takes = [str(card / "T1.WAV"), str(card / "Project" / "T2.wav"), str(card / "Project" / "Day 1" / "T3.WAV")]
+    for n, path in enumerate(takes):
+        write_polywav(path, channels=4, frames=100, take=n + 1)
+    write_polywav(str(card / ".Trashes" / "501" / "T4.WAV"), channels=4, frames=100, take=4)
+    write_polywav(str(card / "Backup" / "T5.WAV"), channels=4, frames=100, take=5)
+    write_polywav(str(card / "split" / "T6.WAV"), channels=4, frames=100, take=6)
+    (card / "split" / MANIFEST_NAME).write_text("")
+    (card / "._T1.WAV").write_bytes(b"\x00\x05\x16\x07" + bytes(100))
+    os.link(takes[0], str(card / "Project" / "T1 copy.WAV"))
+    os.symlink(str(card), str(card / "Project" / "loop"))
+
+    assert sorted(discover([str(card), str(card / "Project")], ignore=["Backup*", ".Trash*", "._*"])) == sorted(takes)
+    assert sorted(discover([str(card)], recursive=False)) == [takes[0]]
+
+    outpath = str(tmp_path / "out" / "{take}-{tracknumber}")
+    result = runner.invoke(main, ["--dry-run", "--no-cache", "--ignore", "Backup*", str(card), outpath])
+    assert result.exit_code == 0
+    assert "Processing 3 take(s)" in result.output
+    result = runner.invoke(main, ["--dry-run", "--no-cache", "--flat", str(card), outpath])
+    assert "Processing 1 take(s)" in result.output